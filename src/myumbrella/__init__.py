@@ -1,13 +1,28 @@
 """Main package for myapp."""
-import warnings
-from importlib.metadata import PackageNotFoundError, version
+from functools import cache
 
 APP_NAME = "MyUmbrella"
-try:
-    __version__ = version(APP_NAME.lower())
-except PackageNotFoundError:  # pragma: nocover; just a fail safe
-    warnings.warn(
-        f"Could not find package for {APP_NAME}. Development environment is assumed"
-    )
-    __version__ = "0.0.0-dev"
-APP_VERSION = __version__
+
+
+@cache
+def get_app_version() -> str:
+    """Return the version of the application (looked up once, when first needed)."""
+    # Querying the package metadata is slow: only do it when the version is needed
+    # pylint: disable=import-outside-toplevel
+    import warnings
+    from importlib.metadata import PackageNotFoundError, version
+
+    try:
+        return version(APP_NAME.lower())
+    except PackageNotFoundError:  # pragma: nocover; just a fail safe
+        warnings.warn(
+            f"Could not find package for {APP_NAME}. Development environment is assumed"
+        )
+        return "0.0.0-dev"
+
+
+def __getattr__(name: str) -> str:
+    """Resolve the version attributes lazily."""
+    if name in ("__version__", "APP_VERSION"):
+        return get_app_version()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
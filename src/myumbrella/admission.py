@@ -0,0 +1,166 @@
+"""Module for the admission control of the requests (i.e. load shedding)."""
+import asyncio
+import contextlib
+import json
+import time
+from collections import deque
+from typing import Callable, Collection
+
+from starlette.types import ASGIApp, Receive, Scope, Send
+
+from .metrics import MetricsRegistry, metrics
+
+# Constants
+DEFAULT_MAX_IN_FLIGHT = 64
+DEFAULT_QUEUE_TIMEOUT = 1.0
+DEFAULT_MAX_LOOP_LAG = 0.5
+DEFAULT_LOOP_LAG_INTERVAL = 0.1
+DEFAULT_RETRY_AFTER = 1
+DEFAULT_EXEMPT_PATHS = ("/", "/metrics", "/debug/profile", "/debug/allocations")
+
+
+class LoopLagMonitor:
+    """Measure how late the event loop runs a task scheduled at a fixed interval.
+
+    A lag that keeps growing means that the loop is saturated (or blocked): the new
+    requests would wait behind the current ones anyway. The time of the last run of the
+    task (i.e. the heartbeat of the loop) is kept in last_beat.
+    """
+
+    def __init__(
+        self,
+        interval: float = DEFAULT_LOOP_LAG_INTERVAL,
+        registry: MetricsRegistry = metrics,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """Initialize a monitor that is not started yet."""
+        self.interval = interval
+        self.lag = 0.0
+        self.last_beat = 0.0
+        self.clock = clock
+        self._registry = registry
+        self._task: asyncio.Task[None] | None = None
+
+    async def _run(self) -> None:
+        while True:
+            scheduled_at = self.last_beat = self.clock()
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, self.clock() - scheduled_at - self.interval)
+            self._registry.observe("eventloop.lag", self.lag)
+
+    async def start(self) -> None:
+        """Start monitoring the running event loop."""
+        if self._task is None:
+            self.last_beat = self.clock()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop monitoring."""
+        if self._task is not None:
+            self._task.cancel()
+            with contextlib.suppress(asyncio.CancelledError):
+                await self._task
+            self._task = None
+        self.lag = 0.0
+
+
+class AdmissionControlMiddleware:
+    """ASGI middleware that sheds the requests the worker cannot serve in time.
+
+    At most max_in_flight requests are processed at once, the next ones wait for a
+    slot for at most queue_timeout seconds. Requests are rejected straight away with
+    a 503 (and a Retry-After header) when they would wait longer or when the event
+    loop lags by more than max_loop_lag seconds. Exempt paths are never shed.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        app: ASGIApp,
+        max_in_flight: int = DEFAULT_MAX_IN_FLIGHT,
+        queue_timeout: float = DEFAULT_QUEUE_TIMEOUT,
+        max_loop_lag: float = DEFAULT_MAX_LOOP_LAG,
+        lag_monitor: LoopLagMonitor | None = None,
+        exempt_paths: Collection[str] = DEFAULT_EXEMPT_PATHS,
+        retry_after: int = DEFAULT_RETRY_AFTER,
+        registry: MetricsRegistry = metrics,
+    ) -> None:
+        """Initialize the middleware around an ASGI application."""
+        self.app = app
+        self.max_in_flight = max_in_flight
+        self.queue_timeout = queue_timeout
+        self.max_loop_lag = max_loop_lag
+        self.lag_monitor = lag_monitor
+        self.exempt_paths = frozenset(exempt_paths)
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self._registry = registry
+        self._waiters: deque[asyncio.Future[None]] = deque()
+
+    async def _acquire(self) -> bool:
+        if self.in_flight < self.max_in_flight:
+            self.in_flight += 1
+            return True
+        if self.queue_timeout <= 0:
+            return False
+
+        # The slot of a finishing request is handed over to the first waiter
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=self.queue_timeout)
+        except asyncio.TimeoutError:
+            if waiter.done():
+                return True
+            waiter.cancel()
+            return False
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self._release()
+            waiter.cancel()
+            raise
+        return True
+
+    def _release(self) -> None:
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+        self.in_flight -= 1
+
+    async def _shed(self, send: Send, reason: str) -> None:
+        self._registry.increment(f"admission.shed.{reason}")
+        body = json.dumps({"detail": "Service overloaded, retry later"}).encode()
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 503,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"retry-after", str(self.retry_after).encode()),
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        """Admit, queue or shed a request."""
+        if scope["type"] != "http" or scope["path"] in self.exempt_paths:
+            await self.app(scope, receive, send)
+            return
+
+        if self.lag_monitor is not None and self.lag_monitor.lag > self.max_loop_lag:
+            await self._shed(send, reason="lag")
+            return
+
+        queued_at = time.monotonic()
+        if not await self._acquire():
+            await self._shed(send, reason="queue")
+            return
+        self._registry.observe("admission.queue_time", time.monotonic() - queued_at)
+
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self._release()
@@ -0,0 +1,125 @@
+"""Module for the pool of Openweather API keys that the calls are spread across."""
+import logging
+import os
+import threading
+import time
+from dataclasses import dataclass
+from typing import Callable, Sequence
+
+from .metrics import MetricsRegistry, metrics
+from .providers import RateLimitExceededException
+
+logger = logging.getLogger(__name__)
+
+# Constants
+DEFAULT_KEY_COOLDOWN = 60.0
+DEFAULT_INVALID_KEY_COOLDOWN = 3600.0
+_QUOTA_PERIOD = 60.0
+_UNAUTHORIZED = 401
+
+
+class APIKeysExhaustedException(RateLimitExceededException):
+    """Exception raised when every API key is out of quota or rotated out."""
+
+
+@dataclass()
+class _APIKeyState:
+    key: str
+    calls: int = 0
+    window_start: float = 0.0
+    rotated_out_until: float = 0.0
+
+
+def _mask(key: str) -> str:
+    return f"...{key[-4:]}"
+
+
+class APIKeyPool:
+    """Thread-safe pool of API keys, with an optional quota of calls per minute per key.
+
+    Calls are balanced on the key that made the fewest calls in the current minute. A
+    key rejected by Openweather is rotated out for a while: a rate-limited key (429)
+    for `cooldown` seconds, an invalid one (401) for `invalid_key_cooldown` seconds,
+    unless it is the last available key (a single 401 must not cause a long outage).
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        keys: Sequence[str],
+        quota_per_minute: int | None = None,
+        cooldown: float = DEFAULT_KEY_COOLDOWN,
+        invalid_key_cooldown: float = DEFAULT_INVALID_KEY_COOLDOWN,
+        registry: MetricsRegistry = metrics,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """Initialize a pool of keys (without quota if quota_per_minute is None)."""
+        if not keys:
+            raise ValueError("An API key pool needs at least one key")
+
+        self.quota_per_minute = quota_per_minute
+        self.cooldown = cooldown
+        self.invalid_key_cooldown = invalid_key_cooldown
+        self._registry = registry
+        self._clock = clock
+        self._states = {key: _APIKeyState(key=key) for key in dict.fromkeys(keys)}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Return the number of keys in the pool."""
+        return len(self._states)
+
+    def _is_available(self, state: _APIKeyState, now: float) -> bool:
+        if state.rotated_out_until > now:
+            return False
+        if now - state.window_start >= _QUOTA_PERIOD:
+            state.calls = 0
+            state.window_start = now
+        return self.quota_per_minute is None or state.calls < self.quota_per_minute
+
+    def acquire(self) -> str:
+        """Return the key to use for a call, counting the call in its quota."""
+        with self._lock:
+            now = self._clock()
+            available = [
+                state
+                for state in self._states.values()
+                if self._is_available(state, now)
+            ]
+            if not available:
+                raise APIKeysExhaustedException(
+                    f"All the {len(self)} Openweather API keys are out of quota "
+                    "or rotated out"
+                )
+
+            state = min(available, key=lambda state: state.calls)
+            state.calls += 1
+            return state.key
+
+    def reject(self, key: str, status_code: int) -> None:
+        """Rotate a key out after Openweather rejected it with a status code."""
+        with self._lock:
+            now = self._clock()
+            others_available = any(
+                self._is_available(state, now)
+                for state in self._states.values()
+                if state.key != key
+            )
+            cooldown = (
+                self.invalid_key_cooldown
+                if status_code == _UNAUTHORIZED and others_available
+                else self.cooldown
+            )
+            self._states[key].rotated_out_until = now + cooldown
+        self._registry.increment("openweather.keys.rejected")
+        logger.warning(
+            "Openweather API key %s rejected (%i): rotated out for %gs",
+            _mask(key),
+            status_code,
+            cooldown,
+        )
+
+
+def load_key_quota_from_env_variable() -> int | None:
+    """Return the quota of calls per minute per API key (None if not configured)."""
+    quota = os.environ.get("OPENWEATHER_API_KEY_QUOTA_PER_MINUTE")
+    return None if quota is None else int(quota)
@@ -3,17 +3,19 @@ import logging
 
 from fastapi import FastAPI
 
-from . import APP_NAME, APP_VERSION
+from . import APP_NAME
+from .routers.debug import router as router_debug
 from .routers.default import router as router_default
 from .routers.umbrella import router as router_umbrella
 
 logger = logging.getLogger(__name__)
 
+# The version is only set once the application is set up (see main.setup_application)
 app = FastAPI(
     description="The API app that tells you if you need your umbrella!",
-    version=APP_VERSION,
     title=APP_NAME,
 )
 
 app.include_router(router=router_default)
 app.include_router(router=router_umbrella)
+app.include_router(router=router_debug)
@@ -0,0 +1,310 @@
+"""Command line tool computing the umbrella reports of many cities (e.g. nightly jobs).
+
+Usage: python -m myumbrella.bulk cities.csv --output reports.ndjson --format ndjson
+"""
+import argparse
+import asyncio
+import contextlib
+import csv
+import io
+import itertools
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import asdict, dataclass
+from typing import BinaryIO, Iterable, Iterator, Sequence, TextIO
+
+from .apikeys import APIKeysExhaustedException
+from .core import UmbrellaReportProvider
+from .providers import RateLimitExceededException
+
+logger = logging.getLogger(__name__)
+
+# Constants
+DEFAULT_BATCH_SIZE = 32
+DEFAULT_CITY_COLUMN = "city"
+OUTPUT_FORMATS = ("csv", "ndjson")
+_RATE_LIMIT_RETRY_DELAY = 1.0
+_MAX_RATE_LIMIT_WAIT = 60.0
+_RESULT_FIELDS = ("line", "city", "umbrella_needed", "weather", "error")
+
+
+@dataclass(frozen=True)
+class BulkResult:
+    """Describes the outcome for one city of the input (line numbers start at 1)."""
+
+    line: int
+    city: str
+    umbrella_needed: bool | None = None
+    weather: str | None = None
+    error: str | None = None
+
+
+class Checkpoint:
+    """Progress of a bulk run, saved after every batch to resume it after a crash.
+
+    It stores the number of input lines processed and the size of the output at that
+    point, so that the results written after the checkpoint can be dropped.
+    """
+
+    def __init__(self, path: str) -> None:
+        """Initialize a checkpoint stored at path."""
+        self.path = path
+
+    def load(self) -> tuple[int, int]:
+        """Return the number of lines processed and the output size (0 if no run yet)."""
+        try:
+            with open(self.path, encoding="utf-8") as file:
+                content = json.load(file)
+        except FileNotFoundError:
+            return 0, 0
+        return int(content["processed"]), int(content["output_offset"])
+
+    def save(self, processed: int, output_offset: int) -> None:
+        """Replace the checkpoint atomically."""
+        temporary_path = f"{self.path}.tmp"
+        with open(temporary_path, "w", encoding="utf-8") as file:
+            json.dump({"processed": processed, "output_offset": output_offset}, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temporary_path, self.path)
+
+
+def read_cities(source: TextIO, column: str = DEFAULT_CITY_COLUMN) -> Iterator[str]:
+    """Stream the cities from a CSV whose header contains column."""
+    reader = csv.DictReader(source)
+    if reader.fieldnames is None or column not in reader.fieldnames:
+        raise ValueError(f"No '{column}' column in the input header")
+    for row in reader:
+        yield (row[column] or "").strip()
+
+
+def format_results(
+    results: Iterable[BulkResult], output_format: str, header: bool = False
+) -> str:
+    """Format results as CSV rows or as NDJSON lines."""
+    buffer = io.StringIO()
+    if output_format == "ndjson":
+        for result in results:
+            buffer.write(json.dumps(asdict(result)) + "\n")
+        return buffer.getvalue()
+
+    writer = csv.DictWriter(buffer, fieldnames=_RESULT_FIELDS, lineterminator="\n")
+    if header:
+        writer.writeheader()
+    writer.writerows(asdict(result) for result in results)
+    return buffer.getvalue()
+
+
+def _compute_result(
+    provider: UmbrellaReportProvider, line: int, city: str
+) -> BulkResult:
+    if not city:
+        return BulkResult(line=line, city=city, error="No city")
+
+    waited = 0.0
+    while True:
+        try:
+            report = provider.get_umbrella_report(city=city)
+            return BulkResult(
+                line=line,
+                city=city,
+                umbrella_needed=report.umbrella_needed,
+                weather=report.weather.value,
+            )
+        except APIKeysExhaustedException as exc:
+            # The keys are rotated out (e.g. invalid): waiting would not help
+            return BulkResult(
+                line=line, city=city, error=f"{type(exc).__name__}: {exc}"
+            )
+        except RateLimitExceededException as exc:
+            # A nightly job has time: it waits for the rate limit, for a while
+            if waited >= _MAX_RATE_LIMIT_WAIT:
+                return BulkResult(
+                    line=line, city=city, error=f"{type(exc).__name__}: {exc}"
+                )
+            time.sleep(_RATE_LIMIT_RETRY_DELAY)
+            waited += _RATE_LIMIT_RETRY_DELAY
+        except Exception as exc:  # pylint: disable=broad-except
+            return BulkResult(
+                line=line, city=city, error=f"{type(exc).__name__}: {exc}"
+            )
+
+
+async def compute_results(
+    provider: UmbrellaReportProvider,
+    cities: Sequence[tuple[int, str]],
+    executor: Executor,
+) -> list[BulkResult]:
+    """Compute the results of a batch of (line, city) concurrently, in input order."""
+    loop = asyncio.get_running_loop()
+    return list(
+        await asyncio.gather(
+            *(
+                loop.run_in_executor(executor, _compute_result, provider, line, city)
+                for line, city in cities
+            )
+        )
+    )
+
+
+def _get_output_size(output: BinaryIO) -> int | None:
+    if not output.seekable():
+        return None
+    return output.seek(0, io.SEEK_END)
+
+
+def _sync(output: BinaryIO) -> None:
+    output.flush()
+    with contextlib.suppress(OSError, io.UnsupportedOperation):
+        os.fsync(output.fileno())
+
+
+async def run_bulk(  # pylint: disable=too-many-arguments
+    provider: UmbrellaReportProvider,
+    source: TextIO,
+    output: BinaryIO,
+    output_format: str = "csv",
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    column: str = DEFAULT_CITY_COLUMN,
+    checkpoint: Checkpoint | None = None,
+) -> int:
+    """Compute the reports of the cities of source batch by batch, return the errors.
+
+    Only one batch is held in memory at a time. When resuming from a checkpoint, the
+    processed lines are skipped and the output is truncated back to its size at the
+    checkpoint (if it can be), so no result is written twice.
+    """
+    processed, output_offset = (0, 0) if checkpoint is None else checkpoint.load()
+    output_size = _get_output_size(output)
+    if (
+        checkpoint is not None
+        and output_size is not None
+        and output_offset < output_size
+    ):
+        output.truncate(output_offset)
+        output.seek(output_offset)
+
+    errors = 0
+    cities = itertools.islice(
+        enumerate(read_cities(source, column), start=1), processed, None
+    )
+    with ThreadPoolExecutor(
+        max_workers=batch_size, thread_name_prefix="umbrella-bulk"
+    ) as executor:
+        header = output_format == "csv" and processed == 0
+        while batch := list(itertools.islice(cities, batch_size)):
+            results = await compute_results(provider, batch, executor)
+            errors += sum(result.error is not None for result in results)
+            output.write(format_results(results, output_format, header=header).encode())
+            header = False
+            _sync(output)
+
+            processed = batch[-1][0]
+            if checkpoint is not None:
+                output_size = _get_output_size(output)
+                checkpoint.save(processed=processed, output_offset=output_size or 0)
+            logger.info("%i cities processed", processed)
+
+    return errors
+
+
+def _parse_arguments(argv: Sequence[str] | None) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog="python -m myumbrella.bulk",
+        description="Compute the umbrella reports of the cities listed in a CSV.",
+    )
+    parser.add_argument("input", help="CSV file with a header ('-' for stdin)")
+    parser.add_argument("--output", default="-", help="output file ('-' for stdout)")
+    parser.add_argument("--format", choices=OUTPUT_FORMATS, default="csv")
+    parser.add_argument("--column", default=DEFAULT_CITY_COLUMN, help="city column")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE)
+    parser.add_argument("--checkpoint", help="file where the progress is saved")
+    arguments = parser.parse_args(argv)
+
+    # Resuming drops the results written after the checkpoint: stdout cannot do that
+    if arguments.checkpoint is not None and arguments.output == "-":
+        parser.error("--checkpoint requires an --output file")
+    return arguments
+
+
+def main(argv: Sequence[str] | None = None) -> int:  # pragma: nocover
+    """Run the bulk tool with the Openweather client and the provider layers."""
+    # pylint: disable=import-outside-toplevel
+    from .apikeys import APIKeyPool, load_key_quota_from_env_variable
+    from .dependencies import ProviderPipeline
+    from .locations import AliasIndex
+    from .logs import setup_logging
+    from .main import DEFAULT_PROVIDER_PIPELINE
+    from .openweather import (
+        OpenweatherClient,
+        load_openweather_api_keys_from_env_variable,
+    )
+    from .providers import provider_layers
+
+    arguments = _parse_arguments(argv)
+    log_listener = setup_logging(level=logging.WARNING)
+    alias_index = AliasIndex()
+    client = OpenweatherClient(
+        api_key=APIKeyPool(
+            keys=load_openweather_api_keys_from_env_variable(),
+            quota_per_minute=load_key_quota_from_env_variable(),
+        ),
+        alias_index=alias_index,
+    )
+    provider = ProviderPipeline.from_names(
+        names=os.environ.get("MYUMBRELLA_PROVIDER_PIPELINE", DEFAULT_PROVIDER_PIPELINE),
+        registry=provider_layers(alias_index=alias_index),
+    ).build(client)
+
+    with contextlib.ExitStack() as stack:
+        source = (
+            sys.stdin
+            if arguments.input == "-"
+            else stack.enter_context(
+                open(arguments.input, encoding="utf-8", newline="")
+            )
+        )
+        output = (
+            sys.stdout.buffer
+            if arguments.output == "-"
+            else stack.enter_context(
+                # The output of a run that can be resumed is kept, up to its checkpoint
+                open(arguments.output, "wb" if arguments.checkpoint is None else "ab")
+            )
+        )
+        try:
+            errors = asyncio.run(
+                run_bulk(
+                    provider=provider,
+                    source=source,
+                    output=output,
+                    output_format=arguments.format,
+                    batch_size=arguments.batch_size,
+                    column=arguments.column,
+                    checkpoint=(
+                        None
+                        if arguments.checkpoint is None
+                        else Checkpoint(arguments.checkpoint)
+                    ),
+                )
+            )
+        finally:
+            client.close()
+            log_listener.stop()
+
+    if errors:
+        print(
+            f"{errors} cities could not be processed by this run "
+            "(the runs resumed from are not counted)",
+            file=sys.stderr,
+        )
+        return 1
+    return 0
+
+
+if __name__ == "__main__":  # pragma: nocover
+    sys.exit(main())
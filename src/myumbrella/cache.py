@@ -0,0 +1,472 @@
+"""Module for the caches used to avoid redundant calls to the weather providers."""
+import math
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable, Mapping
+
+from .core import UmbrellaReport, WeatherState
+from .sharedcache import SharedReportCache
+
+# Constants
+EARTH_RADIUS_KM = 6371.0
+DEFAULT_OBSERVATION_RADIUS_KM = 5.0
+DEFAULT_OBSERVATION_TTL = 600.0
+DEFAULT_REPORT_TTL = 300.0
+DEFAULT_REPORT_CACHE_SIZE = 10_000
+DEFAULT_RESPONSE_TTL = 2.0
+DEFAULT_MIN_REPORT_TTL = 60.0
+DEFAULT_MAX_REPORT_TTL = 1800.0
+DEFAULT_WEATHER_TTLS = {
+    WeatherState.CLEAR: 1800.0,
+    WeatherState.CLOUDS: 900.0,
+    WeatherState.FOG: 600.0,
+    WeatherState.SNOW: 600.0,
+    WeatherState.DRIZZLE: 300.0,
+    WeatherState.RAIN: 300.0,
+    WeatherState.THUNDERSTORM: 120.0,
+    WeatherState.UNKNOWN: 60.0,
+}
+DEFAULT_CHANGE_SMOOTHING = 0.5
+DEFAULT_NEGATIVE_TTL = 60.0
+_KM_PER_DEGREE = math.pi * EARTH_RADIUS_KM / 180.0
+
+
+def haversine_distance_km(
+    latitude1: float, longitude1: float, latitude2: float, longitude2: float
+) -> float:
+    """Compute the great-circle distance (in km) between two points."""
+    phi1 = math.radians(latitude1)
+    phi2 = math.radians(latitude2)
+    delta_phi = phi2 - phi1
+    delta_lambda = math.radians(longitude2 - longitude1)
+
+    hav = (
+        math.sin(delta_phi / 2) ** 2
+        + math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * math.asin(min(1.0, math.sqrt(hav)))
+
+
+@dataclass()
+class _Observation:
+    report: UmbrellaReport
+    expires_at: float
+
+
+class ObservationCache:
+    """Spatial index over the weather observations that are still fresh.
+
+    Observations are bucketed in a regular latitude/longitude grid whose cells are
+    (roughly) as large as the reuse radius, so a lookup only has to scan the cells
+    surrounding the requested point.
+    The time-to-live is either fixed (ttl) or picked for each observation by a policy.
+    """
+
+    def __init__(
+        self,
+        radius_km: float = DEFAULT_OBSERVATION_RADIUS_KM,
+        ttl: float = DEFAULT_OBSERVATION_TTL,
+        clock: Callable[[], float] = time.monotonic,
+        policy: "AdaptiveTTLPolicy | None" = None,
+    ) -> None:
+        """Initialize an empty cache that reuses observations within radius_km."""
+        if radius_km <= 0:
+            raise ValueError(f"Reuse radius must be positive (got {radius_km})")
+        self.radius_km = radius_km
+        self.ttl = ttl
+        self.policy = policy
+        self._clock = clock
+        self._cell_size = radius_km / _KM_PER_DEGREE
+        self._columns = max(1, math.floor(360.0 / self._cell_size))
+        self._cells: dict[tuple[int, int], list[_Observation]] = {}
+        self._lock = threading.Lock()
+
+    def _cell_of(self, latitude: float, longitude: float) -> tuple[int, int]:
+        return (
+            math.floor(latitude / self._cell_size),
+            math.floor((longitude + 180.0) / self._cell_size) % self._columns,
+        )
+
+    def _neighbour_cells(
+        self, latitude: float, longitude: float
+    ) -> list[tuple[int, int]]:
+        row, column = self._cell_of(latitude, longitude)
+
+        # Meridians get closer towards the poles: more columns must be scanned there
+        cos_latitude = math.cos(
+            math.radians(min(abs(latitude) + self._cell_size, 90.0))
+        )
+        if cos_latitude < 1e-6:
+            column_span = self._columns
+        else:
+            column_span = min(self._columns, math.ceil(1.0 / cos_latitude))
+
+        # Columns wrap around the antimeridian
+        columns = {
+            (column + delta_column) % self._columns
+            for delta_column in range(-column_span, column_span + 1)
+        }
+        return [
+            (row + delta_row, other_column)
+            for delta_row in (-1, 0, 1)
+            for other_column in columns
+        ]
+
+    def __len__(self) -> int:
+        """Return the number of stored observations (including expired ones)."""
+        return sum(len(observations) for observations in self._cells.values())
+
+    def add(self, report: UmbrellaReport) -> None:
+        """Store a fresh observation."""
+        location = report.location
+        cell = self._cell_of(location.latitude, location.longitude)
+        ttl = (
+            self.ttl
+            if self.policy is None
+            else self.policy.ttl_for(
+                f"{location.latitude:.2f},{location.longitude:.2f}", report
+            )
+        )
+        observation = _Observation(report=report, expires_at=self._clock() + ttl)
+
+        with self._lock:
+            # A newer observation replaces the one made at the very same place
+            observations = [
+                obs
+                for obs in self._cells.get(cell, [])
+                if (obs.report.location.latitude, obs.report.location.longitude)
+                != (location.latitude, location.longitude)
+            ]
+            observations.append(observation)
+            self._cells[cell] = observations
+
+    def find_nearest(self, latitude: float, longitude: float) -> UmbrellaReport | None:
+        """Return the nearest fresh observation within the reuse radius (if any)."""
+        now = self._clock()
+        best_report: UmbrellaReport | None = None
+        best_distance = self.radius_km
+
+        with self._lock:
+            for cell in self._neighbour_cells(latitude, longitude):
+                observations = self._cells.get(cell)
+                if not observations:
+                    continue
+
+                fresh = [obs for obs in observations if obs.expires_at > now]
+                if not fresh:
+                    del self._cells[cell]
+                    continue
+                self._cells[cell] = fresh
+
+                for observation in fresh:
+                    location = observation.report.location
+                    distance = haversine_distance_km(
+                        latitude, longitude, location.latitude, location.longitude
+                    )
+                    if distance <= best_distance:
+                        best_distance = distance
+                        best_report = observation.report
+
+        return best_report
+
+
+@dataclass()
+class _WeatherHistory:
+    weather: WeatherState
+    change_rate: float = 0.0
+
+
+class AdaptiveTTLPolicy:
+    """Pick the time-to-live of each report from the weather it reports.
+
+    The TTL of a weather state (settled skies last longer than storms) is shortened:
+    - by the observed rate of change of the weather for the same key (smoothed over
+      the successive reports), as an unsettled weather is likely to change again,
+    - by the age of the upstream data, which is only refreshed every few minutes.
+    The result is then bounded by min_ttl and max_ttl.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        weather_ttls: Mapping[WeatherState, float] | None = None,
+        min_ttl: float = DEFAULT_MIN_REPORT_TTL,
+        max_ttl: float = DEFAULT_MAX_REPORT_TTL,
+        smoothing: float = DEFAULT_CHANGE_SMOOTHING,
+        max_entries: int = DEFAULT_REPORT_CACHE_SIZE,
+        wall_clock: Callable[[], float] = time.time,
+    ) -> None:
+        """Initialize a policy without history."""
+        self.weather_ttls = dict(
+            DEFAULT_WEATHER_TTLS if weather_ttls is None else weather_ttls
+        )
+        self.min_ttl = min_ttl
+        self.max_ttl = max_ttl
+        self.smoothing = smoothing
+        self.max_entries = max_entries
+        self._wall_clock = wall_clock
+        self._history: OrderedDict[str, _WeatherHistory] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _update_change_rate(self, key: str, weather: WeatherState) -> float:
+        with self._lock:
+            history = self._history.get(key)
+            if history is None:
+                history = _WeatherHistory(weather=weather)
+                self._history[key] = history
+                while len(self._history) > self.max_entries:
+                    self._history.popitem(last=False)
+            else:
+                changed = 1.0 if history.weather != weather else 0.0
+                history.change_rate += self.smoothing * (changed - history.change_rate)
+                history.weather = weather
+            self._history.move_to_end(key)
+            return history.change_rate
+
+    def ttl_for(self, key: str, report: UmbrellaReport) -> float:
+        """Return the time-to-live (in seconds) of a report stored under a key."""
+        ttl = self.weather_ttls.get(report.weather, self.min_ttl)
+        ttl *= 1.0 - self._update_change_rate(key, report.weather)
+        if report.observed_at is not None:
+            ttl -= max(0.0, self._wall_clock() - report.observed_at)
+        return min(self.max_ttl, max(self.min_ttl, ttl))
+
+
+@dataclass()
+class _CachedReport:
+    report: UmbrellaReport
+    expires_at: float
+
+
+class ReportCache:
+    """Bounded cache of umbrella reports with a time-to-live.
+
+    The time-to-live is either fixed (ttl) or picked for each report by a policy.
+    When a shared cache is set, the reports are published to the other workers
+    through it and only kept locally when it has no room for them.
+    Listeners are notified with the key of every entry that is set, deleted, evicted
+    or found expired, so that anything derived from an entry can be invalidated.
+    """
+
+    def __init__(
+        self,
+        ttl: float = DEFAULT_REPORT_TTL,
+        max_entries: int = DEFAULT_REPORT_CACHE_SIZE,
+        clock: Callable[[], float] = time.monotonic,
+        policy: AdaptiveTTLPolicy | None = None,
+        shared: SharedReportCache | None = None,
+    ) -> None:
+        """Initialize an empty cache."""
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.policy = policy
+        self.shared = shared
+        self._clock = clock
+        self._entries: OrderedDict[str, _CachedReport] = OrderedDict()
+        self._listeners: list[Callable[[str], None]] = []
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Return the number of stored reports (including expired ones)."""
+        return len(self._entries)
+
+    def add_listener(self, listener: Callable[[str], None]) -> None:
+        """Register a callback called with the key of every entry that changes."""
+        self._listeners.append(listener)
+
+    def remove_listener(self, listener: Callable[[str], None]) -> None:
+        """Unregister a callback."""
+        self._listeners.remove(listener)
+
+    def _notify(self, keys: list[str]) -> None:
+        for key in keys:
+            for listener in self._listeners:
+                listener(key)
+
+    def _get_shared(self, key: str) -> UmbrellaReport | None:
+        return None if self.shared is None else self.shared.get(key)
+
+    def peek(self, key: str) -> UmbrellaReport | None:
+        """Return the report stored for a key if it is still fresh, without side effects."""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None or entry.expires_at <= self._clock():
+            return self._get_shared(key)
+        return entry.report
+
+    def get(self, key: str) -> UmbrellaReport | None:
+        """Return the report stored for a key if it is still fresh."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return self._get_shared(key)
+
+            if entry.expires_at > self._clock():
+                self._entries.move_to_end(key)
+                return entry.report
+
+            del self._entries[key]
+
+        self._notify([key])
+        return self._get_shared(key)
+
+    def set(self, key: str, report: UmbrellaReport) -> None:
+        """Store a report, evicting the least recently used one if the cache is full."""
+        changed_keys = [key]
+        ttl = self.ttl if self.policy is None else self.policy.ttl_for(key, report)
+        if self.shared is not None and self.shared.set(key, report, ttl):
+            with self._lock:
+                self._entries.pop(key, None)
+            self._notify(changed_keys)
+            return
+
+        with self._lock:
+            self._entries[key] = _CachedReport(
+                report=report, expires_at=self._clock() + ttl
+            )
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                evicted_key, _ = self._entries.popitem(last=False)
+                changed_keys.append(evicted_key)
+
+        self._notify(changed_keys)
+
+    def delete(self, key: str) -> None:
+        """Forget the report stored for a key."""
+        with self._lock:
+            self._entries.pop(key, None)
+        if self.shared is not None:
+            self.shared.delete(key)
+
+        self._notify([key])
+
+
+@dataclass()
+class _CachedMiss:
+    message: str
+    expires_at: float
+
+
+class NegativeCache:
+    """Bounded cache of the queries that were not found, with a short time-to-live."""
+
+    def __init__(
+        self,
+        ttl: float = DEFAULT_NEGATIVE_TTL,
+        max_entries: int = DEFAULT_REPORT_CACHE_SIZE,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """Initialize an empty cache."""
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._clock = clock
+        self._entries: OrderedDict[str, _CachedMiss] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Return the number of stored misses (including expired ones)."""
+        return len(self._entries)
+
+    def get(self, key: str) -> str | None:
+        """Return the error message stored for a key if it is still fresh."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            if entry.expires_at <= self._clock():
+                del self._entries[key]
+                return None
+
+            return entry.message
+
+    def set(self, key: str, message: str) -> None:
+        """Store a miss, evicting the oldest one if the cache is full."""
+        with self._lock:
+            self._entries[key] = _CachedMiss(
+                message=message, expires_at=self._clock() + self.ttl
+            )
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+@dataclass()
+class _CachedContent:
+    content: bytes
+    expires_at: float
+
+
+class ResponseCache:
+    """Short-lived cache of encoded responses derived from a ReportCache.
+
+    The cache stays disabled until it is attached to a report cache: any change of a
+    report entry then invalidates the response stored for the same key, and a response
+    is only stored if it was built from the report that is currently cached.
+    """
+
+    def __init__(
+        self,
+        ttl: float = DEFAULT_RESPONSE_TTL,
+        max_entries: int = DEFAULT_REPORT_CACHE_SIZE,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """Initialize an empty (and disabled) cache."""
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._clock = clock
+        self._report_cache: ReportCache | None = None
+        self._entries: OrderedDict[str, _CachedContent] = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        """Check if the cache is attached to a report cache."""
+        return self._report_cache is not None
+
+    def attach(self, report_cache: ReportCache) -> None:
+        """Enable the cache, invalidating its entries when report_cache changes."""
+        report_cache.add_listener(self.invalidate)
+        self._report_cache = report_cache
+
+    def detach(self) -> None:
+        """Disable (and empty) the cache."""
+        with self._lock:
+            if self._report_cache is not None:
+                self._report_cache.remove_listener(self.invalidate)
+            self._report_cache = None
+            self._entries.clear()
+
+    def get(self, key: str) -> bytes | None:
+        """Return the response stored for a key if it is still fresh."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            if entry.expires_at <= self._clock():
+                del self._entries[key]
+                return None
+
+            self._entries.move_to_end(key)
+            return entry.content
+
+    def set(self, key: str, content: bytes, report: UmbrellaReport) -> None:
+        """Store the response built from a report if that report is still cached."""
+        with self._lock:
+            # Holding the lock delays any invalidation until the response is stored
+            if self._report_cache is None or self._report_cache.peek(key) != report:
+                return
+
+            self._entries[key] = _CachedContent(
+                content=content, expires_at=self._clock() + self.ttl
+            )
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key: str) -> None:
+        """Forget the response stored for a key."""
+        with self._lock:
+            self._entries.pop(key, None)
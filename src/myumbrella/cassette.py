@@ -0,0 +1,226 @@
+"""Module for the record and the replay of the Openweather traffic (cassettes).
+
+A cassette is a gzipped file with one JSON entry per request/response pair (NDJSON),
+so that load tests can replay production-shaped traffic without network access. Each
+entry is a gzip member of its own, so the cassette of a process that crashed can
+still be replayed (up to its last complete entry).
+"""
+import gzip
+import json
+import logging
+import threading
+import time
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import BinaryIO, Callable
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+# Constants
+# Query parameters that are never written to a cassette
+_SECRET_PARAMS = frozenset({"appid"})
+
+_CassetteKey = tuple[str, str, tuple[tuple[str, str], ...]]
+
+
+@dataclass(frozen=True)
+class CassetteEntry:
+    """Describes a recorded request/response pair and its latency (in seconds)."""
+
+    method: str
+    path: str
+    params: list[tuple[str, str]]
+    status: int
+    content_type: str
+    body: str
+    latency: float
+
+    @property
+    def key(self) -> _CassetteKey:
+        """Key to match requests with."""
+        return _make_key(self.method, self.path, self.params)
+
+
+def _make_key(method: str, path: str, params: list[tuple[str, str]]) -> _CassetteKey:
+    return method, path, tuple(sorted(params))
+
+
+def _get_request_params(request: httpx.Request) -> list[tuple[str, str]]:
+    return [
+        (name, value)
+        for name, value in request.url.params.multi_items()
+        if name not in _SECRET_PARAMS
+    ]
+
+
+def load_cassette(path: str | Path) -> list[CassetteEntry]:
+    """Read all the complete entries of a cassette."""
+    entries = []
+    with gzip.open(path, mode="rt", encoding="utf-8") as cassette:
+        try:
+            for line in cassette:
+                entry = json.loads(line)
+                entries.append(
+                    CassetteEntry(
+                        **{
+                            **entry,
+                            "params": [tuple(param) for param in entry["params"]],
+                        }
+                    )
+                )
+        except EOFError:
+            # The recording process stopped while writing the last entry
+            logger.warning(
+                "Cassette '%s' is truncated after %i entries", path, len(entries)
+            )
+    return entries
+
+
+class RecordingTransport(httpx.BaseTransport):
+    """Transport that records every exchange of another transport into a cassette.
+
+    The API key is left out of the cassette. Entries are appended (and flushed) one
+    gzip member at a time, so the traffic of several runs can be gathered in the same
+    cassette and a crash only loses the entry being written.
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        transport: httpx.BaseTransport,
+        clock: Callable[[], float] = time.perf_counter,
+    ) -> None:
+        """Initialize a transport recording the exchanges of transport into path."""
+        self.path = Path(path)
+        self.transport = transport
+        self._clock = clock
+        self._cassette: BinaryIO | None = None
+        self._lock = threading.Lock()
+
+    def _record(self, entry: CassetteEntry) -> None:
+        line = json.dumps(asdict(entry), ensure_ascii=False, separators=(",", ":"))
+        member = gzip.compress((line + "\n").encode("utf-8"))
+        with self._lock:
+            if self._cassette is None:
+                self._cassette = open(  # pylint: disable=consider-using-with
+                    self.path, mode="ab"
+                )
+            self._cassette.write(member)
+            self._cassette.flush()
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        """Send a request with the wrapped transport and record the exchange."""
+        start = self._clock()
+        response = self.transport.handle_request(request)
+        try:
+            content = response.read()
+        finally:
+            response.close()
+        latency = self._clock() - start
+
+        content_type = response.headers.get("content-type", "application/json")
+        if request.method == "GET":
+            self._record(
+                CassetteEntry(
+                    method=request.method,
+                    path=request.url.path,
+                    params=_get_request_params(request),
+                    status=response.status_code,
+                    content_type=content_type,
+                    body=content.decode("utf-8", errors="replace"),
+                    latency=latency,
+                )
+            )
+
+        # The content is already decoded: its encoding headers do not apply anymore
+        return httpx.Response(
+            status_code=response.status_code,
+            headers={"content-type": content_type},
+            content=content,
+            request=request,
+        )
+
+    def close(self) -> None:
+        """Close the cassette and the wrapped transport."""
+        with self._lock:
+            if self._cassette is not None:
+                self._cassette.close()
+                self._cassette = None
+        self.transport.close()
+
+
+class ReplayTransport(httpx.BaseTransport):
+    """Transport that serves the responses of a cassette instead of calling the host.
+
+    Each response is served after its recorded latency multiplied by latency_scale
+    (0 to serve without waiting). The responses recorded for a same request are
+    served in turn. Unless strict, a request that was not recorded is served the
+    responses recorded for the same endpoint (i.e. same path).
+    """
+
+    def __init__(
+        self,
+        path: str | Path,
+        latency_scale: float = 1.0,
+        strict: bool = True,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        """Initialize a transport replaying the cassette at path."""
+        self.latency_scale = latency_scale
+        self.strict = strict
+        self._sleep = sleep
+        self._entries: dict[_CassetteKey, list[CassetteEntry]] = {}
+        self._endpoint_entries: dict[tuple[str, str], list[CassetteEntry]] = {}
+        for entry in load_cassette(path):
+            self._entries.setdefault(entry.key, []).append(entry)
+            self._endpoint_entries.setdefault((entry.method, entry.path), []).append(
+                entry
+            )
+        self._turns: dict[_CassetteKey | tuple[str, str], int] = {}
+        self._lock = threading.Lock()
+        logger.info("Replaying %i responses from cassette '%s'", len(self), path)
+
+    def __len__(self) -> int:
+        """Return the number of recorded responses."""
+        return sum(len(entries) for entries in self._entries.values())
+
+    def _next_entry(self, request: httpx.Request) -> CassetteEntry | None:
+        request_key = _make_key(
+            request.method, request.url.path, _get_request_params(request)
+        )
+        key: _CassetteKey | tuple[str, str] = request_key
+        entries = self._entries.get(request_key)
+        if entries is None and not self.strict:
+            key = (request.method, request.url.path)
+            entries = self._endpoint_entries.get(key)
+        if entries is None:
+            return None
+
+        with self._lock:
+            turn = self._turns.get(key, 0)
+            self._turns[key] = turn + 1
+        return entries[turn % len(entries)]
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        """Serve the recorded response of a request."""
+        if request.method == "HEAD":
+            # Connection warm-ups are not recorded
+            return httpx.Response(status_code=200, request=request)
+
+        entry = self._next_entry(request)
+        if entry is None:
+            raise httpx.ConnectError(
+                f"No response recorded for {request.method} {request.url.path}",
+                request=request,
+            )
+
+        if self.latency_scale > 0:
+            self._sleep(entry.latency * self.latency_scale)
+        return httpx.Response(
+            status_code=entry.status,
+            headers={"content-type": entry.content_type},
+            content=entry.body.encode("utf-8"),
+            request=request,
+        )
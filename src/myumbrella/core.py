@@ -1,7 +1,7 @@
 """Domain entities and logics for myapp."""
 from dataclasses import dataclass, field
 from enum import Enum
-from typing import Protocol
+from typing import Protocol, runtime_checkable
 
 
 @dataclass()
@@ -33,7 +33,11 @@ class UnknownUmbrellaStateException(ValueError):
 
 
 class LocationNotFoundException(ValueError):
-    """Exception raised when e.g. OpenWeather Geocoding API returns nothing or fails."""
+    """Exception raised when e.g. OpenWeather Geocoding API returns no location."""
+
+
+class UpstreamErrorException(IOError):
+    """Exception raised when e.g. OpenWeather answers with an error (not a result)."""
 
 
 _NO_UMBRELLA_WEATHERS = [WeatherState.CLEAR, WeatherState.CLOUDS, WeatherState.FOG]
@@ -45,6 +49,8 @@ class UmbrellaReport:
 
     location: Location = field(default_factory=Location)
     weather: WeatherState = WeatherState.UNKNOWN
+    # Time (UNIX, UTC) at which the upstream provider calculated the weather (if known)
+    observed_at: float | None = field(default=None, compare=False)
 
     @property
     def umbrella_needed(self) -> bool:
@@ -66,3 +72,14 @@ class UmbrellaReportProvider(Protocol):
     def get_umbrella_report(self, city: str) -> UmbrellaReport:  # pragma: nocover
         """Retrieve the umbrella report for a city."""
         ...  # pylint: disable=unnecessary-ellipsis
+
+
+@runtime_checkable
+class CoordinatesUmbrellaReportProvider(Protocol):
+    """Interface for Classes that provides UmbrellaReport from coordinates."""
+
+    def get_umbrella_report_at(
+        self, latitude: float, longitude: float
+    ) -> UmbrellaReport:  # pragma: nocover
+        """Retrieve the umbrella report for a latitude and a longitude."""
+        ...  # pylint: disable=unnecessary-ellipsis
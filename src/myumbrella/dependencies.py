@@ -1,46 +1,108 @@
 """Module where app dependencies are defined and stored."""
 import logging
+from typing import Callable, Sequence
 
+from .cache import ResponseCache
 from .core import UmbrellaReportProvider
+from .locations import AliasIndex
 
-logger = logging.getLogger("__name__")
+logger = logging.getLogger(__name__)
+
+ProviderLayerFactory = Callable[[UmbrellaReportProvider], UmbrellaReportProvider]
 
 
 class DependencyNotInitializedException(ValueError):
     """Exception when dependency has not been initialized."""
 
 
+class ProviderPipeline:
+    """Declarative stack of layers to wrap around an UmbrellaReportProvider.
+
+    Layers are listed from the outermost to the innermost one: ["cache", "ratelimit"]
+    builds a cache in front of a rate limiter in front of the provider.
+    """
+
+    def __init__(self, layers: Sequence[ProviderLayerFactory] = ()) -> None:
+        """Initialize a pipeline from layer factories."""
+        self.layers = list(layers)
+
+    @classmethod
+    def from_names(
+        cls, names: str | Sequence[str], registry: dict[str, ProviderLayerFactory]
+    ) -> "ProviderPipeline":
+        """Build a pipeline from layer names (comma-separated string or sequence)."""
+        if isinstance(names, str):
+            names = [name.strip() for name in names.split(",") if name.strip()]
+
+        try:
+            return cls(layers=[registry[name] for name in names])
+        except KeyError as exc:
+            raise ValueError(
+                f"Unknown provider layer '{exc.args[0]}' (known: {', '.join(registry)})"
+            ) from exc
+
+    def build(self, provider: UmbrellaReportProvider) -> UmbrellaReportProvider:
+        """Wrap a provider with all the layers of the pipeline."""
+        for layer in reversed(self.layers):
+            provider = layer(provider)
+        return provider
+
+
 class UmbrellaReportProviderDependency:
-    """TBD."""
+    """Dependency that serves the UmbrellaReportProvider to the routes.
 
-    def __init__(self) -> None:
-        """TBD."""
+    The provider that is set is wrapped once with the pipeline layers, so resolving
+    the dependency for a request is a plain attribute read.
+    """
+
+    def __init__(self, pipeline: ProviderPipeline | None = None) -> None:
+        """Initialize the dependency without any provider."""
+        self._pipeline = ProviderPipeline() if pipeline is None else pipeline
         self._provider: UmbrellaReportProvider | None = None
+        self._served_provider: UmbrellaReportProvider | None = None
+
+    def _rebuild(self) -> None:
+        if self._provider is None:
+            self._served_provider = None
+        else:
+            self._served_provider = self._pipeline.build(self._provider)
+
+    @property
+    def pipeline(self) -> ProviderPipeline:
+        """Pipeline of layers wrapped around the provider."""
+        return self._pipeline
+
+    @pipeline.setter
+    def pipeline(self, pipeline: ProviderPipeline) -> None:
+        self._pipeline = pipeline
+        self._rebuild()
 
     @property
     def provider(self) -> UmbrellaReportProvider | None:
-        """TBD."""
-        logging.debug(
-            "%s serving provider: %s",
-            self.__class__.__name__,
-            self._provider.__class__.__name__,
-        )
+        """Provider that is wrapped by the pipeline."""
         return self._provider
 
     @provider.setter
     def provider(self, provider: UmbrellaReportProvider) -> None:
-        logging.info(
+        logger.info(
             "UmbrellaReportProvider is now set to '%s'", provider.__class__.__name__
         )
         self._provider = provider
+        self._rebuild()
 
     @provider.deleter
     def provider(self) -> None:
         self._provider = None
+        self._served_provider = None
+
+    @property
+    def served_provider(self) -> UmbrellaReportProvider | None:
+        """Provider that is served to the routes (i.e. wrapped by the pipeline)."""
+        return self._served_provider
 
     def __call__(self) -> UmbrellaReportProvider:
-        """TBD."""
-        provider = self.provider
+        """Return the provider to be used by a route."""
+        provider = self._served_provider
         if provider is None:
             raise DependencyNotInitializedException(
                 "UmbrellaReportProvider has no provider!"
@@ -49,3 +111,5 @@ class UmbrellaReportProviderDependency:
 
 
 umbrella_report_provider_dependency = UmbrellaReportProviderDependency()
+umbrella_response_cache = ResponseCache()
+city_alias_index = AliasIndex()
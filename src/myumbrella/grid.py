@@ -0,0 +1,185 @@
+"""Module for the umbrella maps computed over a grid of coordinates."""
+import logging
+import math
+from concurrent.futures import Executor, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Iterable
+
+from .core import CoordinatesUmbrellaReportProvider
+from .metrics import MetricsRegistry, metrics
+from .providers import ProviderLayer, RateLimitingLayer, find_layer, prepaid_calls
+
+logger = logging.getLogger(__name__)
+
+# Constants
+DEFAULT_MAP_CONCURRENCY = 8
+DEFAULT_MAX_MAP_CELLS = 1024
+# Decimals kept for the grid coordinates (i.e. ~0.1 m), so they can be used as cache keys
+_CENTER_DECIMALS = 6
+
+# Shared by the maps: its threads are only started once a map is computed
+_map_executor = ThreadPoolExecutor(
+    max_workers=DEFAULT_MAP_CONCURRENCY, thread_name_prefix="umbrella-map"
+)
+
+
+@dataclass(frozen=True)
+class BoundingBox:
+    """Describes a region by its west and east longitudes, south and north latitudes."""
+
+    west: float
+    south: float
+    east: float
+    north: float
+
+    @classmethod
+    def parse(cls, text: str) -> "BoundingBox":
+        """Parse a bounding box like "west,south,east,north" (i.e. OpenWeather order)."""
+        try:
+            west, south, east, north = (float(value) for value in text.split(","))
+        except ValueError as exc:
+            raise ValueError(
+                f"Bounding box '{text}' is not like 'west,south,east,north'"
+            ) from exc
+
+        if not -180.0 <= west < east <= 180.0 or not -90.0 <= south < north <= 90.0:
+            raise ValueError(f"Bounding box '{text}' is not a valid region")
+        return cls(west=west, south=south, east=east, north=north)
+
+
+def _to_lattice(degrees: float, resolution: float) -> float:
+    # Rounded so that e.g. 0.3 / 0.1 is on the lattice (and not 2.9999999999999996)
+    return round(degrees / resolution, 9)
+
+
+@dataclass(frozen=True)
+class UmbrellaGrid:
+    """Grid of the cells covering a bounding box.
+
+    Cells are aligned on a global lattice of `resolution` degrees, so that the maps of
+    overlapping regions share their cells (and their cached observations). The grid is
+    the region snapped to that lattice.
+    """
+
+    bbox: BoundingBox
+    resolution: float
+    rows: int
+    columns: int
+
+    @classmethod
+    def covering(cls, bbox: BoundingBox, resolution: float) -> "UmbrellaGrid":
+        """Return the grid of the lattice cells that intersect a bounding box."""
+        first_column = math.floor(_to_lattice(bbox.west, resolution))
+        first_row = math.floor(_to_lattice(bbox.south, resolution))
+        columns = max(1, math.ceil(_to_lattice(bbox.east, resolution)) - first_column)
+        rows = max(1, math.ceil(_to_lattice(bbox.north, resolution)) - first_row)
+        return cls(
+            bbox=BoundingBox(
+                west=round(first_column * resolution, _CENTER_DECIMALS),
+                south=round(first_row * resolution, _CENTER_DECIMALS),
+                east=round((first_column + columns) * resolution, _CENTER_DECIMALS),
+                north=round((first_row + rows) * resolution, _CENTER_DECIMALS),
+            ),
+            resolution=resolution,
+            rows=rows,
+            columns=columns,
+        )
+
+    def __len__(self) -> int:
+        """Return the number of cells."""
+        return self.rows * self.columns
+
+    def cell_centers(self) -> list[tuple[float, float]]:
+        """Return the (latitude, longitude) of the cell centers.
+
+        Cells are listed row by row, from the north-west corner (i.e. like an image).
+        """
+        half = self.resolution / 2
+        return [
+            (
+                round(self.bbox.north - row * self.resolution - half, _CENTER_DECIMALS),
+                round(
+                    self.bbox.west + column * self.resolution + half, _CENTER_DECIMALS
+                ),
+            )
+            for row in range(self.rows)
+            for column in range(self.columns)
+        ]
+
+
+def pack_flags(flags: Iterable[bool]) -> bytes:
+    """Pack flags into bits, most significant bit first (last byte padded with 0)."""
+    packed = bytearray()
+    byte = 0
+    count = 0
+    for count, flag in enumerate(flags, start=1):
+        byte = (byte << 1) | flag
+        if count % 8 == 0:
+            packed.append(byte)
+            byte = 0
+    if count % 8:
+        packed.append(byte << (8 - count % 8))
+    return bytes(packed)
+
+
+def _peek_umbrella_flag(
+    provider: CoordinatesUmbrellaReportProvider, latitude: float, longitude: float
+) -> bool | None:
+    if not isinstance(provider, ProviderLayer):
+        return None
+    report = provider.peek_at(latitude=latitude, longitude=longitude)
+    return None if report is None else report.umbrella_needed
+
+
+def _get_umbrella_flag(
+    provider: CoordinatesUmbrellaReportProvider, latitude: float, longitude: float
+) -> bool | None:
+    try:
+        return provider.get_umbrella_report_at(
+            latitude=latitude, longitude=longitude
+        ).umbrella_needed
+    except Exception as exc:  # pylint: disable=broad-except
+        # A cell that cannot be assessed (e.g. rate limit) does not fail the map
+        logger.debug(
+            "No umbrella flag at latitude=%.3f, longitude=%.3f: %s",
+            latitude,
+            longitude,
+            exc,
+        )
+        return None
+
+
+def compute_umbrella_flags(
+    provider: CoordinatesUmbrellaReportProvider,
+    grid: UmbrellaGrid,
+    executor: Executor | None = None,
+    registry: MetricsRegistry = metrics,
+) -> list[bool | None]:
+    """Return the umbrella flag of every cell of a grid (None when unknown).
+
+    Cells are first looked up in the caches of the provider layers. The missing cells
+    are then fetched concurrently from the provider, as long as the rate limit can
+    afford them right away: their tokens are taken at once, and the cells that cannot
+    be afforded are unknown.
+    """
+    executor = _map_executor if executor is None else executor
+    centers = grid.cell_centers()
+    flags = [_peek_umbrella_flag(provider, *center) for center in centers]
+    missing = [index for index, flag in enumerate(flags) if flag is None]
+    registry.increment("map.cells.cached", len(flags) - len(missing))
+
+    # A map must not wait for the upstream rate limit shared with the other requests
+    if isinstance(provider, ProviderLayer):
+        rate_limiter = find_layer(provider, RateLimitingLayer)
+        if rate_limiter is not None:
+            missing = missing[: rate_limiter.bucket.take(len(missing))]
+
+    def fetch_flag(index: int) -> bool | None:
+        with prepaid_calls():
+            return _get_umbrella_flag(provider, *centers[index])
+
+    for index, flag in zip(missing, executor.map(fetch_flag, missing)):
+        flags[index] = flag
+    registry.increment("map.cells", len(flags))
+    registry.increment("map.cells.unknown", flags.count(None))
+    return flags
@@ -0,0 +1,147 @@
+"""Module for the hedging of slow upstream requests."""
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, TypeVar
+
+from .metrics import MetricsRegistry, metrics
+
+# Constants
+DEFAULT_HEDGING_PERCENTILE = 0.95
+DEFAULT_HEDGING_BUDGET = 0.05
+DEFAULT_HEDGING_DELAY = 1.0
+DEFAULT_HEDGING_MIN_DELAY = 0.05
+DEFAULT_LATENCY_WINDOW = 200
+_MIN_LATENCY_SAMPLES = 20
+_MAX_HEDGE_TOKENS = 10.0
+
+T = TypeVar("T")
+
+
+class LatencyTracker:
+    """Keep the most recent latencies of an endpoint to estimate its percentiles."""
+
+    def __init__(self, window: int = DEFAULT_LATENCY_WINDOW) -> None:
+        """Initialize an empty tracker keeping at most window latencies."""
+        self._latencies: deque[float] = deque(maxlen=window)
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Return the number of tracked latencies."""
+        return len(self._latencies)
+
+    def record(self, latency: float) -> None:
+        """Track a latency (in seconds)."""
+        with self._lock:
+            self._latencies.append(latency)
+
+    def percentile(self, fraction: float) -> float:
+        """Return the latency below which lies fraction of the tracked latencies."""
+        with self._lock:
+            latencies = sorted(self._latencies)
+        if not latencies:
+            raise ValueError("No latency tracked yet")
+        index = min(
+            len(latencies) - 1, max(0, math.ceil(fraction * len(latencies)) - 1)
+        )
+        return latencies[index]
+
+
+class HedgingPolicy:
+    """Send a second identical request when the first one is slower than usual.
+
+    The hedging delay adapts to the observed latency percentile of each endpoint and the
+    number of hedges is capped by a budget: each request earns `budget` hedge tokens
+    and a hedge costs a full one. The first successful response wins; the other request
+    is cancelled if it has not started yet, or its response is discarded otherwise.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        percentile: float = DEFAULT_HEDGING_PERCENTILE,
+        budget: float = DEFAULT_HEDGING_BUDGET,
+        default_delay: float = DEFAULT_HEDGING_DELAY,
+        min_delay: float = DEFAULT_HEDGING_MIN_DELAY,
+        registry: MetricsRegistry = metrics,
+        max_workers: int = 32,
+    ) -> None:
+        """Initialize a hedging policy."""
+        self.percentile = percentile
+        self.budget = budget
+        self.default_delay = default_delay
+        self.min_delay = min_delay
+        self._registry = registry
+        self._trackers: dict[str, LatencyTracker] = {}
+        self._tokens = 0.0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="hedging"
+        )
+
+    def _tracker(self, endpoint: str) -> LatencyTracker:
+        with self._lock:
+            return self._trackers.setdefault(endpoint, LatencyTracker())
+
+    def delay_for(self, endpoint: str) -> float:
+        """Return how long to wait for a response before hedging the request."""
+        tracker = self._tracker(endpoint)
+        if len(tracker) < _MIN_LATENCY_SAMPLES:
+            return self.default_delay
+        return max(self.min_delay, tracker.percentile(self.percentile))
+
+    def _earn_token(self) -> None:
+        with self._lock:
+            self._tokens = min(_MAX_HEDGE_TOKENS, self._tokens + self.budget)
+
+    def _spend_token(self) -> bool:
+        with self._lock:
+            if self._tokens < 1.0:
+                return False
+            self._tokens -= 1.0
+            return True
+
+    def _timed_submit(self, endpoint: str, send: Callable[[], T]) -> Future[T]:
+        def timed_send() -> T:
+            start = time.perf_counter()
+            result = send()
+            self._tracker(endpoint).record(time.perf_counter() - start)
+            return result
+
+        return self._executor.submit(timed_send)
+
+    def call(self, endpoint: str, send: Callable[[], T]) -> T:
+        """Send a request to an endpoint, hedging it if it is too slow."""
+        self._registry.increment("openweather.hedge.requests")
+        self._earn_token()
+
+        primary = self._timed_submit(endpoint, send)
+        done, _ = wait([primary], timeout=self.delay_for(endpoint))
+        if done or not self._spend_token():
+            return primary.result()
+
+        self._registry.increment("openweather.hedge.sent")
+        hedge = self._timed_submit(endpoint, send)
+
+        pending = {primary, hedge}
+        error: BaseException | None = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                error = future.exception()
+                if error is not None:
+                    continue
+
+                for other in pending:
+                    other.cancel()
+                if future is hedge:
+                    self._registry.increment("openweather.hedge.won")
+                return future.result()
+
+        assert error is not None  # nosec B101; both requests failed
+        raise error
+
+    def shutdown(self) -> None:
+        """Stop the threads used to send the requests."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,145 @@
+"""Module for the canonicalization of the city queries."""
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Callable
+
+from .core import Location
+
+# Constants
+DEFAULT_ALIAS_INDEX_SIZE = 100_000
+DEFAULT_ALIAS_TTL = 24 * 3600.0
+
+
+def _fold(text: str) -> str:
+    """Fold a text for comparisons: no case, no diacritics."""
+    decomposed = unicodedata.normalize("NFKD", text)
+    return "".join(
+        char for char in decomposed if not unicodedata.combining(char)
+    ).casefold()
+
+
+@dataclass(frozen=True)
+class CityQuery:
+    """Describes a city query once canonicalized."""
+
+    name: str
+    state: str | None = None
+    country_code: str | None = None
+
+    def _parts(self) -> list[str]:
+        return [part for part in (self.name, self.state, self.country_code) if part]
+
+    @property
+    def key(self) -> str:
+        """Key shared by all the spellings of the query."""
+        return ",".join(_fold(part) for part in self._parts())
+
+    @property
+    def geocoding_query(self) -> str:
+        """Query to send to Openweather Geocoding API."""
+        return ",".join(self._parts())
+
+
+def canonicalize_city_query(city: str) -> CityQuery:
+    """Canonicalize a city query like " paris , fr" (i.e. "city[,state][,country]").
+
+    The country is recognized as a trailing two-letter code (ISO 3166 alpha-2).
+    """
+    text = unicodedata.normalize("NFKC", city)
+    parts = [" ".join(part.split()) for part in text.split(",")]
+    parts = [part for part in parts if part]
+    if not parts:
+        return CityQuery(name="")
+
+    country_code = None
+    if len(parts) > 1 and len(parts[-1]) == 2 and parts[-1].isalpha():
+        country_code = parts.pop().upper()
+
+    return CityQuery(
+        name=parts[0], state=", ".join(parts[1:]) or None, country_code=country_code
+    )
+
+
+def _location_query(location: Location) -> CityQuery:
+    return CityQuery(
+        name=location.city, state=location.state, country_code=location.country
+    )
+
+
+def location_key(location: Location) -> str:
+    """Key of a location (i.e. "city,state,country@latitude,longitude").
+
+    The coordinates are rounded to ~1 km: places that share a name are told apart
+    even when Openweather returns no state for them.
+    """
+    return (
+        f"{_location_query(location).key}"
+        f"@{location.latitude:.2f},{location.longitude:.2f}"
+    )
+
+
+@dataclass()
+class _Alias:
+    location: Location
+    expires_at: float
+
+
+class AliasIndex:
+    """Learned index mapping every seen spelling of a city to its Location.
+
+    When a query is geocoded, both the query key and the full query of the returned
+    location (i.e. "city,state,country") are learned, so that later variants resolve
+    without any upstream call.
+    Learned locations should be revalidated once their time-to-live expired, but they
+    are kept until then as a (stale) hint of where the city is.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = DEFAULT_ALIAS_INDEX_SIZE,
+        ttl: float = DEFAULT_ALIAS_TTL,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """Initialize an empty index."""
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._clock = clock
+        self._aliases: OrderedDict[str, _Alias] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        """Return the number of known aliases."""
+        return len(self._aliases)
+
+    def lookup(self, query: CityQuery, include_stale: bool = False) -> Location | None:
+        """Return the location known for a query (if any and, unless asked, fresh)."""
+        with self._lock:
+            alias = self._aliases.get(query.key)
+            if alias is None:
+                return None
+            self._aliases.move_to_end(query.key)
+
+        if not include_stale and alias.expires_at <= self._clock():
+            return None
+        return alias.location
+
+    def learn(self, query: CityQuery, location: Location) -> None:
+        """Remember the location returned for a query."""
+        alias = _Alias(location=location, expires_at=self._clock() + self.ttl)
+        with self._lock:
+            for key in (query.key, _location_query(location).key):
+                self._aliases[key] = alias
+                self._aliases.move_to_end(key)
+            while len(self._aliases) > self.max_entries:
+                self._aliases.popitem(last=False)
+
+    def cache_key(self, city: str) -> str:
+        """Return the key to cache the results of a city query with."""
+        query = canonicalize_city_query(city)
+        location = self.lookup(query, include_stale=True)
+        if location is None:
+            return query.key
+        return location_key(location)
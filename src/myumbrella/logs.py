@@ -0,0 +1,114 @@
+"""Module for the logging setup of the application (off the request hot path)."""
+import logging
+import queue
+import random
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Callable, Mapping, Sequence
+
+from .metrics import MetricsRegistry, metrics
+
+# Constants
+DEFAULT_LOG_SAMPLE_RATE = 1.0
+DEFAULT_LOG_RATE_LIMIT = 10
+DEFAULT_LOG_RATE_PERIOD = 1.0
+_LOG_FORMAT = "%(levelname)s:%(name)s:%(message)s"
+
+
+class SamplingFilter(logging.Filter):
+    """Filter that samples and rate-limits the repetitive logs of a message type.
+
+    The type of a message is its template (i.e. the message before its arguments are
+    merged in), so the filtered out messages are never formatted. Messages above the
+    INFO level always pass.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        default_sample_rate: float = DEFAULT_LOG_SAMPLE_RATE,
+        sample_rates: Mapping[str, float] | None = None,
+        rate_limit: int = DEFAULT_LOG_RATE_LIMIT,
+        period: float = DEFAULT_LOG_RATE_PERIOD,
+        registry: MetricsRegistry = metrics,
+        clock: Callable[[], float] = time.monotonic,
+        draw: Callable[[], float] = random.random,
+    ) -> None:
+        """Initialize a filter letting rate_limit messages of a type per period."""
+        super().__init__()
+        self.default_sample_rate = default_sample_rate
+        self.sample_rates = dict(sample_rates or {})
+        self.rate_limit = rate_limit
+        self.period = period
+        self._registry = registry
+        self._clock = clock
+        self._draw = draw
+        self._windows: dict[tuple[str, str], tuple[float, int]] = {}
+        self._lock = threading.Lock()
+
+    def _is_within_rate_limit(self, key: tuple[str, str]) -> bool:
+        now = self._clock()
+        with self._lock:
+            window_start, count = self._windows.get(key, (now, 0))
+            if now - window_start >= self.period:
+                window_start, count = now, 0
+            self._windows[key] = (window_start, count + 1)
+        return count < self.rate_limit
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        """Return whether the record should be emitted."""
+        if record.levelno > logging.INFO:
+            return True
+
+        template = str(record.msg)
+        sample_rate = self.sample_rates.get(template, self.default_sample_rate)
+        if (sample_rate >= 1.0 or self._draw() < sample_rate) and (
+            self._is_within_rate_limit((record.name, template))
+        ):
+            return True
+
+        self._registry.increment("logging.suppressed")
+        return False
+
+
+class _DeferredFormattingQueueHandler(QueueHandler):
+    """Queue handler that leaves the formatting to the listener thread.
+
+    The record is enqueued as is: its arguments must not be mutated afterwards, which
+    holds for the (immutable) values logged by this application.
+    """
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return record
+
+
+def setup_logging(
+    level: int = logging.INFO,
+    handlers: Sequence[logging.Handler] | None = None,
+    sampling_filter: SamplingFilter | None = None,
+) -> QueueListener:
+    """Route the logs of the application through a queue to a background thread.
+
+    The emitting threads only filter and enqueue the records; formatting and writing
+    them is done by the returned listener, which is already started.
+    """
+    if handlers is None:
+        stream_handler = logging.StreamHandler()
+        stream_handler.setFormatter(logging.Formatter(_LOG_FORMAT))
+        handlers = [stream_handler]
+
+    log_queue: queue.SimpleQueue[logging.LogRecord] = queue.SimpleQueue()
+    queue_handler = _DeferredFormattingQueueHandler(log_queue)
+    queue_handler.addFilter(
+        SamplingFilter() if sampling_filter is None else sampling_filter
+    )
+
+    root_logger = logging.getLogger()
+    for handler in root_logger.handlers[:]:
+        root_logger.removeHandler(handler)
+    root_logger.addHandler(queue_handler)
+    root_logger.setLevel(level)
+
+    listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+    listener.start()
+    return listener
@@ -0,0 +1,144 @@
+"""Module for the detection of the code that blocks the event loop."""
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable
+
+from .admission import LoopLagMonitor
+from .metrics import MetricsRegistry, metrics
+
+logger = logging.getLogger(__name__)
+
+# Constants
+DEFAULT_BLOCKING_THRESHOLD = 0.1
+DEFAULT_MAX_BLOCKING_REPORTS = 100
+
+
+class EventLoopBlockedException(AssertionError):
+    """Exception when the event loop has been blocked (test mode)."""
+
+
+@dataclass(frozen=True)
+class BlockingReport:
+    """Describes a callback or a task step that blocked the event loop."""
+
+    duration: float
+    stack: str
+
+
+class LoopBlockingDetector:
+    """Watchdog that reports what blocks the event loop for longer than a threshold.
+
+    A thread watches the heartbeat of the loop (i.e. the task of a lag monitor, shared
+    with the admission control if given): when it stops for too long while the loop is
+    running, the stack of the loop thread is captured while it is still blocked, logged
+    and counted by the "eventloop.blocked" metric.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        threshold: float = DEFAULT_BLOCKING_THRESHOLD,
+        registry: MetricsRegistry = metrics,
+        max_reports: int = DEFAULT_MAX_BLOCKING_REPORTS,
+        clock: Callable[[], float] = time.monotonic,
+        lag_monitor: LoopLagMonitor | None = None,
+    ) -> None:
+        """Initialize a detector that is not started yet."""
+        self.threshold = threshold
+        self.interval = threshold / 4
+        self._owns_lag_monitor = lag_monitor is None
+        self.lag_monitor = (
+            LoopLagMonitor(interval=self.interval, registry=registry, clock=clock)
+            if lag_monitor is None
+            else lag_monitor
+        )
+        self._registry = registry
+        self._reports: deque[BlockingReport] = deque(maxlen=max_reports)
+        self._lock = threading.Lock()
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_thread_id: int | None = None
+        self._watchdog: threading.Thread | None = None
+        self._stopped = threading.Event()
+
+    @property
+    def reports(self) -> list[BlockingReport]:
+        """Return the most recent blockings."""
+        with self._lock:
+            return list(self._reports)
+
+    def _capture_loop_stack(self) -> str:
+        if self._loop_thread_id is None:
+            return ""  # pragma: nocover
+        frame = sys._current_frames().get(  # pylint: disable=protected-access
+            self._loop_thread_id
+        )
+        if frame is None:
+            return ""  # pragma: nocover
+        return "".join(traceback.format_stack(frame))
+
+    def _report(self, duration: float) -> None:
+        report = BlockingReport(duration=duration, stack=self._capture_loop_stack())
+        with self._lock:
+            self._reports.append(report)
+        self._registry.increment("eventloop.blocked")
+        logger.warning(
+            "Event loop blocked for more than %.3fs by:\n%s", duration, report.stack
+        )
+
+    def _watch(self) -> None:
+        blocked_beat = None
+        while not self._stopped.wait(self.interval):
+            if self._loop is None or self._loop.is_closed():
+                return
+            beat = self.lag_monitor.last_beat
+            if blocked_beat is not None and beat != blocked_beat:
+                # The loop is running again: the blocking is over
+                self._registry.observe("eventloop.blocked_time", beat - blocked_beat)
+                blocked_beat = None
+
+            # A loop that is not running is idle, not blocked
+            blocked_for = self.lag_monitor.clock() - beat - self.lag_monitor.interval
+            if (
+                blocked_beat is None
+                and blocked_for >= self.threshold
+                and self._loop.is_running()
+            ):
+                blocked_beat = beat
+                self._report(duration=blocked_for)
+
+    async def start(self) -> None:
+        """Start watching the running event loop."""
+        if self._watchdog is not None:
+            return
+
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        await self.lag_monitor.start()
+        self._stopped.clear()
+        self._watchdog = threading.Thread(
+            target=self._watch, name="loop-blocking-detector", daemon=True
+        )
+        self._watchdog.start()
+
+    async def stop(self) -> None:
+        """Stop watching the event loop."""
+        self._stopped.set()
+        if self._watchdog is not None:
+            self._watchdog.join()
+            self._watchdog = None
+        if self._owns_lag_monitor:
+            await self.lag_monitor.stop()
+
+    def check(self) -> None:
+        """Raise if the event loop has been blocked (i.e. test mode)."""
+        reports = self.reports
+        if reports:
+            raise EventLoopBlockedException(
+                f"Event loop blocked {len(reports)} time(s), first by:\n"
+                f"{reports[0].stack}"
+            )
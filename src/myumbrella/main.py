@@ -2,56 +2,226 @@
 """Main script for the umbrella application."""
 import asyncio
 import logging
+import os
+from typing import TYPE_CHECKING, Any
 
-import httpx
-import uvicorn
-from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
-
-from myumbrella.app import app
+from myumbrella import get_app_version
+from myumbrella.admission import (
+    DEFAULT_MAX_IN_FLIGHT,
+    DEFAULT_MAX_LOOP_LAG,
+    DEFAULT_QUEUE_TIMEOUT,
+    AdmissionControlMiddleware,
+    LoopLagMonitor,
+)
+from myumbrella.apikeys import APIKeyPool, load_key_quota_from_env_variable
+from myumbrella.cache import (
+    DEFAULT_OBSERVATION_RADIUS_KM,
+    AdaptiveTTLPolicy,
+    ObservationCache,
+)
 from myumbrella.dependencies import (
     DependencyNotInitializedException,
+    ProviderPipeline,
+    city_alias_index,
     umbrella_report_provider_dependency,
+    umbrella_response_cache,
+)
+from myumbrella.hedging import HedgingPolicy
+from myumbrella.logs import (
+    DEFAULT_LOG_RATE_LIMIT,
+    DEFAULT_LOG_SAMPLE_RATE,
+    SamplingFilter,
+    setup_logging,
 )
+from myumbrella.loopwatch import LoopBlockingDetector
 from myumbrella.openweather import (
     OpenweatherClient,
-    load_openweather_api_key_from_env_variable,
+    load_openweather_api_keys_from_env_variable,
 )
+from myumbrella.providers import CachingLayer, find_layer, provider_layers
+from myumbrella.sharedcache import DEFAULT_SHARED_CACHE_SLOTS, SharedReportCache
+
+if TYPE_CHECKING:  # pragma: nocover
+    import httpx
+    from fastapi import FastAPI, Request
+    from fastapi.responses import JSONResponse
+
+# Layers wrapped around the Openweather client, from the outermost to the innermost
+DEFAULT_PROVIDER_PIPELINE = "cache,nearby,coalesce,ratelimit,metrics"
+
+
+def __getattr__(name: str) -> Any:
+    """Import the (slow to import) FastAPI application only when it is needed."""
+    if name != "app":
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    from myumbrella.app import app  # pylint: disable=import-outside-toplevel
+
+    return app
 
 
 def _dependency_exception_handler(
-    _: Request, exc: DependencyNotInitializedException
-) -> JSONResponse:
+    _: "Request", exc: DependencyNotInitializedException
+) -> "JSONResponse":
+    # pylint: disable=import-outside-toplevel
+    from fastapi import status
+    from fastapi.responses import JSONResponse
+
     response = JSONResponse(
-        status_code=httpx.codes.INTERNAL_SERVER_ERROR, content={"detail": exc.args[0]}
+        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+        content={"detail": exc.args[0]},
     )
 
     return response
 
 
-def setup_application(application: FastAPI) -> FastAPI:
+def _create_openweather_transport() -> "httpx.BaseTransport | None":
+    # httpx is slow to import: it is only loaded here when a cassette is used
+    # pylint: disable=import-outside-toplevel
+    replay_path = os.environ.get("MYUMBRELLA_CASSETTE_REPLAY")
+    if replay_path is not None:
+        from myumbrella.cassette import ReplayTransport
+
+        return ReplayTransport(
+            path=replay_path,
+            latency_scale=float(
+                os.environ.get("MYUMBRELLA_CASSETTE_LATENCY_SCALE", "1.0")
+            ),
+            strict=False,
+        )
+
+    record_path = os.environ.get("MYUMBRELLA_CASSETTE_RECORD")
+    if record_path is not None:
+        from myumbrella.cassette import RecordingTransport
+        from myumbrella.transport import OpenweatherTransport
+
+        return RecordingTransport(path=record_path, transport=OpenweatherTransport())
+
+    return None
+
+
+def setup_application(application: "FastAPI") -> "FastAPI":
     """Set up the application."""
-    client = OpenweatherClient(api_key=load_openweather_api_key_from_env_variable())
+    # Querying the package metadata is slow: it is only done once the app is set up
+    application.version = get_app_version()
+
+    radius_km = float(
+        os.environ.get(
+            "MYUMBRELLA_OBSERVATION_RADIUS_KM", DEFAULT_OBSERVATION_RADIUS_KM
+        )
+    )
+    hedging_budget = os.environ.get("MYUMBRELLA_HEDGING_BUDGET")
+    client = OpenweatherClient(
+        api_key=APIKeyPool(
+            keys=load_openweather_api_keys_from_env_variable(),
+            quota_per_minute=load_key_quota_from_env_variable(),
+        ),
+        observation_cache=ObservationCache(
+            radius_km=radius_km, policy=AdaptiveTTLPolicy()
+        ),
+        alias_index=city_alias_index,
+        transport=_create_openweather_transport(),
+        hedging=(
+            None
+            if hedging_budget is None
+            else HedgingPolicy(budget=float(hedging_budget))
+        ),
+    )
+    umbrella_report_provider_dependency.pipeline = ProviderPipeline.from_names(
+        names=os.environ.get("MYUMBRELLA_PROVIDER_PIPELINE", DEFAULT_PROVIDER_PIPELINE),
+        registry=provider_layers(alias_index=city_alias_index),
+    )
     umbrella_report_provider_dependency.provider = client
 
+    # Encoded responses can only be cached if they can follow the report cache
+    served_provider = umbrella_report_provider_dependency()
+    caching_layer = find_layer(served_provider, CachingLayer)
+    if caching_layer is not None:
+        umbrella_response_cache.attach(caching_layer.cache)
+
+        # The workers of a host can share their reports through a memory segment
+        shared_cache_name = os.environ.get("MYUMBRELLA_SHARED_CACHE")
+        if shared_cache_name is not None:
+            shared_cache = SharedReportCache(
+                name=shared_cache_name,
+                slots=int(
+                    os.environ.get(
+                        "MYUMBRELLA_SHARED_CACHE_SLOTS", DEFAULT_SHARED_CACHE_SLOTS
+                    )
+                ),
+            )
+            caching_layer.cache.shared = shared_cache
+            application.add_event_handler("shutdown", shared_cache.close)
+
+    # Connections are opened before traffic arrives and kept open while idle
+    application.add_event_handler("startup", client.warm_up)
+    application.add_event_handler("startup", client.start_keepalive)
+    application.add_event_handler("shutdown", client.close)
+
     application.add_exception_handler(
         exc_class_or_status_code=DependencyNotInitializedException,
         handler=_dependency_exception_handler,
     )
+
+    # Opt-in detection of the code that blocks the event loop (it watches the lag
+    # monitor: it is stopped before it)
+    lag_monitor = LoopLagMonitor()
+    blocking_threshold = os.environ.get("MYUMBRELLA_LOOP_BLOCKING_THRESHOLD")
+    if blocking_threshold is not None:
+        blocking_detector = LoopBlockingDetector(
+            threshold=float(blocking_threshold), lag_monitor=lag_monitor
+        )
+        application.add_event_handler("startup", blocking_detector.start)
+        application.add_event_handler("shutdown", blocking_detector.stop)
+
+    # Requests that cannot be served in time are rejected instead of piling up
+    application.add_event_handler("startup", lag_monitor.start)
+    application.add_event_handler("shutdown", lag_monitor.stop)
+    application.add_middleware(
+        AdmissionControlMiddleware,
+        max_in_flight=int(
+            os.environ.get("MYUMBRELLA_MAX_IN_FLIGHT", DEFAULT_MAX_IN_FLIGHT)
+        ),
+        queue_timeout=float(
+            os.environ.get("MYUMBRELLA_QUEUE_TIMEOUT", DEFAULT_QUEUE_TIMEOUT)
+        ),
+        max_loop_lag=float(
+            os.environ.get("MYUMBRELLA_MAX_LOOP_LAG", DEFAULT_MAX_LOOP_LAG)
+        ),
+        lag_monitor=lag_monitor,
+    )
     return application
 
 
 async def main() -> None:  # pragma: nocover
     """Launch the umbrella app."""
-    logging.basicConfig(level=logging.INFO)
+    # pylint: disable=import-outside-toplevel
+    import uvicorn
+
+    from myumbrella.app import app
+
+    log_listener = setup_logging(
+        level=logging.INFO,
+        sampling_filter=SamplingFilter(
+            default_sample_rate=float(
+                os.environ.get("MYUMBRELLA_LOG_SAMPLE_RATE", DEFAULT_LOG_SAMPLE_RATE)
+            ),
+            rate_limit=int(
+                os.environ.get("MYUMBRELLA_LOG_RATE_LIMIT", DEFAULT_LOG_RATE_LIMIT)
+            ),
+        ),
+    )
 
     application = setup_application(application=app)
 
+    # Without its own log config, uvicorn logs through the queue as well
     config = uvicorn.Config(
-        app=application, host="0.0.0.0", port=5000, log_level="info"
+        app=application, host="0.0.0.0", port=5000, log_level="info", log_config=None
     )
     server = uvicorn.Server(config)
-    await server.serve()
+    try:
+        await server.serve()
+    finally:
+        log_listener.stop()
 
 
 if __name__ == "__main__":  # pragma: nocover
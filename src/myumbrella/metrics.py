@@ -0,0 +1,76 @@
+"""Module for the in-process metrics of the application."""
+import threading
+from dataclasses import dataclass
+
+
+@dataclass()
+class Summary:
+    """Aggregates the observed values of a metric (e.g. latencies in seconds)."""
+
+    count: int = 0
+    total: float = 0.0
+    maximum: float = 0.0
+
+    @property
+    def mean(self) -> float:
+        """Return the mean of the observed values."""
+        if self.count == 0:
+            return 0.0
+        return self.total / self.count
+
+
+class MetricsRegistry:
+    """Thread-safe store for counters and summaries."""
+
+    def __init__(self) -> None:
+        """Initialize an empty registry."""
+        self._counters: dict[str, int] = {}
+        self._summaries: dict[str, Summary] = {}
+        self._lock = threading.Lock()
+
+    def increment(self, name: str, value: int = 1) -> None:
+        """Increment a counter."""
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def observe(self, name: str, value: float) -> None:
+        """Record a value in a summary."""
+        with self._lock:
+            summary = self._summaries.setdefault(name, Summary())
+            summary.count += 1
+            summary.total += value
+            summary.maximum = max(summary.maximum, value)
+
+    def counter(self, name: str) -> int:
+        """Return the current value of a counter."""
+        return self._counters.get(name, 0)
+
+    def summary(self, name: str) -> Summary:
+        """Return a copy of a summary."""
+        with self._lock:
+            summary = self._summaries.get(name, Summary())
+            return Summary(summary.count, summary.total, summary.maximum)
+
+    def reset(self) -> None:
+        """Forget all the metrics."""
+        with self._lock:
+            self._counters.clear()
+            self._summaries.clear()
+
+    def snapshot(self) -> dict[str, dict]:
+        """Return all the metrics as a JSON-friendly dict."""
+        with self._lock:
+            return {
+                "counters": dict(self._counters),
+                "summaries": {
+                    name: {
+                        "count": summary.count,
+                        "mean": summary.mean,
+                        "max": summary.maximum,
+                    }
+                    for name, summary in self._summaries.items()
+                },
+            }
+
+
+metrics = MetricsRegistry()
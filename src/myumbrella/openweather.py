@@ -1,17 +1,32 @@
 """Module for the Openweather API Client."""
 import logging
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from typing import Any
+from typing import TYPE_CHECKING, Any
 
-import httpx
+from .apikeys import APIKeyPool, APIKeysExhaustedException
+from .cache import ObservationCache
+from .core import (
+    Location,
+    LocationNotFoundException,
+    UmbrellaReport,
+    UpstreamErrorException,
+    WeatherState,
+)
+from .hedging import HedgingPolicy
+from .locations import AliasIndex, canonicalize_city_query
+from .metrics import metrics
 
-from .core import Location, LocationNotFoundException, UmbrellaReport, WeatherState
+if TYPE_CHECKING:  # pragma: nocover
+    import httpx
 
 logger = logging.getLogger(__name__)
 
 # Constants
 OPENWEATHER_HOST = "https://api.openweathermap.org"
+DEFAULT_KEEPALIVE_INTERVAL = 30.0
 # See https://openweathermap.org/weather-conditions#Weather-Condition-Codes-2
 _OPENWEATHER_CATEGORY_TO_WEATHERSTATE = {
     "2": WeatherState.THUNDERSTORM,
@@ -21,12 +36,25 @@ _OPENWEATHER_CATEGORY_TO_WEATHERSTATE = {
     "8": WeatherState.CLOUDS,
 }
 _OPENWEATHER_CODE_TO_WEATHERSTATE = {800: WeatherState.CLEAR, 741: WeatherState.FOG}
+# Status codes for an invalid API key and for a key exceeding its plan
+_REJECTED_KEY_STATUS_CODES = (401, 429)
+# Tolerance (in degrees, i.e. ~10 m) to consider that a location did not move
+_COORDINATES_TOLERANCE = 1e-4
 
 
 class NoAPIKeyAvailableException(IOError):
     """Exception raised when no API key can be loaded."""
 
 
+class APIKeyRejectedException(IOError):
+    """Exception raised when Openweather rejects the API key of a call (401 or 429)."""
+
+    def __init__(self, status_code: int) -> None:
+        """Initialize the exception from the status code of the response."""
+        super().__init__(f"Openweather rejected the API key ({status_code})")
+        self.status_code = status_code
+
+
 def load_openweather_api_key_from_env_variable(
     env_var_name: str = "OPENWEATHER_API_KEY",
 ) -> str:
@@ -54,6 +82,27 @@ def load_openweather_api_key_from_env_variable(
     return env_var_value
 
 
+def load_openweather_api_keys_from_env_variable(
+    env_var_name: str = "OPENWEATHER_API_KEY",
+) -> list[str]:
+    """Load several Openweather's API keys from an environment variable.
+
+    This environment variable can contain either:
+        1. the actual API keys, separated by commas
+    or
+        2. the path to the file where the API keys are stored, one per line
+    """
+    env_var_value = load_openweather_api_key_from_env_variable(env_var_name)
+    separator = "\n" if "\n" in env_var_value else ","
+    keys = [key.strip() for key in env_var_value.split(separator)]
+    keys = [key for key in keys if key and not key.startswith("#")]
+    if not keys:
+        raise NoAPIKeyAvailableException(
+            f"Impossible to load API keys: '{env_var_name}' contains no key"
+        )
+    return keys
+
+
 def convert_openweather_code_to_weatherstate(code: int) -> WeatherState:
     """Convert an Openweather Condition code to a WeatherState.
 
@@ -74,34 +123,161 @@ def convert_openweather_code_to_weatherstate(code: int) -> WeatherState:
     return WeatherState.UNKNOWN
 
 
+def _have_same_coordinates(location: Location, other: Location) -> bool:
+    return (
+        abs(location.latitude - other.latitude) <= _COORDINATES_TOLERANCE
+        and abs(location.longitude - other.longitude) <= _COORDINATES_TOLERANCE
+    )
+
+
 class OpenweatherClient:
     """Main class to handle communication with the Openweather API."""
 
-    def __init__(self, api_key: str, openweather_host: str = OPENWEATHER_HOST) -> None:
-        """Initialize an OpenweatherClient based on a optionnally specified configuration."""
+    def __init__(
+        self,
+        api_key: str | APIKeyPool,
+        openweather_host: str = OPENWEATHER_HOST,
+        observation_cache: ObservationCache | None = None,
+        hedging: HedgingPolicy | None = None,
+        transport: "httpx.BaseTransport | None" = None,
+        alias_index: AliasIndex | None = None,
+    ) -> None:
+        """Initialize an OpenweatherClient based on a optionnally specified configuration.
+
+        When an observation cache is given, fresh observations made close enough to the
+        requested coordinates are reused instead of calling the weather API.
+        When a hedging policy is given, slow calls are hedged by a second request.
+        Unless a transport is given, an OpenweatherTransport is used.
+        When an alias index is given, the known spellings of a city are not geocoded.
+        When an API key pool is given, the calls are spread across its keys.
+        """
         self.host = openweather_host
-        self.api_key = api_key
+        self.api_keys = (
+            APIKeyPool([api_key], quota_per_minute=None)
+            if isinstance(api_key, str)
+            else api_key
+        )
+        self.observation_cache = observation_cache
+        self.hedging = hedging
+        self._transport = transport
+        self.alias_index = alias_index
+        self._http_client: "httpx.Client | None" = None
+        self._http_client_lock = threading.Lock()
+        self._keepalive_stopped = threading.Event()
+        self._keepalive_thread: threading.Thread | None = None
+        self._executor = ThreadPoolExecutor(thread_name_prefix="openweather")
+
+    @property
+    def http_client(self) -> "httpx.Client":
+        """HTTP client (and its connections) shared by all the calls."""
+        with self._http_client_lock:
+            if self._http_client is None:
+                # httpx is slow to import: only load it once the client actually needs it
+                # pylint: disable=import-outside-toplevel
+                import httpx
+
+                from .transport import OpenweatherTransport
+
+                transport = self._transport
+                if transport is None:
+                    transport = OpenweatherTransport()
+                self._http_client = httpx.Client(transport=transport)
+            return self._http_client
+
+    def warm_up(self) -> None:
+        """Open (or keep open) the connection to the Openweather host."""
+        # pylint: disable=import-outside-toplevel
+        import httpx
+
+        try:
+            self.http_client.head(self.host)
+        except httpx.HTTPError as exc:
+            logger.warning("Could not warm up connection to '%s': %s", self.host, exc)
+
+    def _keep_alive(self, interval: float) -> None:
+        while not self._keepalive_stopped.wait(timeout=interval):
+            self.warm_up()
+
+    def start_keepalive(self, interval: float = DEFAULT_KEEPALIVE_INTERVAL) -> None:
+        """Ping the Openweather host periodically so that idle connections stay open."""
+        with self._http_client_lock:
+            if self._keepalive_thread is not None and self._keepalive_thread.is_alive():
+                return
+            self._keepalive_stopped.clear()
+            self._keepalive_thread = threading.Thread(
+                target=self._keep_alive,
+                args=(interval,),
+                name="openweather-keepalive",
+                daemon=True,
+            )
+            self._keepalive_thread.start()
+
+    def close(self) -> None:
+        """Stop the keep-alive pings and close the connections."""
+        self._keepalive_stopped.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        with self._http_client_lock:
+            self._keepalive_thread = None
+            if self._http_client is not None:
+                self._http_client.close()
+                self._http_client = None
+
+    def _send_request(self, url: str, params: dict) -> Any:
+        api_response = self.http_client.get(url=url, params=params)
+        if api_response.status_code in _REJECTED_KEY_STATUS_CODES:
+            raise APIKeyRejectedException(status_code=api_response.status_code)
+        if api_response.is_error:
+            raise UpstreamErrorException(
+                f"Openweather answered {api_response.status_code} to {url}"
+            )
+        return api_response.json()
 
     def _call_rest_api(self, endpoint: str, params: dict) -> Any:
         url = f"{self.host}/{endpoint}"
-        api_params = params.copy()
-        api_params["appid"] = self.api_key
 
-        api_response = httpx.get(url=url, params=api_params)
-        return api_response.json()
+        # A rejected key is rotated out and the call is retried with another key
+        for _ in range(len(self.api_keys)):
+            api_key = self.api_keys.acquire()
+            api_params = {**params, "appid": api_key}
+            try:
+                if self.hedging is None:
+                    return self._send_request(url=url, params=api_params)
+                return self.hedging.call(
+                    endpoint=endpoint,
+                    send=lambda: self._send_request(url=url, params=api_params),
+                )
+            except APIKeyRejectedException as exc:
+                self.api_keys.reject(api_key, status_code=exc.status_code)
+        raise APIKeysExhaustedException("Openweather rejected all the API keys tried")
 
     def _get_location_from_description(self, description: str) -> Location:
-        logger.info("Calling Openweather geocoding API for '%s'", description)
-        api_response: list[dict[str, str | float | dict]] = self._call_rest_api(
-            endpoint="geo/1.0/direct", params={"q": description}
-        )
+        query = canonicalize_city_query(description)
+        if self.alias_index is not None:
+            known_location = self.alias_index.lookup(query)
+            if known_location is not None:
+                logger.info("Location for '%s' is already known", description)
+                return known_location
 
-        try:
-            location_json = api_response[0]
-        except (IndexError, KeyError) as exc:
-            msg = f"Location '{description}' is unknown to Openweather Geocoding API!"
-            logger.error(msg)
-            raise LocationNotFoundException(msg) from exc
+        logger.info("Calling Openweather geocoding API for '%s'", query.geocoding_query)
+        api_response: list[dict[str, str | float | dict]] = []
+        if query.name:
+            api_response = self._call_rest_api(
+                endpoint="geo/1.0/direct", params={"q": query.geocoding_query}
+            )
+
+        # Only an empty list means that the location is unknown (and can be cached)
+        if not isinstance(api_response, list):
+            raise UpstreamErrorException(
+                f"Openweather Geocoding API failed for '{description}': {api_response}"
+            )
+        if not api_response:
+            logger.error(
+                "Location '%s' is unknown to Openweather Geocoding API!", description
+            )
+            raise LocationNotFoundException(
+                f"Location '{description}' is unknown to Openweather Geocoding API!"
+            )
+        location_json = api_response[0]
 
         city = str(location_json.get("name", "city"))
         state = str(location_json.get("state", "state"))
@@ -124,19 +300,25 @@ class OpenweatherClient:
             latitude,
             longitude,
         )
+        if self.alias_index is not None:
+            self.alias_index.learn(query, location)
         return location
 
-    def _get_weather_code_for_location(self, location: Location) -> int:
+    def _get_weather_for_coordinates(self, latitude: float, longitude: float) -> dict:
         logger.info(
             "Calling Openweather weather API for latitude=%.3f and longitude=%.3f",
-            location.latitude,
-            location.longitude,
+            latitude,
+            longitude,
         )
-        weather_response = self._call_rest_api(
+        weather_response: dict = self._call_rest_api(
             "data/2.5/weather",
-            params={"lat": location.latitude, "lon": location.longitude},
+            params={"lat": latitude, "lon": longitude},
         )
-        weather = weather_response.get("weather")[0]
+        return weather_response
+
+    @staticmethod
+    def _get_weather_code_from_response(weather_response: dict) -> int:
+        weather = weather_response.get("weather")[0]  # type: ignore
         weather_code = int(weather["id"])
         logger.info(
             "Returned weather: %s (code: %i)",
@@ -146,12 +328,94 @@ class OpenweatherClient:
 
         return weather_code
 
+    def _get_weather_for_location(self, location: Location) -> dict:
+        return self._get_weather_for_coordinates(
+            latitude=location.latitude, longitude=location.longitude
+        )
+
+    @staticmethod
+    def _get_observation_time_from_response(weather_response: dict) -> float | None:
+        # Time (UNIX, UTC) at which Openweather calculated the returned data
+        observed_at = weather_response.get("dt")
+        return None if observed_at is None else float(observed_at)
+
+    def _build_report(
+        self, location: Location, weather_response: dict
+    ) -> UmbrellaReport:
+        weather_code = self._get_weather_code_from_response(weather_response)
+        report = UmbrellaReport(
+            location=location,
+            weather=convert_openweather_code_to_weatherstate(code=weather_code),
+            observed_at=self._get_observation_time_from_response(weather_response),
+        )
+        if self.observation_cache is not None:
+            self.observation_cache.add(report)
+        return report
+
+    def _get_stale_location(self, city: str) -> Location | None:
+        if self.alias_index is None:
+            return None
+
+        query = canonicalize_city_query(city)
+        if self.alias_index.lookup(query) is not None:
+            return None
+        return self.alias_index.lookup(query, include_stale=True)
+
+    def _get_location_and_weather(self, city: str) -> tuple[Location, dict]:
+        stale_location = self._get_stale_location(city)
+        if stale_location is None:
+            location = self._get_location_from_description(description=city)
+            return location, self._get_weather_for_location(location)
+
+        # Speculate that the city did not move while its location is revalidated
+        speculative_weather = self._executor.submit(
+            self._get_weather_for_location, stale_location
+        )
+        try:
+            location = self._get_location_from_description(description=city)
+        except BaseException:
+            speculative_weather.cancel()
+            raise
+
+        if _have_same_coordinates(location, stale_location):
+            metrics.increment("openweather.speculation.hits")
+            return location, speculative_weather.result()
+
+        metrics.increment("openweather.speculation.misses")
+        speculative_weather.cancel()
+        return location, self._get_weather_for_location(location)
+
     def get_umbrella_report(self, city: str) -> UmbrellaReport:
-        """Call Openweather API for a location and build a weather report."""
-        location = self._get_location_from_description(description=city)
+        """Call Openweather API for a location and build a weather report.
+
+        When the location of the city is known but has to be revalidated, the weather
+        is fetched for the known coordinates while the city is geocoded again.
+        """
+        location, weather_response = self._get_location_and_weather(city)
+        return self._build_report(location=location, weather_response=weather_response)
 
-        weather_code = self._get_weather_code_for_location(location)
+    def get_umbrella_report_at(
+        self, latitude: float, longitude: float
+    ) -> UmbrellaReport:
+        """Build a weather report for coordinates, without calling the geocoding API."""
+        if self.observation_cache is not None:
+            cached_report = self.observation_cache.find_nearest(latitude, longitude)
+            if cached_report is not None:
+                logger.info(
+                    "Reusing observation made at latitude=%.3f and longitude=%.3f",
+                    cached_report.location.latitude,
+                    cached_report.location.longitude,
+                )
+                return cached_report
 
-        weatherstate = convert_openweather_code_to_weatherstate(code=weather_code)
+        weather_response = self._get_weather_for_coordinates(latitude, longitude)
 
-        return UmbrellaReport(location=location, weather=weatherstate)
+        system = weather_response.get("sys", {})
+        location = Location(
+            city=str(weather_response.get("name") or "city"),
+            state="state",
+            country=str(system.get("country", "country")),
+            latitude=latitude,
+            longitude=longitude,
+        )
+        return self._build_report(location=location, weather_response=weather_response)
@@ -0,0 +1,172 @@
+"""Module for the on-demand profiling of a worker (CPU samples and allocations)."""
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from dataclasses import dataclass
+from types import FrameType
+from typing import Callable
+
+# Constants
+DEFAULT_SAMPLING_INTERVAL = 0.01
+DEFAULT_ALLOCATIONS_TOP = 20
+# Categories of the samples, by priority: the first one matching a frame of the stack
+# wins (e.g. the SSL reads made for OpenweatherClient count as "openweather")
+_CATEGORIES = (
+    (
+        "openweather",
+        ("myumbrella.openweather", "myumbrella.transport", "httpx", "httpcore"),
+    ),
+    ("serialization", ("pydantic", "fastapi.encoders", "json")),
+    ("app", ("myumbrella",)),
+    ("framework", ("fastapi", "starlette", "uvicorn", "anyio", "asyncio")),
+)
+# Modules where an idle thread (or event loop) waits for work
+_IDLE_MODULES = frozenset(
+    {"threading", "selectors", "queue", "concurrent.futures.thread"}
+)
+
+
+# Tracing allocations is process-wide: a single snapshot is taken at a time
+_allocations_lock = threading.Lock()
+
+
+class ProfilerBusyException(RuntimeError):
+    """Exception raised when a profile is requested while another one runs."""
+
+
+def _get_module(frame: FrameType) -> str:
+    return str(frame.f_globals.get("__name__", "?"))
+
+
+def _is_in_package(module: str, package: str) -> bool:
+    return module == package or module.startswith(f"{package}.")
+
+
+def _categorize(modules: list[str]) -> str:
+    # Modules are listed from the innermost frame
+    if modules[0] in _IDLE_MODULES:
+        return "idle"
+    for category, packages in _CATEGORIES:
+        if any(
+            _is_in_package(module, package)
+            for module in modules
+            for package in packages
+        ):
+            return category
+    return "other"
+
+
+def collapse_stack(frame: FrameType) -> str:
+    """Return a stack as a collapsed line: "category;outermost;...;innermost"."""
+    labels: list[str] = []
+    modules: list[str] = []
+    current: FrameType | None = frame
+    while current is not None:
+        module = _get_module(current)
+        modules.append(module)
+        labels.append(f"{module}:{current.f_code.co_name}")
+        current = current.f_back
+    labels.reverse()
+    return ";".join([_categorize(modules), *labels])
+
+
+class SamplingProfiler:
+    """Profiler sampling the stacks of all the threads of the process at an interval.
+
+    Only the stacks are read at each sample (no tracing), so the overhead does not
+    depend on the code being profiled. A single profile runs at a time.
+    """
+
+    def __init__(
+        self,
+        interval: float = DEFAULT_SAMPLING_INTERVAL,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        """Initialize a profiler taking a sample every interval seconds."""
+        self.interval = interval
+        self._clock = clock
+        self._sleep = sleep
+        self._lock = threading.Lock()
+
+    def sample(self) -> list[str]:
+        """Return the collapsed stacks of the other threads."""
+        own_thread_id = threading.get_ident()
+        frames = sys._current_frames()  # pylint: disable=protected-access
+        return [
+            collapse_stack(frame)
+            for thread_id, frame in frames.items()
+            if thread_id != own_thread_id
+        ]
+
+    def profile(self, seconds: float) -> Counter[str]:
+        """Sample the threads for some seconds and count the collapsed stacks."""
+        if not self._lock.acquire(blocking=False):
+            raise ProfilerBusyException("A profile is already running on this worker")
+
+        try:
+            stacks: Counter[str] = Counter()
+            end = self._clock() + seconds
+            while self._clock() < end:
+                stacks.update(self.sample())
+                self._sleep(self.interval)
+            return stacks
+        finally:
+            self._lock.release()
+
+
+def format_collapsed_stacks(stacks: Counter[str]) -> str:
+    """Format the stacks for flame graph tools (one "stack count" line per stack)."""
+    return "".join(f"{stack} {count}\n" for stack, count in stacks.most_common())
+
+
+@dataclass(frozen=True)
+class AllocationStatistic:
+    """Describes the memory allocated from a line of code."""
+
+    location: str
+    size: int
+    count: int
+
+
+def take_allocations_snapshot(
+    top: int = DEFAULT_ALLOCATIONS_TOP,
+    seconds: float = 0.0,
+    sleep: Callable[[float], None] = time.sleep,
+) -> list[AllocationStatistic]:
+    """Return the top lines of code by allocated memory.
+
+    Unless allocations are already traced (e.g. PYTHONTRACEMALLOC is set), they are
+    traced for some seconds only: the snapshot then shows what is allocated, and still
+    alive, during that time.
+    """
+    if not _allocations_lock.acquire(blocking=False):
+        raise ProfilerBusyException("Allocations are already traced on this worker")
+
+    was_tracing = tracemalloc.is_tracing()
+    try:
+        if not was_tracing:
+            tracemalloc.start()
+            sleep(seconds)
+        snapshot = tracemalloc.take_snapshot()
+    finally:
+        if not was_tracing:
+            tracemalloc.stop()
+        _allocations_lock.release()
+
+    snapshot = snapshot.filter_traces(
+        (
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+        )
+    )
+    return [
+        AllocationStatistic(
+            location=f"{statistic.traceback[0].filename}:{statistic.traceback[0].lineno}",
+            size=statistic.size,
+            count=statistic.count,
+        )
+        for statistic in snapshot.statistics("lineno")[:top]
+    ]
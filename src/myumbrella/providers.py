@@ -0,0 +1,574 @@
+"""Module for the layers that can be stacked around an UmbrellaReportProvider."""
+import itertools
+import math
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from contextlib import contextmanager
+from contextvars import ContextVar
+from enum import Enum
+from functools import partial
+from typing import Any, Callable, Iterator, TypeVar
+
+from .cache import AdaptiveTTLPolicy, NegativeCache, ObservationCache, ReportCache
+from .core import LocationNotFoundException, UmbrellaReport, UmbrellaReportProvider
+from .dependencies import ProviderLayerFactory
+from .locations import AliasIndex
+from .metrics import MetricsRegistry, metrics
+
+# Constants
+DEFAULT_RATE_LIMIT_PER_SECOND = 1.0
+DEFAULT_RATE_LIMIT_BURST = 60
+DEFAULT_RATE_LIMIT_MAX_WAIT = 5.0
+DEFAULT_FALLBACK_DEADLINE = 1.0
+DEFAULT_LATENCY_SMOOTHING = 0.2
+DEFAULT_RACING_WORKERS = 32
+DEFAULT_PROBE_EVERY = 20
+
+ReportFetcher = Callable[[], UmbrellaReport]
+ProviderCall = Callable[[Any], UmbrellaReport]
+LayerT = TypeVar("LayerT", bound="ProviderLayer")
+
+# Set while the upstream calls have already been paid for (e.g. by a map)
+_prepaid_calls: ContextVar[bool] = ContextVar("prepaid_calls", default=False)
+
+
+class RateLimitExceededException(IOError):
+    """Exception raised when a call would exceed the upstream rate limit."""
+
+
+class TokenBucket:
+    """Thread-safe token bucket rate limiter."""
+
+    def __init__(
+        self,
+        rate: float = DEFAULT_RATE_LIMIT_PER_SECOND,
+        capacity: int = DEFAULT_RATE_LIMIT_BURST,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        """Initialize a full bucket refilled with rate tokens per second."""
+        self.rate = rate
+        self.capacity = capacity
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = float(capacity)
+        self._last_refill = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self) -> None:
+        now = self._clock()
+        self._tokens = min(
+            self.capacity, self._tokens + (now - self._last_refill) * self.rate
+        )
+        self._last_refill = now
+
+    def available(self) -> float:
+        """Return the number of tokens that can be taken right away."""
+        with self._lock:
+            self._refill()
+            return max(0.0, self._tokens)
+
+    def take(self, count: int) -> int:
+        """Take at most count tokens right away, and return the number of tokens taken."""
+        with self._lock:
+            self._refill()
+            taken = max(0, min(count, math.floor(self._tokens)))
+            self._tokens -= taken
+            return taken
+
+    def _reserve(self, max_wait: float) -> float | None:
+        with self._lock:
+            self._refill()
+            wait = max(0.0, (1.0 - self._tokens) / self.rate)
+            if wait > max_wait:
+                return None
+
+            # The token is taken right away (possibly in advance) to keep callers in order
+            self._tokens -= 1.0
+            return wait
+
+    def acquire(self, max_wait: float = DEFAULT_RATE_LIMIT_MAX_WAIT) -> None:
+        """Take a token, waiting at most max_wait seconds for it."""
+        wait = self._reserve(max_wait=max_wait)
+        if wait is None:
+            raise RateLimitExceededException(
+                f"Upstream rate limit of {self.rate:g} calls/s exceeded"
+            )
+        if wait > 0:
+            self._sleep(wait)
+
+
+@contextmanager
+def prepaid_calls() -> Iterator[None]:
+    """Let the calls made in this context through the rate limits (already paid for)."""
+    token = _prepaid_calls.set(True)
+    try:
+        yield
+    finally:
+        _prepaid_calls.reset(token)
+
+
+def _coordinates_key(latitude: float, longitude: float) -> str:
+    return f"@{latitude:.5f},{longitude:.5f}"
+
+
+class QueryKey:
+    """Key of a query, only computed by the layers that need it (and only once).
+
+    City queries are keyed by an alias index, so that the equivalent spellings of a
+    city share the same key.
+    """
+
+    def __init__(self, city: str | None = None, key: str | None = None) -> None:
+        """Initialize the key of a city query, or a key that is already known."""
+        self.city = city
+        self._key = key
+
+    def resolve(self, alias_index: AliasIndex) -> str:
+        """Return the key of the query, computing it on first use."""
+        if self._key is None:
+            self._key = alias_index.cache_key(str(self.city))
+        return self._key
+
+    def refresh(self, alias_index: AliasIndex) -> str:
+        """Compute the key of a city query again (e.g. once its city was learned)."""
+        if self.city is not None:
+            self._key = alias_index.cache_key(self.city)
+        return self.resolve(alias_index)
+
+
+class ProviderLayer:
+    """Base class for the layers wrapped around an UmbrellaReportProvider.
+
+    Subclasses only have to override `_around` to add their behaviour to both city and
+    coordinates queries. The key of a city query is passed down the stacked layers, so
+    that it is computed once, by the first layer that resolves it. Coordinates queries
+    are only exposed when the wrapped provider supports them. The layers that can serve
+    a query without the provider override `peek_at` too.
+    """
+
+    def __init__(self, provider: UmbrellaReportProvider) -> None:
+        """Wrap a provider."""
+        self.provider = provider
+
+    def _around(self, key: QueryKey, fetch: ReportFetcher) -> UmbrellaReport:
+        return fetch()
+
+    def _get_city_report(self, city: str, key: QueryKey) -> UmbrellaReport:
+        return self._around(key=key, fetch=lambda: self._fetch_city_report(city, key))
+
+    def _fetch_city_report(self, city: str, key: QueryKey) -> UmbrellaReport:
+        if isinstance(self.provider, ProviderLayer):
+            # pylint: disable-next=protected-access
+            return self.provider._get_city_report(city=city, key=key)
+        return self.provider.get_umbrella_report(city=city)
+
+    def peek_at(self, latitude: float, longitude: float) -> UmbrellaReport | None:
+        """Return the report of a layer for coordinates, without calling the provider."""
+        if isinstance(self.provider, ProviderLayer):
+            return self.provider.peek_at(latitude=latitude, longitude=longitude)
+        return None
+
+    def get_umbrella_report(self, city: str) -> UmbrellaReport:
+        """Retrieve the umbrella report for a city."""
+        return self._get_city_report(city=city, key=QueryKey(city=city))
+
+    def __getattr__(self, name: str) -> Any:
+        """Expose the coordinates queries when the wrapped provider supports them."""
+        if name != "get_umbrella_report_at":
+            raise AttributeError(name)
+        get_report_at = getattr(self.provider, name)
+
+        def get_umbrella_report_at(latitude: float, longitude: float) -> UmbrellaReport:
+            return self._around(
+                key=QueryKey(key=_coordinates_key(latitude, longitude)),
+                fetch=lambda: get_report_at(latitude=latitude, longitude=longitude),
+            )
+
+        return get_umbrella_report_at
+
+
+class CachingLayer(ProviderLayer):
+    """Serve the reports from a cache, only calling the provider on misses.
+
+    Unless given a cache, the reports are cached with an adaptive TTL policy. The
+    locations that are not found are cached too (for a shorter time) in order not to
+    query them again on every typo. Cities are keyed by the given alias index (the one
+    the provider learns the cities with).
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        provider: UmbrellaReportProvider,
+        cache: ReportCache | None = None,
+        registry: MetricsRegistry = metrics,
+        negative_cache: NegativeCache | None = None,
+        alias_index: AliasIndex | None = None,
+    ) -> None:
+        """Wrap a provider with a report cache."""
+        super().__init__(provider=provider)
+        self.cache = ReportCache(policy=AdaptiveTTLPolicy()) if cache is None else cache
+        self.negative_cache = (
+            NegativeCache() if negative_cache is None else negative_cache
+        )
+        self.alias_index = AliasIndex() if alias_index is None else alias_index
+        self._registry = registry
+
+    def _around(self, key: QueryKey, fetch: ReportFetcher) -> UmbrellaReport:
+        cache_key = key.resolve(self.alias_index)
+        report = self.cache.get(cache_key)
+        if report is not None:
+            self._registry.increment("cache.hits")
+            return report
+
+        not_found_message = self.negative_cache.get(cache_key)
+        if not_found_message is not None:
+            self._registry.increment("cache.negative_hits")
+            raise LocationNotFoundException(not_found_message)
+
+        self._registry.increment("cache.misses")
+        try:
+            report = fetch()
+        except LocationNotFoundException as exc:
+            self.negative_cache.set(cache_key, str(exc))
+            raise
+        self.cache.set(cache_key, report)
+
+        # The city may have just been learned by the alias index: its key has changed
+        learned_key = key.refresh(self.alias_index)
+        if learned_key != cache_key:
+            self.cache.set(learned_key, report)
+        return report
+
+    def peek_at(self, latitude: float, longitude: float) -> UmbrellaReport | None:
+        """Return the report of a layer for coordinates, without calling the provider."""
+        report = self.cache.peek(_coordinates_key(latitude, longitude))
+        if report is not None:
+            return report
+        return super().peek_at(latitude=latitude, longitude=longitude)
+
+
+class ObservationLayer(ProviderLayer):
+    """Reuse a fresh observation made near the requested coordinates.
+
+    Unless given a cache, the observation cache of the wrapped provider is used (if
+    any). The lookup is done in front of the inner layers, so that a reused observation
+    is neither rate limited nor counted as a provider call.
+    """
+
+    def __init__(
+        self,
+        provider: UmbrellaReportProvider,
+        observations: ObservationCache | None = None,
+        registry: MetricsRegistry = metrics,
+    ) -> None:
+        """Wrap a provider with an observation cache."""
+        super().__init__(provider=provider)
+        self.observations = (
+            _find_observation_cache(provider) if observations is None else observations
+        )
+        self._registry = registry
+
+    def peek_at(self, latitude: float, longitude: float) -> UmbrellaReport | None:
+        """Return the report of a layer for coordinates, without calling the provider."""
+        if self.observations is not None:
+            report = self.observations.find_nearest(latitude, longitude)
+            if report is not None:
+                return report
+        return super().peek_at(latitude=latitude, longitude=longitude)
+
+    def __getattr__(self, name: str) -> Any:
+        """Expose the coordinates queries when the wrapped provider supports them."""
+        get_report_at = super().__getattr__(name)
+
+        def get_umbrella_report_at(latitude: float, longitude: float) -> UmbrellaReport:
+            if self.observations is not None:
+                report = self.observations.find_nearest(latitude, longitude)
+                if report is not None:
+                    self._registry.increment("nearby.hits")
+                    return report
+            fetched_report: UmbrellaReport = get_report_at(
+                latitude=latitude, longitude=longitude
+            )
+            return fetched_report
+
+        return get_umbrella_report_at
+
+
+class CoalescingLayer(ProviderLayer):
+    """Share a single provider call between concurrent queries for the same key.
+
+    Cities are keyed by the given alias index, so that concurrent queries for the
+    equivalent spellings of a city share their call.
+    """
+
+    def __init__(
+        self,
+        provider: UmbrellaReportProvider,
+        registry: MetricsRegistry = metrics,
+        alias_index: AliasIndex | None = None,
+    ) -> None:
+        """Wrap a provider."""
+        super().__init__(provider=provider)
+        self.alias_index = AliasIndex() if alias_index is None else alias_index
+        self._registry = registry
+        self._in_flight: dict[str, Future[UmbrellaReport]] = {}
+        self._lock = threading.Lock()
+
+    def _around(self, key: QueryKey, fetch: ReportFetcher) -> UmbrellaReport:
+        flight_key = key.resolve(self.alias_index)
+        with self._lock:
+            future = self._in_flight.get(flight_key)
+            is_leader = future is None
+            if future is None:
+                future = Future()
+                self._in_flight[flight_key] = future
+
+        if not is_leader:
+            self._registry.increment("coalesce.shared")
+            return future.result()
+
+        try:
+            report = fetch()
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(report)
+            return report
+        finally:
+            with self._lock:
+                del self._in_flight[flight_key]
+
+
+class RateLimitingLayer(ProviderLayer):
+    """Throttle the calls made to the provider with a token bucket.
+
+    The calls made within `prepaid_calls` are let through: their tokens have already
+    been taken from the bucket.
+    """
+
+    def __init__(
+        self,
+        provider: UmbrellaReportProvider,
+        bucket: TokenBucket | None = None,
+        max_wait: float = DEFAULT_RATE_LIMIT_MAX_WAIT,
+    ) -> None:
+        """Wrap a provider with a rate limiter."""
+        super().__init__(provider=provider)
+        self.bucket = TokenBucket() if bucket is None else bucket
+        self.max_wait = max_wait
+
+    def _around(self, key: QueryKey, fetch: ReportFetcher) -> UmbrellaReport:
+        if not _prepaid_calls.get():
+            self.bucket.acquire(max_wait=self.max_wait)
+        return fetch()
+
+
+class MetricsLayer(ProviderLayer):
+    """Count the calls made to the wrapped provider and measure their latency."""
+
+    def __init__(
+        self, provider: UmbrellaReportProvider, registry: MetricsRegistry = metrics
+    ) -> None:
+        """Wrap a provider, naming its metrics after the wrapped class."""
+        super().__init__(provider=provider)
+        self._registry = registry
+        self.prefix = f"provider.{provider.__class__.__name__}"
+
+    def _around(self, key: QueryKey, fetch: ReportFetcher) -> UmbrellaReport:
+        self._registry.increment(f"{self.prefix}.calls")
+        start = time.perf_counter()
+        try:
+            return fetch()
+        except Exception:
+            self._registry.increment(f"{self.prefix}.errors")
+            raise
+        finally:
+            self._registry.observe(
+                f"{self.prefix}.latency", time.perf_counter() - start
+            )
+
+
+class RacingMode(Enum):
+    """How a RacingProvider queries its providers."""
+
+    RACE = "race"
+    FALLBACK = "fallback"
+
+
+class SmoothedLatency:
+    """Exponentially weighted moving average of the latencies of a provider."""
+
+    def __init__(self, smoothing: float = DEFAULT_LATENCY_SMOOTHING) -> None:
+        """Initialize an average without any latency (smoothing is the new weight)."""
+        self.smoothing = smoothing
+        self.value: float | None = None
+        self._lock = threading.Lock()
+
+    def record(self, latency: float) -> None:
+        """Take a latency (in seconds) into account."""
+        with self._lock:
+            if self.value is None:
+                self.value = latency
+            else:
+                self.value += self.smoothing * (latency - self.value)
+
+
+class RacingProvider:
+    """Composite provider that queries a primary and a secondary provider.
+
+    Providers are tried from the fastest to the slowest (according to their smoothed
+    latency, the unmeasured ones last and in their configured order). In RACE mode, all
+    of them are queried at once and the first report wins. In FALLBACK mode, the next
+    provider is only queried once the previous one failed or did not answer within the
+    deadline, and the first report wins. Failures count as a latency of at least the
+    deadline, so that a failing provider falls behind. One call out of probe_every is
+    raced whatever the mode, so that the latency of every provider stays known and a
+    provider that recovered can take the lead again.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        primary: UmbrellaReportProvider,
+        secondary: UmbrellaReportProvider,
+        mode: RacingMode = RacingMode.FALLBACK,
+        deadline: float = DEFAULT_FALLBACK_DEADLINE,
+        smoothing: float = DEFAULT_LATENCY_SMOOTHING,
+        registry: MetricsRegistry = metrics,
+        max_workers: int = DEFAULT_RACING_WORKERS,
+        probe_every: int = DEFAULT_PROBE_EVERY,
+    ) -> None:
+        """Initialize a composite of two providers."""
+        self.providers = {"primary": primary, "secondary": secondary}
+        self.mode = mode
+        self.deadline = deadline
+        self.probe_every = probe_every
+        self._calls = itertools.count(1)
+        self.latencies = {name: SmoothedLatency(smoothing) for name in self.providers}
+        self._registry = registry
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="racing-provider"
+        )
+
+    def _by_latency(self, method: str) -> list[tuple[str, Any]]:
+        candidates = [
+            (name, provider)
+            for name, provider in self.providers.items()
+            if hasattr(provider, method)
+        ]
+        # Sorting is stable: unknown latencies keep their configured order
+        return sorted(candidates, key=lambda item: self._latency_of(item[0]))
+
+    def _latency_of(self, name: str) -> float:
+        latency = self.latencies[name].value
+        return math.inf if latency is None else latency
+
+    def _timed_call(
+        self, name: str, provider: Any, call: ProviderCall
+    ) -> UmbrellaReport:
+        start = time.perf_counter()
+        try:
+            report = call(provider)
+        except BaseException:
+            self.latencies[name].record(max(time.perf_counter() - start, self.deadline))
+            raise
+        self.latencies[name].record(time.perf_counter() - start)
+        return report
+
+    def _fetch(self, method: str, call: ProviderCall) -> UmbrellaReport:
+        candidates = deque(self._by_latency(method))
+        pending: dict[Future[UmbrellaReport], str] = {}
+        errors: list[BaseException] = []
+
+        def query_next_candidate() -> None:
+            name, provider = candidates.popleft()
+            self._registry.increment(f"racing.{name}.calls")
+            future = self._executor.submit(self._timed_call, name, provider, call)
+            pending[future] = name
+
+        # A probing call races all the providers, so that they all get measured
+        probing = next(self._calls) % self.probe_every == 0
+        query_next_candidate()
+        while (self.mode is RacingMode.RACE or probing) and candidates:
+            query_next_candidate()
+
+        while pending:
+            done, _ = wait(
+                pending,
+                timeout=self.deadline if candidates else None,
+                return_when=FIRST_COMPLETED,
+            )
+            for future in done:
+                name = pending.pop(future)
+                error = future.exception()
+                if error is None:
+                    self._registry.increment(f"racing.{name}.won")
+                    return future.result()
+                errors.append(error)
+
+            # Past the deadline, or once every queried provider failed, try the next one
+            if candidates and (not done or not pending):
+                query_next_candidate()
+
+        raise errors[0]
+
+    def get_umbrella_report(self, city: str) -> UmbrellaReport:
+        """Retrieve the umbrella report for a city from the providers."""
+        return self._fetch(
+            "get_umbrella_report", lambda provider: provider.get_umbrella_report(city)
+        )
+
+    def __getattr__(self, name: str) -> Any:
+        """Expose the coordinates queries when a provider supports them."""
+        if name != "get_umbrella_report_at" or not any(
+            hasattr(provider, name) for provider in self.providers.values()
+        ):
+            raise AttributeError(name)
+
+        def get_umbrella_report_at(latitude: float, longitude: float) -> UmbrellaReport:
+            return self._fetch(
+                name,
+                lambda provider: provider.get_umbrella_report_at(
+                    latitude=latitude, longitude=longitude
+                ),
+            )
+
+        return get_umbrella_report_at
+
+    def shutdown(self) -> None:
+        """Stop the threads used to query the providers."""
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+
+def find_layer(
+    provider: UmbrellaReportProvider, layer_type: type[LayerT]
+) -> LayerT | None:
+    """Return the outermost layer of a given type wrapped around a provider (if any)."""
+    while isinstance(provider, ProviderLayer):
+        if isinstance(provider, layer_type):
+            return provider
+        provider = provider.provider
+    return None
+
+
+def _find_observation_cache(
+    provider: UmbrellaReportProvider,
+) -> ObservationCache | None:
+    while isinstance(provider, ProviderLayer):
+        provider = provider.provider
+    observations = getattr(provider, "observation_cache", None)
+    return observations if isinstance(observations, ObservationCache) else None
+
+
+def provider_layers(alias_index: AliasIndex) -> dict[str, ProviderLayerFactory]:
+    """Return the layer factories by name, keying the cities with an alias index."""
+    return {
+        "cache": partial(CachingLayer, alias_index=alias_index),
+        "nearby": ObservationLayer,
+        "coalesce": partial(CoalescingLayer, alias_index=alias_index),
+        "ratelimit": RateLimitingLayer,
+        "metrics": MetricsLayer,
+    }
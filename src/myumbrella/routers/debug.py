@@ -0,0 +1,104 @@
+"""Module for router that handles the debug endpoints (profiling of the worker)."""
+import hmac
+import logging
+import os
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, status
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import PlainTextResponse
+from pydantic import BaseModel
+
+from ..profiling import (
+    DEFAULT_ALLOCATIONS_TOP,
+    ProfilerBusyException,
+    SamplingProfiler,
+    format_collapsed_stacks,
+    take_allocations_snapshot,
+)
+
+logger = logging.getLogger(__name__)
+
+# Constants
+DEBUG_TOKEN_ENV_VAR = "MYUMBRELLA_DEBUG_TOKEN"
+
+_profiler = SamplingProfiler()
+
+
+class AllocationResponse(BaseModel):
+    """Response model for an entry of the allocations endpoint."""
+
+    location: str
+    size: int
+    count: int
+
+
+def _check_debug_token(authorization: str | None = Header(default=None)) -> None:
+    # Debug endpoints do not exist unless a token is configured
+    token = os.environ.get(DEBUG_TOKEN_ENV_VAR)
+    if not token:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Not Found")
+
+    if authorization is None or not hmac.compare_digest(
+        authorization.encode(), f"Bearer {token}".encode()
+    ):
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED,
+            detail="Invalid debug token",
+            headers={"WWW-Authenticate": "Bearer"},
+        )
+
+
+router = APIRouter(
+    prefix="/debug",
+    tags=["debug"],
+    dependencies=[Depends(_check_debug_token)],
+    include_in_schema=False,
+)
+
+
+@router.get(
+    "/profile",
+    response_class=PlainTextResponse,
+    responses={409: {"description": "A profile is already running"}},
+)
+async def view_profile(
+    seconds: float = Query(default=10.0, gt=0.0, le=60.0)
+) -> PlainTextResponse:
+    """Sample the stacks of the worker and return them collapsed for flame graphs.
+
+    The first frame of every stack is its category: openweather, serialization, app,
+    framework, idle or other.
+    """
+    logger.info("Profiling worker for %gs", seconds)
+    try:
+        stacks = await run_in_threadpool(_profiler.profile, seconds)
+    except ProfilerBusyException as exc:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT, detail=exc.args[0]
+        ) from exc
+    return PlainTextResponse(content=format_collapsed_stacks(stacks))
+
+
+@router.get(
+    "/allocations",
+    response_model=list[AllocationResponse],
+    responses={409: {"description": "Allocations are already being traced"}},
+)
+async def view_allocations(
+    top: int = Query(default=DEFAULT_ALLOCATIONS_TOP, gt=0, le=1000),
+    seconds: float = Query(default=10.0, ge=0.0, le=60.0),
+) -> list[AllocationResponse]:
+    """Return the lines of code that allocated the most memory (still alive)."""
+    logger.info("Tracing allocations of worker for %gs", seconds)
+    try:
+        statistics = await run_in_threadpool(take_allocations_snapshot, top, seconds)
+    except ProfilerBusyException as exc:
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT, detail=exc.args[0]
+        ) from exc
+    return [
+        AllocationResponse(
+            location=statistic.location, size=statistic.size, count=statistic.count
+        )
+        for statistic in statistics
+    ]
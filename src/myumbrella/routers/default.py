@@ -1,7 +1,8 @@
 """Module for router that handles generic or default endpoints."""
 from fastapi import APIRouter
 
-from .. import APP_NAME, APP_VERSION
+from .. import APP_NAME, get_app_version
+from ..metrics import metrics
 
 router = APIRouter(tags=["default"])
 
@@ -14,4 +15,15 @@ router = APIRouter(tags=["default"])
 )
 async def view_root() -> str:
     """Return a greeting to the user."""
-    return f"Welcome to {APP_NAME} v.{APP_VERSION}!"
+    return f"Welcome to {APP_NAME} v.{get_app_version()}!"
+
+
+@router.get(
+    "/metrics",
+    description="Expose the in-process metrics of this worker.",
+    response_description="Counters and summaries",
+    name="Metrics view",
+)
+async def view_metrics() -> dict[str, dict]:
+    """Return a snapshot of the metrics."""
+    return metrics.snapshot()
@@ -1,18 +1,36 @@
 """Module for the routing specific to the umbrella endpoint."""
+import base64
+import json
 import logging
+import sys
 import warnings
+from typing import Iterable
 
-import httpx
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from fastapi.concurrency import run_in_threadpool
 from pydantic import BaseModel
 
 from ..core import (
+    CoordinatesUmbrellaReportProvider,
     LocationNotFoundException,
     UmbrellaReport,
     UmbrellaReportProvider,
     UnknownUmbrellaStateException,
+    UpstreamErrorException,
 )
-from ..dependencies import umbrella_report_provider_dependency
+from ..dependencies import (
+    city_alias_index,
+    umbrella_report_provider_dependency,
+    umbrella_response_cache,
+)
+from ..grid import (
+    DEFAULT_MAX_MAP_CELLS,
+    BoundingBox,
+    UmbrellaGrid,
+    compute_umbrella_flags,
+    pack_flags,
+)
+from ..providers import RateLimitExceededException
 
 router = APIRouter(tags=["umbrella"])
 logger = logging.getLogger(__name__)
@@ -28,6 +46,30 @@ class MyUmbrellaResponse(BaseModel):
     umbrella_needed: bool = True
 
 
+class UmbrellaMapResponse(BaseModel):
+    """Response model for myumbrella map endpoint.
+
+    The cells are listed row by row from the north-west corner of the bbox (which is
+    the requested one snapped to the grid). Their flags are packed into bits (most
+    significant bit first) and encoded in base64: `umbrella_needed` is only meaningful
+    for the cells whose `known` bit is set.
+    """
+
+    bbox: list[float]
+    resolution: float
+    rows: int
+    columns: int
+    umbrella_needed: str
+    known: str
+
+
+def _is_upstream_timeout(exc: Exception) -> bool:
+    # httpx is only imported once a client needs it: as long as it is not loaded,
+    # the exception cannot be one of its timeouts
+    httpx = sys.modules.get("httpx")
+    return httpx is not None and isinstance(exc, httpx.TimeoutException)
+
+
 async def _myumbrellaresponse_from_umbrella_report(
     report: UmbrellaReport,
 ) -> MyUmbrellaResponse:
@@ -39,7 +81,10 @@ async def _myumbrellaresponse_from_umbrella_report(
         msg = f"Unknown umbrella status for weather: {report.weather.value} -> set to True"
 
         warnings.warn(message=msg, category=RuntimeWarning)
-        logger.warning(msg=msg)
+        logger.warning(
+            "Unknown umbrella status for weather: %s -> set to True",
+            report.weather.value,
+        )
         umbrella_needed = True
 
     return MyUmbrellaResponse(
@@ -51,24 +96,157 @@ async def _myumbrellaresponse_from_umbrella_report(
     )
 
 
-@router.get("/myumbrella", responses={404: {"description": "City not found"}})
+def _encode_response(response: MyUmbrellaResponse) -> bytes:
+    # Same encoding as the JSONResponse that FastAPI builds from the response model
+    return json.dumps(
+        response.dict(), ensure_ascii=False, separators=(",", ":")
+    ).encode("utf-8")
+
+
+def _encode_flags(flags: Iterable[bool]) -> str:
+    return base64.b64encode(pack_flags(flags)).decode("ascii")
+
+
+@router.get(
+    "/myumbrella",
+    response_model=MyUmbrellaResponse,
+    responses={
+        404: {"description": "City not found"},
+        429: {"description": "Upstream rate limit exceeded"},
+        502: {"description": "Upstream error"},
+    },
+)
 async def view_umbrella(
     city: str,
     report_provider: UmbrellaReportProvider = Depends(
         umbrella_report_provider_dependency
     ),
-) -> MyUmbrellaResponse:
+) -> MyUmbrellaResponse | Response:
     """Return the WeatherReport for a city."""
-    logging.info("Getting Umbrella report for city: %s", city)
+    logger.info("Getting Umbrella report for city: %s", city)
+    if umbrella_response_cache.enabled:
+        cached_content = umbrella_response_cache.get(city_alias_index.cache_key(city))
+        if cached_content is not None:
+            return Response(content=cached_content, media_type="application/json")
+
+    # Providers make blocking calls: they must not run on the event loop
     try:
-        report = report_provider.get_umbrella_report(city=city)
-    except httpx.TimeoutException as exc:
+        report = await run_in_threadpool(report_provider.get_umbrella_report, city=city)
+    except LocationNotFoundException as exc:
         raise HTTPException(
-            status_code=httpx.codes.GATEWAY_TIMEOUT, detail=exc.args[0]
+            status_code=status.HTTP_404_NOT_FOUND, detail=exc.args[0]
         ) from exc
-    except LocationNotFoundException as exc:
+    except RateLimitExceededException as exc:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=exc.args[0]
+        ) from exc
+    except UpstreamErrorException as exc:
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY, detail=exc.args[0]
+        ) from exc
+    except Exception as exc:  # pylint: disable=broad-except
+        if not _is_upstream_timeout(exc):
+            raise
         raise HTTPException(
-            status_code=httpx.codes.NOT_FOUND, detail=exc.args[0]
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=exc.args[0]
         ) from exc
     response = await _myumbrellaresponse_from_umbrella_report(report=report)
+    if umbrella_response_cache.enabled:
+        # The key changes once the alias index learned the city
+        umbrella_response_cache.set(
+            city_alias_index.cache_key(city),
+            content=_encode_response(response),
+            report=report,
+        )
     return response
+
+
+@router.get(
+    "/myumbrella/coords",
+    responses={
+        429: {"description": "Upstream rate limit exceeded"},
+        501: {"description": "Provider does not support coordinates"},
+        502: {"description": "Upstream error"},
+    },
+)
+async def view_umbrella_at_coordinates(
+    lat: float = Query(ge=-90.0, le=90.0),
+    lon: float = Query(ge=-180.0, le=180.0),
+    report_provider: UmbrellaReportProvider = Depends(
+        umbrella_report_provider_dependency
+    ),
+) -> MyUmbrellaResponse:
+    """Return the WeatherReport for a latitude and a longitude."""
+    logger.info("Getting Umbrella report for coordinates: lat=%.3f, lon=%.3f", lat, lon)
+    if not isinstance(report_provider, CoordinatesUmbrellaReportProvider):
+        raise HTTPException(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail=f"{report_provider.__class__.__name__} does not support coordinates",
+        )
+
+    try:
+        report = await run_in_threadpool(
+            report_provider.get_umbrella_report_at, latitude=lat, longitude=lon
+        )
+    except RateLimitExceededException as exc:
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=exc.args[0]
+        ) from exc
+    except UpstreamErrorException as exc:
+        raise HTTPException(
+            status_code=status.HTTP_502_BAD_GATEWAY, detail=exc.args[0]
+        ) from exc
+    except Exception as exc:  # pylint: disable=broad-except
+        if not _is_upstream_timeout(exc):
+            raise
+        raise HTTPException(
+            status_code=status.HTTP_504_GATEWAY_TIMEOUT, detail=exc.args[0]
+        ) from exc
+    response = await _myumbrellaresponse_from_umbrella_report(report=report)
+    return response
+
+
+@router.get(
+    "/myumbrella/map",
+    response_model=UmbrellaMapResponse,
+    responses={
+        422: {"description": "Invalid or too large bounding box"},
+        501: {"description": "Provider does not support coordinates"},
+    },
+)
+async def view_umbrella_map(
+    bbox: str = Query(description="Region as 'west,south,east,north' (in degrees)"),
+    resolution: float = Query(gt=0.0, le=10.0, description="Cell size (in degrees)"),
+    report_provider: UmbrellaReportProvider = Depends(
+        umbrella_report_provider_dependency
+    ),
+) -> UmbrellaMapResponse:
+    """Return the umbrella flags of a grid of cells covering a region."""
+    logger.info("Getting Umbrella map for bbox=%s, resolution=%g", bbox, resolution)
+    if not isinstance(report_provider, CoordinatesUmbrellaReportProvider):
+        raise HTTPException(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail=f"{report_provider.__class__.__name__} does not support coordinates",
+        )
+
+    try:
+        grid = UmbrellaGrid.covering(BoundingBox.parse(bbox), resolution=resolution)
+    except ValueError as exc:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=exc.args[0]
+        ) from exc
+    if len(grid) > DEFAULT_MAX_MAP_CELLS:
+        raise HTTPException(
+            status_code=status.HTTP_422_UNPROCESSABLE_ENTITY,
+            detail=f"Map of {len(grid)} cells exceeds {DEFAULT_MAX_MAP_CELLS} cells",
+        )
+
+    flags = await run_in_threadpool(compute_umbrella_flags, report_provider, grid)
+    return UmbrellaMapResponse(
+        bbox=[grid.bbox.west, grid.bbox.south, grid.bbox.east, grid.bbox.north],
+        resolution=grid.resolution,
+        rows=grid.rows,
+        columns=grid.columns,
+        umbrella_needed=_encode_flags(bool(flag) for flag in flags),
+        known=_encode_flags(flag is not None for flag in flags),
+    )
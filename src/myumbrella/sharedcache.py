@@ -0,0 +1,223 @@
+"""Module for the report cache shared by the worker processes of a host."""
+import contextlib
+import fcntl
+import hashlib
+import math
+import os
+import struct
+import tempfile
+import threading
+import time
+from multiprocessing import resource_tracker, shared_memory
+from typing import Callable, Iterator
+
+from .core import Location, UmbrellaReport, WeatherState
+from .metrics import MetricsRegistry, metrics
+
+# Constants
+DEFAULT_SHARED_CACHE_SLOTS = 16_384
+DEFAULT_SHARED_CACHE_SLOT_SIZE = 256
+_PROBES = 4
+_MAX_READ_ATTEMPTS = 3
+_FIELD_SEPARATOR = "\x1f"
+_WEATHER_STATES = list(WeatherState)
+# Slot: sequence number, key hash, expiration (UNIX time), payload length
+_SLOT_HEADER = struct.Struct("<IQdH")
+_SEQUENCE = struct.Struct("<I")
+_SEQUENCE_MODULO = 2**32
+# Payload: weather index, latitude, longitude, observation time (NaN if unknown)
+_REPORT = struct.Struct("<Bddd")
+
+
+def _hash_key(key: str) -> int:
+    digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+    # 0 marks the empty slots
+    return int.from_bytes(digest, "little") or 1
+
+
+def _encode_entry(key: str, report: UmbrellaReport) -> bytes:
+    location = report.location
+    observed_at = math.nan if report.observed_at is None else report.observed_at
+    texts = _FIELD_SEPARATOR.join(
+        (key, location.city, location.state, location.country)
+    )
+    return (
+        _REPORT.pack(
+            _WEATHER_STATES.index(report.weather),
+            location.latitude,
+            location.longitude,
+            observed_at,
+        )
+        + texts.encode()
+    )
+
+
+def _decode_entry(payload: bytes) -> tuple[str, UmbrellaReport]:
+    weather_index, latitude, longitude, observed_at = _REPORT.unpack_from(payload)
+    key, city, state, country = payload[_REPORT.size :].decode().split(_FIELD_SEPARATOR)
+    return key, UmbrellaReport(
+        location=Location(
+            city=city,
+            state=state,
+            country=country,
+            latitude=latitude,
+            longitude=longitude,
+        ),
+        weather=_WEATHER_STATES[weather_index],
+        observed_at=None if math.isnan(observed_at) else observed_at,
+    )
+
+
+class SharedReportCache:
+    """Cache of umbrella reports in a shared memory segment of fixed-size slots.
+
+    Every worker of the host attaches to the same named segment. A key can be stored
+    in one of a few slots following its hash. Reads take no lock: each slot has a
+    sequence number that writers make odd while they update it (i.e. a seqlock), so a
+    torn read is detected and retried. Writers are serialized by a file lock.
+
+    An entry that does not fit in a slot or whose slots are all taken by fresh
+    entries is not stored: the caller keeps it in its local cache instead.
+    """
+
+    def __init__(  # pylint: disable=too-many-arguments
+        self,
+        name: str,
+        slots: int = DEFAULT_SHARED_CACHE_SLOTS,
+        slot_size: int = DEFAULT_SHARED_CACHE_SLOT_SIZE,
+        lock_path: str | None = None,
+        registry: MetricsRegistry = metrics,
+        clock: Callable[[], float] = time.time,
+    ) -> None:
+        """Create the named segment, or attach to it if another worker created it."""
+        if slot_size <= _SLOT_HEADER.size + _REPORT.size:
+            raise ValueError(f"Shared cache slots are too small (got {slot_size})")
+
+        self.slots = slots
+        self.slot_size = slot_size
+        self._registry = registry
+        self._clock = clock
+        size = slots * slot_size
+        try:
+            # A new segment is zero-filled: all of its slots are empty
+            self._memory = shared_memory.SharedMemory(name=name, create=True, size=size)
+        except FileExistsError:
+            self._memory = shared_memory.SharedMemory(name=name)
+        # The segment outlives the workers: none of them must unlink it when exiting
+        resource_tracker.unregister(
+            self._memory._name, "shared_memory"  # type: ignore[attr-defined]
+        )
+        if self._memory.size < size:
+            self._memory.close()
+            raise ValueError(
+                f"Shared cache segment '{name}' is smaller than {size} bytes"
+            )
+
+        if lock_path is None:
+            lock_path = os.path.join(tempfile.gettempdir(), f"{name}.lock")
+        self._lock_file = open(lock_path, "a+b")  # pylint: disable=consider-using-with
+        self._thread_lock = threading.Lock()
+
+    def _slot_offsets(self, key_hash: int) -> list[int]:
+        first_slot = key_hash % self.slots
+        return [
+            ((first_slot + probe) % self.slots) * self.slot_size
+            for probe in range(min(_PROBES, self.slots))
+        ]
+
+    def _read_slot(self, offset: int) -> tuple[int, float, bytes] | None:
+        buffer = self._memory.buf
+        for _ in range(_MAX_READ_ATTEMPTS):
+            (sequence,) = _SEQUENCE.unpack_from(buffer, offset)
+            if sequence % 2:
+                continue
+            slot = bytes(buffer[offset : offset + self.slot_size])
+            if _SEQUENCE.unpack_from(buffer, offset)[0] == sequence:
+                _, key_hash, expires_at, length = _SLOT_HEADER.unpack_from(slot)
+                return key_hash, expires_at, slot[_SLOT_HEADER.size :][:length]
+        return None
+
+    def _write_slot(
+        self, offset: int, key_hash: int, expires_at: float, payload: bytes
+    ) -> None:
+        buffer = self._memory.buf
+        (sequence,) = _SEQUENCE.unpack_from(buffer, offset)
+        # The sequence number stays odd while the slot is being updated
+        _SLOT_HEADER.pack_into(
+            buffer,
+            offset,
+            (sequence + 1) % _SEQUENCE_MODULO,
+            key_hash,
+            expires_at,
+            len(payload),
+        )
+        start = offset + _SLOT_HEADER.size
+        buffer[start : start + len(payload)] = payload
+        _SEQUENCE.pack_into(buffer, offset, (sequence + 2) % _SEQUENCE_MODULO)
+
+    @contextlib.contextmanager
+    def _locked(self) -> Iterator[None]:
+        # A file lock is held by an open file, not by a thread: threads need their own
+        with self._thread_lock:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    def get(self, key: str) -> UmbrellaReport | None:
+        """Return the report stored for a key if it is still fresh."""
+        key_hash = _hash_key(key)
+        now = self._clock()
+        for offset in self._slot_offsets(key_hash):
+            slot = self._read_slot(offset)
+            if slot is None or slot[0] != key_hash or slot[1] <= now:
+                continue
+            stored_key, report = _decode_entry(slot[2])
+            if stored_key == key:
+                return report
+        return None
+
+    def set(self, key: str, report: UmbrellaReport, ttl: float) -> bool:
+        """Store a report for ttl seconds, returning whether there was room for it."""
+        payload = _encode_entry(key, report)
+        if _SLOT_HEADER.size + len(payload) > self.slot_size:
+            self._registry.increment("sharedcache.full")
+            return False
+
+        key_hash = _hash_key(key)
+        with self._locked():
+            now = self._clock()
+            free_offset = None
+            for offset in self._slot_offsets(key_hash):
+                slot_hash, expires_at, _ = _SLOT_HEADER.unpack_from(
+                    self._memory.buf, offset
+                )[1:]
+                if slot_hash == key_hash:
+                    free_offset = offset
+                    break
+                if free_offset is None and (slot_hash == 0 or expires_at <= now):
+                    free_offset = offset
+
+            if free_offset is None:
+                self._registry.increment("sharedcache.full")
+                return False
+            self._write_slot(free_offset, key_hash, now + ttl, payload)
+        return True
+
+    def delete(self, key: str) -> None:
+        """Forget the report stored for a key."""
+        key_hash = _hash_key(key)
+        with self._locked():
+            for offset in self._slot_offsets(key_hash):
+                if _SLOT_HEADER.unpack_from(self._memory.buf, offset)[1] == key_hash:
+                    self._write_slot(offset, 0, 0.0, b"")
+
+    def close(self) -> None:
+        """Detach from the segment (which stays available to the other workers)."""
+        self._memory.close()
+        self._lock_file.close()
+
+    def unlink(self) -> None:
+        """Destroy the segment once no worker uses it anymore."""
+        self._memory.unlink()
@@ -0,0 +1,131 @@
+"""Module for the HTTP transport used to reach the Openweather API."""
+import importlib.util
+import logging
+import socket
+import ssl
+import threading
+import time
+from typing import Callable
+
+import httpcore
+import httpx
+from httpcore.backends.base import NetworkStream
+from httpcore.backends.sync import SyncBackend
+
+logger = logging.getLogger(__name__)
+
+# Constants
+DEFAULT_DNS_TTL = 60.0
+# HTTP/2 multiplexes the calls over a few connections, HTTP/1.1 needs one per call
+DEFAULT_HTTP2_MAX_CONNECTIONS = 4
+DEFAULT_HTTP1_MAX_CONNECTIONS = 100
+# Must be longer than the keep-alive interval of the client, or pings would be useless
+DEFAULT_KEEPALIVE_EXPIRY = 90.0
+
+
+def _resolve_with_system(host: str, port: int) -> str:
+    address_info = socket.getaddrinfo(host, port, type=socket.SOCK_STREAM)
+    return str(address_info[0][4][0])
+
+
+def is_http2_available() -> bool:
+    """Check if the HTTP/2 support of httpx (i.e. h2, from httpx[http2]) is installed."""
+    return importlib.util.find_spec("h2") is not None
+
+
+class CachingResolver:
+    """DNS resolver that keeps the resolved addresses for a time-to-live.
+
+    The system resolver does not expose the TTL of the DNS records, so the cache uses a
+    configured one. A stale address is still used if a new resolution fails.
+    """
+
+    def __init__(
+        self,
+        ttl: float = DEFAULT_DNS_TTL,
+        resolve: Callable[[str, int], str] = _resolve_with_system,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        """Initialize an empty resolver cache."""
+        self.ttl = ttl
+        self._resolve = resolve
+        self._clock = clock
+        self._addresses: dict[tuple[str, int], tuple[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def resolve(self, host: str, port: int) -> str:
+        """Return the address to connect to for a host and a port."""
+        key = (host, port)
+        with self._lock:
+            cached = self._addresses.get(key)
+        if cached is not None and cached[1] > self._clock():
+            return cached[0]
+
+        try:
+            address = self._resolve(host, port)
+        except OSError:
+            if cached is None:
+                raise
+            logger.warning("Could not resolve '%s': using stale address", host)
+            return cached[0]
+
+        with self._lock:
+            self._addresses[key] = (address, self._clock() + self.ttl)
+        return address
+
+
+class _ResolvingNetworkBackend(SyncBackend):
+    def __init__(self, resolver: CachingResolver) -> None:
+        self.resolver = resolver
+
+    def connect_tcp(
+        self,
+        host: str,
+        port: int,
+        timeout: float | None = None,
+        local_address: str | None = None,
+    ) -> NetworkStream:
+        # TLS still uses the original host name for SNI and certificate validation
+        address = self.resolver.resolve(host, port)
+        return super().connect_tcp(
+            address, port, timeout=timeout, local_address=local_address
+        )
+
+
+class OpenweatherTransport(httpx.HTTPTransport):
+    """Transport that keeps its connections (HTTP/2 if available) open.
+
+    Host names are resolved through a caching resolver, so neither the DNS lookup nor
+    the TCP and TLS handshakes are paid by every call.
+    """
+
+    def __init__(
+        self,
+        resolver: CachingResolver | None = None,
+        http2: bool | None = None,
+        verify: bool | str | ssl.SSLContext = True,
+        max_connections: int | None = None,
+    ) -> None:
+        """Initialize a transport (HTTP/2 is used if h2 is installed unless specified)."""
+        if http2 is None:
+            http2 = is_http2_available()
+        if max_connections is None:
+            max_connections = (
+                DEFAULT_HTTP2_MAX_CONNECTIONS
+                if http2
+                else DEFAULT_HTTP1_MAX_CONNECTIONS
+            )
+        super().__init__(verify=verify, http2=http2)
+
+        self.http2 = http2
+        self.resolver = CachingResolver() if resolver is None else resolver
+        # httpx does not expose the network backend of its pool: the pool is rebuilt
+        self._pool = httpcore.ConnectionPool(
+            ssl_context=httpx.create_ssl_context(verify=verify, http2=http2),
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=DEFAULT_KEEPALIVE_EXPIRY,
+            http1=True,
+            http2=http2,
+            network_backend=_ResolvingNetworkBackend(resolver=self.resolver),
+        )
@@ -0,0 +1,54 @@
+"""Fixtures shared by the tests."""
+import asyncio
+from typing import Iterator
+
+import pytest
+
+from myumbrella.loopwatch import LoopBlockingDetector
+from myumbrella.metrics import MetricsRegistry
+
+# Constants
+_BLOCKING_THRESHOLD = 0.1
+
+
+class _WatchedEventLoopPolicy(asyncio.DefaultEventLoopPolicy):
+    """Policy watching every new event loop with a blocking detector."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.detectors: list[LoopBlockingDetector] = []
+
+    def new_event_loop(self) -> asyncio.AbstractEventLoop:
+        """Create an event loop whose detector starts with it."""
+        loop = super().new_event_loop()
+        detector = LoopBlockingDetector(
+            threshold=_BLOCKING_THRESHOLD, registry=MetricsRegistry()
+        )
+        loop.call_soon(lambda: loop.create_task(detector.start()))
+        self.detectors.append(detector)
+        return loop
+
+
+def pytest_configure(config: pytest.Config) -> None:
+    """Register the markers of the tests."""
+    config.addinivalue_line(
+        "markers", "blocks_event_loop: the test blocks the event loop on purpose"
+    )
+
+
+@pytest.fixture(autouse=True)
+def fail_on_event_loop_blocking(request: pytest.FixtureRequest) -> Iterator[None]:
+    """Fail the tests whose code blocks an event loop (e.g. the app or asyncio.run)."""
+    if request.node.get_closest_marker("blocks_event_loop") is not None:
+        yield
+        return
+
+    policy = _WatchedEventLoopPolicy()
+    previous_policy = asyncio.get_event_loop_policy()
+    asyncio.set_event_loop_policy(policy)
+    try:
+        yield
+    finally:
+        asyncio.set_event_loop_policy(previous_policy)
+    for detector in policy.detectors:
+        detector.check()
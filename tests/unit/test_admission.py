@@ -0,0 +1,163 @@
+"""Tests for the admission control of the requests."""
+import asyncio
+import time
+
+from starlette.types import Message, Receive, Scope, Send
+
+from myumbrella.admission import AdmissionControlMiddleware, LoopLagMonitor
+from myumbrella.metrics import MetricsRegistry
+
+
+class _GatedApp:
+    """Fake ASGI application: requests are answered once the gate is open."""
+
+    def __init__(self) -> None:
+        self.gate = asyncio.Event()
+        self.started = 0
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        self.started += 1
+        if scope["path"] != "/":
+            await self.gate.wait()
+        await send({"type": "http.response.start", "status": 200, "headers": []})
+        await send({"type": "http.response.body", "body": b"ok"})
+
+
+async def _request(
+    middleware: AdmissionControlMiddleware, path: str = "/myumbrella"
+) -> tuple[int, dict[bytes, bytes]]:
+    messages: list[Message] = []
+
+    async def receive() -> Message:
+        return {"type": "http.request"}  # pragma: nocover
+
+    async def send(message: Message) -> None:
+        messages.append(message)
+
+    await middleware({"type": "http", "path": path}, receive, send)
+    return messages[0]["status"], dict(messages[0]["headers"])
+
+
+def test_admissioncontrol_should_shed_requests_beyond_in_flight_limit() -> None:
+    """Check that requests beyond the limit are rejected straight away."""
+
+    async def scenario() -> None:
+        # Given a middleware that admits a single request without any queue
+        app = _GatedApp()
+        registry = MetricsRegistry()
+        middleware = AdmissionControlMiddleware(
+            app, max_in_flight=1, queue_timeout=0.0, registry=registry
+        )
+        first_request = asyncio.create_task(_request(middleware))
+        await asyncio.sleep(0)
+
+        # When another request arrives
+        status_code, headers = await _request(middleware)
+
+        # Then it should be rejected with a hint to retry later
+        assert status_code == 503
+        assert headers[b"retry-after"] == b"1"
+        assert registry.counter("admission.shed.queue") == 1
+
+        # And the root view should never be shed
+        assert (await _request(middleware, path="/"))[0] == 200
+
+        # And the admitted request should complete normally
+        app.gate.set()
+        assert (await first_request)[0] == 200
+        assert middleware.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_admissioncontrol_should_admit_queued_request_before_deadline() -> None:
+    """Check that a queued request gets the slot of a finishing request."""
+
+    async def scenario() -> None:
+        # Given a middleware whose only slot is taken
+        app = _GatedApp()
+        middleware = AdmissionControlMiddleware(app, max_in_flight=1, queue_timeout=1.0)
+        first_request = asyncio.create_task(_request(middleware))
+        await asyncio.sleep(0)
+
+        # When another request is queued and the first one finishes in time
+        queued_request = asyncio.create_task(_request(middleware))
+        await asyncio.sleep(0.01)
+        app.gate.set()
+
+        # Then both requests should be served
+        assert (await first_request)[0] == 200
+        assert (await queued_request)[0] == 200
+        assert app.started == 2
+        assert middleware.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_admissioncontrol_should_shed_queued_request_after_deadline() -> None:
+    """Check that a request waiting longer than the queue deadline is rejected."""
+
+    async def scenario() -> None:
+        # Given a middleware whose only slot is taken
+        app = _GatedApp()
+        middleware = AdmissionControlMiddleware(
+            app, max_in_flight=1, queue_timeout=0.01
+        )
+        first_request = asyncio.create_task(_request(middleware))
+        await asyncio.sleep(0)
+
+        # When another request waits longer than the deadline
+        # Then it should be rejected
+        assert (await _request(middleware))[0] == 503
+
+        # Test teardown
+        app.gate.set()
+        await first_request
+        assert middleware.in_flight == 0
+
+    asyncio.run(scenario())
+
+
+def test_admissioncontrol_should_shed_requests_when_loop_lags() -> None:
+    """Check that requests are rejected while the event loop lags."""
+
+    async def scenario() -> None:
+        # Given a middleware whose event loop lags
+        app = _GatedApp()
+        registry = MetricsRegistry()
+        lag_monitor = LoopLagMonitor(registry=registry)
+        lag_monitor.lag = 1.0
+        middleware = AdmissionControlMiddleware(
+            app, max_loop_lag=0.5, lag_monitor=lag_monitor, registry=registry
+        )
+
+        # When a request arrives
+        # Then it should be rejected without reaching the application
+        assert (await _request(middleware))[0] == 503
+        assert app.started == 0
+        assert registry.counter("admission.shed.lag") == 1
+
+    asyncio.run(scenario())
+
+
+def test_looplagmonitor_should_measure_blocked_loop() -> None:
+    """Check that blocking the event loop is measured as lag."""
+
+    async def scenario() -> None:
+        # Given a started lag monitor
+        registry = MetricsRegistry()
+        lag_monitor = LoopLagMonitor(interval=0.01, registry=registry)
+        await lag_monitor.start()
+        await asyncio.sleep(0)
+
+        # When the event loop is blocked
+        time.sleep(0.1)  # Blocking on purpose
+        await asyncio.sleep(0.02)
+
+        # Then the lag should have been measured
+        assert registry.summary("eventloop.lag").maximum >= 0.05
+
+        # Test teardown
+        await lag_monitor.stop()
+
+    asyncio.run(scenario())
@@ -0,0 +1,90 @@
+"""Tests for the pool of Openweather API keys."""
+import pytest
+
+from myumbrella.apikeys import APIKeyPool, APIKeysExhaustedException
+from myumbrella.metrics import MetricsRegistry
+
+
+class _FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def test_apikeypool_should_balance_calls_within_quota() -> None:
+    """Check that calls are spread across the keys until their quota is reached."""
+    # Given a pool of two keys allowing 2 calls per minute each
+    clock = _FakeClock()
+    pool = APIKeyPool(keys=["key1", "key2"], quota_per_minute=2, clock=clock)
+
+    # When acquiring keys for 4 calls
+    keys = [pool.acquire() for _ in range(4)]
+
+    # Then each key should be used twice
+    assert sorted(keys) == ["key1", "key1", "key2", "key2"]
+
+    # And a 5th call should exceed the quotas
+    with pytest.raises(APIKeysExhaustedException):
+        pool.acquire()
+
+    # And the quotas should be renewed the next minute
+    clock.now = 60.0
+    assert pool.acquire() in ("key1", "key2")
+
+
+def test_apikeypool_should_rotate_rejected_keys_out() -> None:
+    """Check that a rejected key is not used until its cooldown is over."""
+    # Given a pool of two keys
+    clock = _FakeClock()
+    registry = MetricsRegistry()
+    pool = APIKeyPool(
+        keys=["key1", "key2"],
+        cooldown=30.0,
+        invalid_key_cooldown=3600.0,
+        registry=registry,
+        clock=clock,
+    )
+
+    # When a key is rate limited by Openweather
+    pool.reject("key1", status_code=429)
+
+    # Then only the other key should be used until the cooldown is over
+    assert {pool.acquire() for _ in range(5)} == {"key2"}
+    clock.now = 30.0
+    assert "key1" in {pool.acquire() for _ in range(5)}
+
+    # And an invalid key should be rotated out for longer
+    pool.reject("key2", status_code=401)
+    clock.now = 100.0
+    assert {pool.acquire() for _ in range(5)} == {"key1"}
+    assert registry.counter("openweather.keys.rejected") == 2
+
+
+def test_apikeypool_should_not_rotate_last_key_out_for_long() -> None:
+    """Check that the last available key is only rotated out for the short cooldown."""
+    # Given a pool of a single key
+    clock = _FakeClock()
+    pool = APIKeyPool(
+        keys=["key1"], cooldown=30.0, invalid_key_cooldown=3600.0, clock=clock
+    )
+
+    # When Openweather rejects it as invalid
+    pool.reject("key1", status_code=401)
+
+    # Then it should only be rotated out for the short cooldown
+    with pytest.raises(APIKeysExhaustedException):
+        pool.acquire()
+    clock.now = 30.0
+    assert pool.acquire() == "key1"
+
+
+def test_apikeypool_should_not_have_quota_by_default() -> None:
+    """Check that a pool without configured quota does not limit the calls."""
+    # Given a pool of a single key without quota
+    pool = APIKeyPool(keys=["key1"])
+
+    # When acquiring it many times
+    # Then it should never be exhausted
+    assert {pool.acquire() for _ in range(1000)} == {"key1"}
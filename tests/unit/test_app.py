@@ -1,18 +1,37 @@
 """Tests for the main module."""
+import asyncio
+import base64
+import time
+
 import httpx
 import pytest
 from fastapi import FastAPI
 from fastapi.testclient import TestClient
 
+from myumbrella import get_app_version
 from myumbrella.app import app
+from myumbrella.cache import ReportCache
 from myumbrella.core import (
     Location,
     LocationNotFoundException,
     UmbrellaReport,
+    UpstreamErrorException,
     WeatherState,
 )
-from myumbrella.dependencies import umbrella_report_provider_dependency
-from myumbrella.routers.umbrella import MyUmbrellaResponse, UmbrellaReportProvider
+from myumbrella.dependencies import (
+    ProviderPipeline,
+    umbrella_report_provider_dependency,
+    umbrella_response_cache,
+)
+from myumbrella.loopwatch import LoopBlockingDetector
+from myumbrella.metrics import MetricsRegistry
+from myumbrella.providers import CachingLayer, RateLimitingLayer, TokenBucket
+from myumbrella.routers.umbrella import (
+    MyUmbrellaResponse,
+    UmbrellaMapResponse,
+    UmbrellaReportProvider,
+)
+from myumbrella.routers.umbrella import router as router_umbrella
 
 
 class TestApp:
@@ -84,7 +103,21 @@ class TestApp:
         assert response.status_code == httpx.codes.OK
 
         # And the return message should contain the app version
-        assert app.version in response.text
+        assert get_app_version() in response.text
+
+    def test_metrics_view_should_return_counters_and_summaries(self) -> None:
+        """Check that calling metrics returns the metrics snapshot."""
+        # Given a app client
+        client = self._get_client()
+
+        # When calling the "/metrics" entry point
+        response = client.get("/metrics")
+
+        # Then the response should return OK
+        assert response.status_code == httpx.codes.OK
+
+        # And the return object should contain counters and summaries
+        assert set(response.json()) == {"counters", "summaries"}
 
     def test_myumbrella_view_should_return_report_ok(self) -> None:
         """Check that the umbrella view returns the correct response when everything is OK."""
@@ -188,6 +221,28 @@ class TestApp:
         # Test teardown
         del umbrella_report_provider_dependency.provider
 
+    def test_myumbrella_view_should_handle_upstream_error(self) -> None:
+        """Check that the view returns a bad gateway error when openweather fails."""
+        # Test setup
+        expected_expection = UpstreamErrorException("Openweather answered 500")
+        failing_provider = self._create_mocked_provider_from_exception(
+            exception=expected_expection
+        )
+        umbrella_report_provider_dependency.provider = failing_provider
+
+        # Given a app client
+        client = self._get_client()
+
+        # When calling the "/" entry point
+        response = client.get("/myumbrella?city=testcity")
+
+        # Then the response should be a bad gateway error
+        assert response.status_code == httpx.codes.BAD_GATEWAY
+        assert response.json()["detail"] == expected_expection.args[0]
+
+        # Test teardown
+        del umbrella_report_provider_dependency.provider
+
     def test_myumbrella_view_should_warn_on_unknown_weather(self) -> None:
         """Check that the umbrella view returns the correct response when everything is OK."""
         # Test setup
@@ -233,3 +288,331 @@ class TestApp:
 
         # Test teardown
         del umbrella_report_provider_dependency.provider
+
+    def test_myumbrella_coords_view_should_return_report_ok(self) -> None:
+        """Check that the coordinates view returns the report for the coordinates."""
+        # Test setup
+        fake_report = UmbrellaReport(
+            location=Location(
+                city="testcity", latitude=43.6, longitude=1.44, country="testcountry"
+            ),
+            weather=WeatherState.RAIN,
+        )
+
+        class _FakeCoordinatesProvider:
+            def get_umbrella_report(self, city: str) -> UmbrellaReport:
+                """Not used."""
+                raise NotImplementedError
+
+            def get_umbrella_report_at(
+                self, latitude: float, longitude: float
+            ) -> UmbrellaReport:
+                """Get a test report."""
+                assert (latitude, longitude) == (43.6, 1.44)
+                return fake_report
+
+        umbrella_report_provider_dependency.provider = _FakeCoordinatesProvider()
+
+        # Given a app client
+        client = self._get_client()
+
+        # When calling the "/myumbrella/coords" entry point
+        response = client.get("/myumbrella/coords?lat=43.6&lon=1.44")
+
+        # Then the response should return OK
+        assert response.status_code == httpx.codes.OK
+
+        # And the returned json should match the report
+        report = MyUmbrellaResponse(**response.json())
+        assert report.city == "testcity"
+        assert report.umbrella_needed is True
+
+        # Test teardown
+        del umbrella_report_provider_dependency.provider
+
+    def test_myumbrella_coords_view_should_reject_city_only_provider(self) -> None:
+        """Check that the coordinates view fails when the provider only knows cities."""
+        # Test setup
+        umbrella_report_provider_dependency.provider = (
+            self._create_mocked_provider_from_reports(reports=[])
+        )
+
+        # Given a app client
+        client = self._get_client()
+
+        # When calling the "/myumbrella/coords" entry point
+        response = client.get("/myumbrella/coords?lat=43.6&lon=1.44")
+
+        # Then the response should be a not implemented error
+        assert response.status_code == httpx.codes.NOT_IMPLEMENTED
+
+        # Test teardown
+        del umbrella_report_provider_dependency.provider
+
+    def test_myumbrella_coords_view_should_validate_coordinates(self) -> None:
+        """Check that the coordinates view rejects out-of-range coordinates."""
+        # Test setup
+        umbrella_report_provider_dependency.provider = (
+            self._create_mocked_provider_from_reports(reports=[])
+        )
+
+        # Given a app client
+        client = self._get_client()
+
+        # When calling the "/myumbrella/coords" entry point with a wrong latitude
+        response = client.get("/myumbrella/coords?lat=123&lon=1.44")
+
+        # Then the response should be a validation error
+        assert response.status_code == httpx.codes.UNPROCESSABLE_ENTITY
+
+        # Test teardown
+        del umbrella_report_provider_dependency.provider
+
+    def test_myumbrella_view_should_serve_encoded_response_from_cache(self) -> None:
+        """Check that a cached city is served without going through the provider."""
+        # Test setup
+        fake_report = UmbrellaReport(
+            location=Location(city="testcity"), weather=WeatherState.RAIN
+        )
+        registry = MetricsRegistry()
+        report_cache = ReportCache()
+        umbrella_report_provider_dependency.pipeline = ProviderPipeline(
+            layers=[
+                lambda provider: CachingLayer(
+                    provider=provider, cache=report_cache, registry=registry
+                )
+            ]
+        )
+        umbrella_report_provider_dependency.provider = (
+            self._create_mocked_provider_from_reports(reports=[fake_report])
+        )
+        umbrella_response_cache.attach(report_cache)
+
+        # Given a app client
+        client = self._get_client()
+
+        # When calling the "/myumbrella" entry point twice
+        first_response = client.get("/myumbrella?city=testcity")
+        second_response = client.get("/myumbrella?city=testcity")
+
+        # Then both responses should be the same
+        assert first_response.status_code == httpx.codes.OK
+        assert second_response.status_code == httpx.codes.OK
+        assert second_response.json() == first_response.json()
+        assert second_response.headers["content-type"] == "application/json"
+
+        # And the second one should not have reached the report cache
+        assert registry.counter("cache.misses") == 1
+        assert registry.counter("cache.hits") == 0
+
+        # Test teardown
+        umbrella_response_cache.detach()
+        umbrella_report_provider_dependency.pipeline = ProviderPipeline()
+        del umbrella_report_provider_dependency.provider
+
+    def test_myumbrella_view_should_not_block_event_loop(self) -> None:
+        """Check that a slow provider does not block the event loop of the app."""
+
+        # Test setup
+        class _SlowProvider:
+            def get_umbrella_report(self, city: str) -> UmbrellaReport:
+                """Block like a synchronous HTTP call."""
+                time.sleep(0.2)
+                return UmbrellaReport(
+                    location=Location(city=city), weather=WeatherState.CLEAR
+                )
+
+        umbrella_report_provider_dependency.provider = _SlowProvider()
+        detector = LoopBlockingDetector(threshold=0.05, registry=MetricsRegistry())
+        application = FastAPI()
+        application.include_router(router=router_umbrella)
+        application.add_event_handler("startup", detector.start)
+        application.add_event_handler("shutdown", detector.stop)
+
+        # Given a app client that watches its event loop
+        with TestClient(app=application) as client:
+            # When calling the "/myumbrella" entry point
+            response = client.get("/myumbrella?city=testcity")
+
+        # Then the response should return OK
+        assert response.status_code == httpx.codes.OK
+
+        # And the event loop should not have been blocked
+        detector.check()
+
+        # Test teardown
+        del umbrella_report_provider_dependency.provider
+
+    def test_myumbrella_views_should_call_provider_outside_event_loop(self) -> None:
+        """Check that the blocking provider layers are not run on the event loop."""
+
+        # Test setup
+        class _LoopCheckingProvider:
+            def __init__(self) -> None:
+                self.calls_on_loop = 0
+
+            def _record_call(self) -> UmbrellaReport:
+                try:
+                    asyncio.get_running_loop()
+                    self.calls_on_loop += 1
+                except RuntimeError:
+                    pass
+                return UmbrellaReport(
+                    location=Location(city="testcity"), weather=WeatherState.CLEAR
+                )
+
+            def get_umbrella_report(self, city: str) -> UmbrellaReport:
+                """Record whether the call runs on the event loop."""
+                return self._record_call()
+
+            def get_umbrella_report_at(
+                self, latitude: float, longitude: float
+            ) -> UmbrellaReport:
+                """Record whether the call runs on the event loop."""
+                return self._record_call()
+
+        provider = _LoopCheckingProvider()
+        umbrella_report_provider_dependency.provider = provider
+
+        # Given a app client
+        client = self._get_client()
+
+        # When calling the entry points that use the provider
+        responses = [
+            client.get("/myumbrella?city=testcity"),
+            client.get("/myumbrella/coords?lat=43.6&lon=1.44"),
+        ]
+
+        # Then the responses should return OK
+        assert [response.status_code for response in responses] == [200, 200]
+
+        # And the provider should have been called from the threadpool
+        assert provider.calls_on_loop == 0
+
+        # Test teardown
+        del umbrella_report_provider_dependency.provider
+
+    def test_myumbrella_map_view_should_return_packed_flags(self) -> None:
+        """Check that the map view returns the bit-packed flags of the grid cells."""
+
+        # Test setup
+        class _FakeCoordinatesProvider:
+            def get_umbrella_report(self, city: str) -> UmbrellaReport:
+                """Not used."""
+                raise NotImplementedError  # pragma: nocover
+
+            def get_umbrella_report_at(
+                self, latitude: float, longitude: float
+            ) -> UmbrellaReport:
+                """Get a test report: it rains in the northern cells."""
+                return UmbrellaReport(
+                    weather=WeatherState.RAIN if latitude > 44 else WeatherState.CLEAR
+                )
+
+        umbrella_report_provider_dependency.provider = _FakeCoordinatesProvider()
+
+        # Given a app client
+        client = self._get_client()
+
+        # When calling the "/myumbrella/map" entry point for a 2x2 grid
+        response = client.get("/myumbrella/map?bbox=1,43,3,45&resolution=1")
+
+        # Then the response should return OK
+        assert response.status_code == httpx.codes.OK
+
+        # And the flags should be packed row by row from the north-west corner
+        umbrella_map = UmbrellaMapResponse(**response.json())
+        assert (umbrella_map.rows, umbrella_map.columns) == (2, 2)
+        assert base64.b64decode(umbrella_map.umbrella_needed) == bytes([0b11000000])
+        assert base64.b64decode(umbrella_map.known) == bytes([0b11110000])
+
+        # Test teardown
+        del umbrella_report_provider_dependency.provider
+
+    @pytest.mark.parametrize(
+        argnames="query",
+        argvalues=["bbox=3,43,1,45&resolution=1", "bbox=-180,-90,180,90&resolution=1"],
+    )
+    def test_myumbrella_map_view_should_reject_invalid_or_large_maps(
+        self, query: str
+    ) -> None:
+        """Check that the map view rejects invalid regions and too many cells."""
+
+        # Test setup
+        class _CoordinatesProvider:
+            def get_umbrella_report(self, city: str) -> UmbrellaReport:
+                """Not used."""
+                raise NotImplementedError  # pragma: nocover
+
+            def get_umbrella_report_at(
+                self, latitude: float, longitude: float
+            ) -> UmbrellaReport:
+                """Not used."""
+                raise NotImplementedError  # pragma: nocover
+
+        umbrella_report_provider_dependency.provider = _CoordinatesProvider()
+
+        # Given a app client
+        client = self._get_client()
+
+        # When calling the "/myumbrella/map" entry point
+        response = client.get(f"/myumbrella/map?{query}")
+
+        # Then the response should be a validation error
+        assert response.status_code == httpx.codes.UNPROCESSABLE_ENTITY
+
+        # Test teardown
+        del umbrella_report_provider_dependency.provider
+
+    def test_myumbrella_map_view_should_not_drain_rate_limit(self) -> None:
+        """Check that maps only take tokens for their missing cells, if affordable."""
+
+        # Test setup
+        class _CoordinatesProvider:
+            def __init__(self) -> None:
+                self.calls = 0
+
+            def get_umbrella_report(self, city: str) -> UmbrellaReport:
+                """Not used."""
+                raise NotImplementedError  # pragma: nocover
+
+            def get_umbrella_report_at(
+                self, latitude: float, longitude: float
+            ) -> UmbrellaReport:
+                """Get a test report."""
+                self.calls += 1
+                return UmbrellaReport(weather=WeatherState.CLEAR)
+
+        provider = _CoordinatesProvider()
+        umbrella_report_provider_dependency.provider = CachingLayer(
+            provider=RateLimitingLayer(
+                provider=provider,
+                bucket=TokenBucket(rate=1.0, capacity=4, clock=lambda: 0.0),
+            ),
+            cache=ReportCache(),
+        )
+
+        # Given a app client whose rate limit allows a burst of 4 calls
+        client = self._get_client()
+
+        # When calling the "/myumbrella/map" entry point for 2x2 maps twice
+        responses = [
+            client.get("/myumbrella/map?bbox=1,43,3,45&resolution=1") for _ in range(2)
+        ]
+
+        # Then both maps should be complete, the second one from the cache
+        for response in responses:
+            assert response.status_code == httpx.codes.OK
+            umbrella_map = UmbrellaMapResponse(**response.json())
+            assert base64.b64decode(umbrella_map.known) == bytes([0b11110000])
+        assert provider.calls == 4
+
+        # And the cells of a larger map that cannot be afforded should be unknown
+        response = client.get("/myumbrella/map?bbox=1,43,4,46&resolution=1")
+        assert response.status_code == httpx.codes.OK
+        umbrella_map = UmbrellaMapResponse(**response.json())
+        assert base64.b64decode(umbrella_map.known) == bytes([0b00011011, 0])
+        assert provider.calls == 4
+
+        # Test teardown
+        del umbrella_report_provider_dependency.provider
@@ -0,0 +1,216 @@
+"""Tests for the bulk umbrella reports tool."""
+import asyncio
+import io
+import json
+import pathlib
+
+import pytest
+
+from myumbrella.apikeys import APIKeysExhaustedException
+from myumbrella.bulk import Checkpoint, _parse_arguments, read_cities, run_bulk
+from myumbrella.core import (
+    Location,
+    LocationNotFoundException,
+    UmbrellaReport,
+    WeatherState,
+)
+from myumbrella.providers import RateLimitExceededException
+
+
+class _Crash(BaseException):
+    """Simulates the crash of the process."""
+
+
+class _FakeProvider:
+    def __init__(self, crash_on: str | None = None) -> None:
+        self.calls: list[str] = []
+        self.crash_on = crash_on
+        self.rate_limited = {"Lyon"}
+
+    def get_umbrella_report(self, city: str) -> UmbrellaReport:
+        """Build a report, failing for some cities."""
+        self.calls.append(city)
+        if city == self.crash_on:
+            raise _Crash()
+        if city in self.rate_limited:
+            self.rate_limited.remove(city)
+            raise RateLimitExceededException("Rate limited")
+        if city == "Atlantis":
+            raise LocationNotFoundException("Cannot find location 'Atlantis'")
+        weather = WeatherState.RAIN if city == "Brest" else WeatherState.CLEAR
+        return UmbrellaReport(location=Location(city=city), weather=weather)
+
+
+_CITIES_CSV = "id,city\n1,Toulouse\n2,Brest\n3,Atlantis\n4,Lyon\n5,Paris\n"
+
+
+def test_read_cities_should_stream_the_city_column() -> None:
+    """Check that the cities are read from their column."""
+    # Given a CSV of cities
+    source = io.StringIO(_CITIES_CSV)
+
+    # When reading the cities
+    cities = read_cities(source, column="city")
+
+    # Then the cities should be streamed
+    assert next(cities) == "Toulouse"
+    assert list(cities) == ["Brest", "Atlantis", "Lyon", "Paris"]
+
+    # And a missing column should be reported
+    with pytest.raises(ValueError, match="town"):
+        next(read_cities(io.StringIO(_CITIES_CSV), column="town"))
+
+
+def test_run_bulk_should_write_csv_results(monkeypatch: pytest.MonkeyPatch) -> None:
+    """Check that every city gets a CSV row, in input order."""
+    # Test setup
+    monkeypatch.setattr("myumbrella.bulk._RATE_LIMIT_RETRY_DELAY", 0.0)
+
+    # Given a provider and a CSV of cities
+    provider = _FakeProvider()
+    output = io.BytesIO()
+
+    # When running the bulk tool with small batches
+    errors = asyncio.run(
+        run_bulk(
+            provider=provider,
+            source=io.StringIO(_CITIES_CSV),
+            output=output,
+            batch_size=2,
+        )
+    )
+
+    # Then each city should have a row, the failures having an error
+    assert output.getvalue().decode().splitlines() == [
+        "line,city,umbrella_needed,weather,error",
+        "1,Toulouse,False,Clear,",
+        "2,Brest,True,Rain,",
+        "3,Atlantis,,,LocationNotFoundException: Cannot find location 'Atlantis'",
+        "4,Lyon,False,Clear,",
+        "5,Paris,False,Clear,",
+    ]
+    assert errors == 1
+
+    # And the rate limited city should have been retried
+    assert provider.calls.count("Lyon") == 2
+
+
+def test_run_bulk_should_write_ndjson_results() -> None:
+    """Check that the results can be written as NDJSON."""
+    # Given a provider and a CSV of cities
+    output = io.BytesIO()
+
+    # When running the bulk tool with a NDJSON output
+    asyncio.run(
+        run_bulk(
+            provider=_FakeProvider(),
+            source=io.StringIO("city\nBrest\n"),
+            output=output,
+            output_format="ndjson",
+        )
+    )
+
+    # Then each result should be a JSON line
+    assert json.loads(output.getvalue()) == {
+        "line": 1,
+        "city": "Brest",
+        "umbrella_needed": True,
+        "weather": "Rain",
+        "error": None,
+    }
+
+
+def test_run_bulk_should_resume_from_checkpoint(
+    tmp_path: pathlib.Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """Check that a crashed run resumes after its last checkpoint without duplicates."""
+    # Test setup
+    monkeypatch.setattr("myumbrella.bulk._RATE_LIMIT_RETRY_DELAY", 0.0)
+
+    # Given a run that crashes in its 3rd batch (after writing partial results)
+    checkpoint = Checkpoint(str(tmp_path / "bulk.checkpoint"))
+    output_path = tmp_path / "reports.csv"
+    with open(output_path, "ab") as output:
+        with pytest.raises(_Crash):
+            asyncio.run(
+                run_bulk(
+                    provider=_FakeProvider(crash_on="Paris"),
+                    source=io.StringIO(_CITIES_CSV),
+                    output=output,
+                    batch_size=2,
+                    checkpoint=checkpoint,
+                )
+            )
+        output.write(b"5,Par")
+    assert checkpoint.load()[0] == 4
+
+    # When resuming the run
+    provider = _FakeProvider()
+    with open(output_path, "ab") as output:
+        asyncio.run(
+            run_bulk(
+                provider=provider,
+                source=io.StringIO(_CITIES_CSV),
+                output=output,
+                batch_size=2,
+                checkpoint=checkpoint,
+            )
+        )
+
+    # Then only the remaining cities should be processed
+    assert provider.calls == ["Paris"]
+
+    # And the output should contain every city once
+    lines = output_path.read_text(encoding="utf-8").splitlines()
+    assert [line.split(",")[0] for line in lines] == ["line", "1", "2", "3", "4", "5"]
+    assert checkpoint.load() == (5, output_path.stat().st_size)
+
+
+class _AlwaysRateLimitedProvider:
+    def __init__(self, exception: Exception) -> None:
+        self.exception = exception
+        self.calls = 0
+
+    def get_umbrella_report(self, city: str) -> UmbrellaReport:
+        """Always raise the rate limit exception."""
+        self.calls += 1
+        raise self.exception
+
+
+@pytest.mark.parametrize(
+    argnames="exception, expected_calls",
+    argvalues=[
+        (RateLimitExceededException("Rate limited"), 4),
+        (APIKeysExhaustedException("Keys rotated out"), 1),
+    ],
+)
+def test_run_bulk_should_give_up_on_rate_limits(
+    monkeypatch: pytest.MonkeyPatch, exception: Exception, expected_calls: int
+) -> None:
+    """Check that a city is reported as failed when the rate limit does not lift."""
+    # Test setup
+    monkeypatch.setattr("myumbrella.bulk._RATE_LIMIT_RETRY_DELAY", 0.125)
+    monkeypatch.setattr("myumbrella.bulk._MAX_RATE_LIMIT_WAIT", 0.375)
+
+    # Given a provider that is always rate limited
+    provider = _AlwaysRateLimitedProvider(exception)
+    output = io.BytesIO()
+
+    # When running the bulk tool
+    errors = asyncio.run(
+        run_bulk(provider=provider, source=io.StringIO("city\nParis\n"), output=output)
+    )
+
+    # Then the city should be reported as failed after a bounded number of tries
+    assert errors == 1
+    assert provider.calls == expected_calls
+    assert type(exception).__name__ in output.getvalue().decode()
+
+
+def test_parse_arguments_should_reject_checkpoint_with_stdout() -> None:
+    """Check that a run writing to stdout cannot be checkpointed."""
+    # Given arguments with a checkpoint but no output file
+    # When parsing them
+    # Then they should be rejected
+    with pytest.raises(SystemExit):
+        _parse_arguments(["cities.csv", "--checkpoint", "bulk.checkpoint"])
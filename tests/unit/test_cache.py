@@ -0,0 +1,304 @@
+"""Tests for the caches."""
+import pytest
+
+from myumbrella.cache import (
+    AdaptiveTTLPolicy,
+    NegativeCache,
+    ObservationCache,
+    ReportCache,
+    ResponseCache,
+    haversine_distance_km,
+)
+from myumbrella.core import Location, UmbrellaReport, WeatherState
+
+
+class _FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _create_report(latitude: float, longitude: float) -> UmbrellaReport:
+    return UmbrellaReport(
+        location=Location(latitude=latitude, longitude=longitude),
+        weather=WeatherState.RAIN,
+    )
+
+
+def test_haversine_distance_should_match_known_distance() -> None:
+    """Check the great-circle distance between Toulouse and Paris (~588 km)."""
+    # Given the coordinates of Toulouse and Paris
+    # When computing the distance between them
+    distance = haversine_distance_km(43.6045, 1.4442, 48.8566, 2.3522)
+
+    # Then it should match the known distance
+    assert distance == pytest.approx(588.0, abs=2.0)
+
+
+def test_observationcache_should_reuse_nearby_observation() -> None:
+    """Check that an observation made within the radius is reused."""
+    # Given a cache that contains an observation
+    cache = ObservationCache(radius_km=5.0)
+    report = _create_report(latitude=43.6045, longitude=1.4442)
+    cache.add(report)
+
+    # When looking for an observation ~1 km away
+    found = cache.find_nearest(latitude=43.6135, longitude=1.4442)
+
+    # Then the cached observation should be returned
+    assert found is report
+
+
+def test_observationcache_should_ignore_far_observation() -> None:
+    """Check that an observation made outside the radius is not reused."""
+    # Given a cache that contains an observation
+    cache = ObservationCache(radius_km=5.0)
+    cache.add(_create_report(latitude=43.6045, longitude=1.4442))
+
+    # When looking for an observation ~10 km away
+    found = cache.find_nearest(latitude=43.6945, longitude=1.4442)
+
+    # Then nothing should be returned
+    assert found is None
+
+
+def test_observationcache_should_return_the_nearest_observation() -> None:
+    """Check that the closest of several nearby observations is returned."""
+    # Given a cache that contains several nearby observations
+    cache = ObservationCache(radius_km=5.0)
+    far_report = _create_report(latitude=43.63, longitude=1.44)
+    near_report = _create_report(latitude=43.61, longitude=1.44)
+    cache.add(far_report)
+    cache.add(near_report)
+
+    # When looking for an observation
+    found = cache.find_nearest(latitude=43.60, longitude=1.44)
+
+    # Then the nearest one should be returned
+    assert found is near_report
+
+
+def test_observationcache_should_ignore_expired_observation() -> None:
+    """Check that expired observations are neither reused nor kept."""
+    # Given a cache that contains an observation
+    clock = _FakeClock()
+    cache = ObservationCache(radius_km=5.0, ttl=60.0, clock=clock)
+    cache.add(_create_report(latitude=43.6045, longitude=1.4442))
+
+    # When looking for it after it expired
+    clock.now = 61.0
+    found = cache.find_nearest(latitude=43.6045, longitude=1.4442)
+
+    # Then nothing should be returned
+    assert found is None
+
+    # And the expired observation should have been purged
+    assert len(cache) == 0
+
+
+def test_observationcache_should_pick_ttl_from_policy() -> None:
+    """Check that an observation only lasts as long as its weather is expected to."""
+    # Given a cache whose TTL is picked by the adaptive policy
+    clock = _FakeClock()
+    cache = ObservationCache(radius_km=5.0, clock=clock, policy=AdaptiveTTLPolicy())
+
+    # When storing a thunderstorm observation
+    cache.add(
+        UmbrellaReport(
+            location=Location(latitude=43.6045, longitude=1.4442),
+            weather=WeatherState.THUNDERSTORM,
+        )
+    )
+
+    # Then it should be reused for the thunderstorm TTL only
+    clock.now = 119.0
+    assert cache.find_nearest(latitude=43.6045, longitude=1.4442) is not None
+    clock.now = 121.0
+    assert cache.find_nearest(latitude=43.6045, longitude=1.4442) is None
+
+
+@pytest.mark.parametrize(
+    argnames="stored, requested",
+    argvalues=[
+        ((0.0, 179.99), (0.0, -179.99)),
+        ((89.99, 0.0), (89.99, 90.0)),
+        ((69.65, 18.95), (69.65, 19.05)),
+    ],
+)
+def test_observationcache_should_handle_antimeridian_and_high_latitudes(
+    stored: tuple[float, float], requested: tuple[float, float]
+) -> None:
+    """Check that neighbour lookup works where the grid wraps or cells get narrow."""
+    # Given a cache that contains an observation
+    cache = ObservationCache(radius_km=5.0)
+    report = _create_report(latitude=stored[0], longitude=stored[1])
+    cache.add(report)
+
+    # When looking for an observation within the radius
+    found = cache.find_nearest(latitude=requested[0], longitude=requested[1])
+
+    # Then the cached observation should be returned
+    assert found is report
+
+
+def test_observationcache_should_replace_observation_at_same_place() -> None:
+    """Check that a newer observation at the same coordinates replaces the older one."""
+    # Given a cache that contains an observation
+    cache = ObservationCache(radius_km=5.0)
+    cache.add(_create_report(latitude=43.6045, longitude=1.4442))
+
+    # When adding a newer observation at the same place
+    newer_report = _create_report(latitude=43.6045, longitude=1.4442)
+    cache.add(newer_report)
+
+    # Then only the newer one should be kept
+    assert len(cache) == 1
+    assert cache.find_nearest(latitude=43.6045, longitude=1.4442) is newer_report
+
+
+def test_reportcache_should_notify_listeners_of_changes() -> None:
+    """Check that listeners are notified when entries are set, expire or are deleted."""
+    # Given a report cache with a listener
+    clock = _FakeClock()
+    cache = ReportCache(ttl=60.0, max_entries=1, clock=clock)
+    changed_keys: list[str] = []
+    cache.add_listener(changed_keys.append)
+
+    # When setting, evicting, expiring and deleting entries
+    cache.set("toulouse", UmbrellaReport())
+    cache.set("paris", UmbrellaReport())
+    clock.now = 61.0
+    cache.get("paris")
+    cache.delete("lyon")
+
+    # Then every change should have been notified
+    assert changed_keys == ["toulouse", "paris", "toulouse", "paris", "lyon"]
+
+
+def test_adaptivettlpolicy_should_follow_weather_state() -> None:
+    """Check that settled weathers are cached longer than unsettled ones."""
+    # Given an adaptive TTL policy
+    policy = AdaptiveTTLPolicy()
+
+    # When picking the TTL of a clear sky and of a thunderstorm
+    clear_ttl = policy.ttl_for("toulouse", UmbrellaReport(weather=WeatherState.CLEAR))
+    storm_ttl = policy.ttl_for(
+        "paris", UmbrellaReport(weather=WeatherState.THUNDERSTORM)
+    )
+
+    # Then the clear sky should be cached longer
+    assert clear_ttl == 1800.0
+    assert storm_ttl == 120.0
+
+
+def test_adaptivettlpolicy_should_shorten_ttl_of_changing_weather() -> None:
+    """Check that the TTL shrinks when the weather of a key keeps changing."""
+    # Given an adaptive TTL policy
+    policy = AdaptiveTTLPolicy(smoothing=0.5, min_ttl=10.0)
+
+    # When the weather of a location changes
+    policy.ttl_for("toulouse", UmbrellaReport(weather=WeatherState.CLEAR))
+    ttl = policy.ttl_for("toulouse", UmbrellaReport(weather=WeatherState.CLOUDS))
+
+    # Then the TTL of the new weather should be shortened
+    assert ttl == pytest.approx(900.0 * 0.5)
+
+    # And it should recover while the weather stays the same
+    ttl = policy.ttl_for("toulouse", UmbrellaReport(weather=WeatherState.CLOUDS))
+    assert ttl == pytest.approx(900.0 * 0.75)
+
+
+def test_adaptivettlpolicy_should_account_for_upstream_data_age() -> None:
+    """Check that the age of the upstream data is deducted from the TTL."""
+    # Given an adaptive TTL policy
+    clock = _FakeClock()
+    clock.now = 1_700_000_000.0
+    policy = AdaptiveTTLPolicy(wall_clock=clock)
+
+    # When picking the TTL of a report calculated upstream 5 minutes ago
+    ttl = policy.ttl_for(
+        "toulouse",
+        UmbrellaReport(weather=WeatherState.CLOUDS, observed_at=clock.now - 300.0),
+    )
+
+    # Then the age should be deducted from the TTL
+    assert ttl == 600.0
+
+    # And the TTL should never go below the minimum
+    ttl = policy.ttl_for(
+        "paris",
+        UmbrellaReport(weather=WeatherState.RAIN, observed_at=clock.now - 3600.0),
+    )
+    assert ttl == policy.min_ttl
+
+
+def test_reportcache_should_use_ttl_policy() -> None:
+    """Check that the report cache expires the reports according to its policy."""
+    # Given a report cache with an adaptive TTL policy
+    clock = _FakeClock()
+    cache = ReportCache(policy=AdaptiveTTLPolicy(), clock=clock)
+
+    # When caching a clear sky and a thunderstorm
+    cache.set("toulouse", UmbrellaReport(weather=WeatherState.CLEAR))
+    cache.set("paris", UmbrellaReport(weather=WeatherState.THUNDERSTORM))
+
+    # Then only the clear sky should be served after a few minutes
+    clock.now = 300.0
+    assert cache.get("toulouse") is not None
+    assert cache.get("paris") is None
+
+
+def test_negativecache_should_expire_misses() -> None:
+    """Check that the misses are forgotten after their TTL."""
+    # Given a negative cache that contains a miss
+    clock = _FakeClock()
+    cache = NegativeCache(ttl=60.0, clock=clock)
+    cache.set("toulose", "Cannot find location 'toulose'")
+
+    # When looking for the miss before and after its TTL
+    # Then it should only be found before
+    assert cache.get("toulose") == "Cannot find location 'toulose'"
+    clock.now = 60.0
+    assert cache.get("toulose") is None
+    assert len(cache) == 0
+
+
+def test_responsecache_should_be_disabled_until_attached() -> None:
+    """Check that nothing is stored until a report cache is attached."""
+    # Given a response cache that is not attached
+    cache = ResponseCache()
+
+    # When storing a response
+    cache.set("toulouse", content=b"{}", report=UmbrellaReport())
+
+    # Then it should not be stored
+    assert not cache.enabled
+    assert cache.get("toulouse") is None
+
+
+def test_responsecache_should_follow_report_cache() -> None:
+    """Check that responses are invalidated when the report entry changes."""
+    # Given a response cache attached to a report cache
+    report_cache = ReportCache()
+    cache = ResponseCache()
+    cache.attach(report_cache)
+    report = UmbrellaReport(weather=WeatherState.RAIN)
+    report_cache.set("toulouse", report)
+
+    # When storing the response built from the cached report
+    cache.set("toulouse", content=b"rain", report=report)
+
+    # Then it should be served
+    assert cache.get("toulouse") == b"rain"
+
+    # When the report entry changes
+    report_cache.set("toulouse", UmbrellaReport(weather=WeatherState.CLEAR))
+
+    # Then the response should be invalidated
+    assert cache.get("toulouse") is None
+
+    # And a response built from the previous report should not be stored anymore
+    cache.set("toulouse", content=b"rain", report=report)
+    assert cache.get("toulouse") is None
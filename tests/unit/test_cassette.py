@@ -0,0 +1,139 @@
+"""Tests for the record and the replay of the Openweather traffic."""
+import itertools
+from pathlib import Path
+
+import httpx
+import pytest
+
+from myumbrella.cassette import RecordingTransport, ReplayTransport, load_cassette
+from myumbrella.core import WeatherState
+from myumbrella.openweather import OpenweatherClient
+
+_API_RESPONSES = {
+    "/geo/1.0/direct": [
+        {"name": "Toulouse", "country": "FR", "lat": 43.6044622, "lon": 1.4442469}
+    ],
+    "/data/2.5/weather": {"weather": [{"id": 500, "description": "light rain"}]},
+}
+
+
+def _handle_api_request(request: httpx.Request) -> httpx.Response:
+    return httpx.Response(status_code=200, json=_API_RESPONSES[request.url.path])
+
+
+def _record_toulouse(cassette_path: Path) -> None:
+    # Each exchange takes 0.1 s according to the clock
+    clock = (0.1 * tick for tick in itertools.count())
+    client = OpenweatherClient(
+        api_key="testapikey",
+        transport=RecordingTransport(
+            path=cassette_path,
+            transport=httpx.MockTransport(_handle_api_request),
+            clock=lambda: next(clock),
+        ),
+    )
+    client.get_umbrella_report("Toulouse")
+    client.close()
+
+
+def test_recordingtransport_should_record_exchanges_without_api_key(
+    tmp_path: Path,
+) -> None:
+    """Check that every exchange is recorded with its latency but not the API key."""
+    # Given a client that records its traffic
+    cassette_path = tmp_path / "openweather.ndjson.gz"
+
+    # When retrieving a report
+    _record_toulouse(cassette_path)
+
+    # Then the geocoding and weather calls should have been recorded
+    entries = load_cassette(cassette_path)
+    assert [entry.path for entry in entries] == ["/geo/1.0/direct", "/data/2.5/weather"]
+    assert entries[0].params == [("q", "Toulouse")]
+    assert all(entry.latency == pytest.approx(0.1) for entry in entries)
+
+    # And the API key should not have been recorded
+    assert "testapikey" not in cassette_path.read_bytes().decode("latin-1")
+
+
+def test_loadcassette_should_read_cassette_of_crashed_recording(
+    tmp_path: Path,
+) -> None:
+    """Check that a cassette whose recording never closed it can be replayed."""
+    # Given a recording that is still running
+    cassette_path = tmp_path / "openweather.ndjson.gz"
+    recording_transport = RecordingTransport(
+        path=cassette_path, transport=httpx.MockTransport(_handle_api_request)
+    )
+    client = OpenweatherClient(api_key="testapikey", transport=recording_transport)
+    client.get_umbrella_report("Toulouse")
+
+    # When the process crashes in the middle of an entry
+    complete_size = cassette_path.stat().st_size
+    client.get_umbrella_report("Paris")
+    with open(cassette_path, "r+b") as cassette:
+        cassette.truncate(complete_size + 30)
+
+    # Then the complete entries should be read
+    entries = load_cassette(cassette_path)
+    assert [entry.path for entry in entries] == ["/geo/1.0/direct", "/data/2.5/weather"]
+
+    # Test teardown
+    client.close()
+
+
+def test_replaytransport_should_serve_recorded_responses_with_scaled_latency(
+    tmp_path: Path,
+) -> None:
+    """Check that a client can run offline from a cassette."""
+    # Test setup
+    cassette_path = tmp_path / "openweather.ndjson.gz"
+    _record_toulouse(cassette_path)
+    sleeps: list[float] = []
+
+    # Given a client that replays a cassette at twice the recorded latency
+    client = OpenweatherClient(
+        api_key="otherapikey",
+        transport=ReplayTransport(
+            path=cassette_path, latency_scale=2.0, sleep=sleeps.append
+        ),
+    )
+
+    # When retrieving the recorded report
+    report = client.get_umbrella_report("Toulouse")
+
+    # Then the recorded responses should be served
+    assert report.location.city == "Toulouse"
+    assert report.weather == WeatherState.RAIN
+
+    # And the latencies should have been scaled
+    assert sleeps == [pytest.approx(0.2), pytest.approx(0.2)]
+
+    # Test teardown
+    client.close()
+
+
+def test_replaytransport_should_only_serve_unrecorded_requests_unless_strict(
+    tmp_path: Path,
+) -> None:
+    """Check that unrecorded requests are served by endpoint only when not strict."""
+    # Test setup
+    cassette_path = tmp_path / "openweather.ndjson.gz"
+    _record_toulouse(cassette_path)
+    request = httpx.Request(
+        "GET", "https://openweather.test/geo/1.0/direct", params={"q": "Paris"}
+    )
+
+    # Given a strict replay transport
+    transport = ReplayTransport(path=cassette_path, latency_scale=0.0)
+
+    # When serving an unrecorded request
+    # Then it should fail like an unreachable host
+    with pytest.raises(httpx.ConnectError):
+        transport.handle_request(request)
+
+    # When not strict
+    transport.strict = False
+
+    # Then it should be served a response recorded for the same endpoint
+    assert transport.handle_request(request).json()[0]["name"] == "Toulouse"
@@ -0,0 +1,82 @@
+"""Tests for the app dependencies."""
+import pytest
+
+from myumbrella.core import UmbrellaReport, UmbrellaReportProvider
+from myumbrella.dependencies import (
+    DependencyNotInitializedException,
+    ProviderPipeline,
+    UmbrellaReportProviderDependency,
+)
+from myumbrella.locations import AliasIndex
+from myumbrella.providers import CachingLayer, MetricsLayer, provider_layers
+
+
+class _DummyProvider:
+    def get_umbrella_report(self, city: str) -> UmbrellaReport:
+        """Build an empty report."""
+        return UmbrellaReport()
+
+
+def test_pipeline_should_stack_layers_from_outermost_to_innermost() -> None:
+    """Check that the pipeline wraps the provider in the declared order."""
+    # Given a pipeline built from layer names
+    pipeline = ProviderPipeline.from_names(
+        names="cache, metrics", registry=provider_layers(alias_index=AliasIndex())
+    )
+    provider = _DummyProvider()
+
+    # When building it around a provider
+    built = pipeline.build(provider)
+
+    # Then the first layer should be the outermost one
+    assert isinstance(built, CachingLayer)
+    assert isinstance(built.provider, MetricsLayer)
+    assert built.provider.provider is provider
+
+
+def test_pipeline_should_reject_unknown_layer() -> None:
+    """Check that a typo in the pipeline configuration is reported."""
+    # Given an unknown layer name
+    # When building a pipeline
+    # Then an error should be raised
+    with pytest.raises(ValueError):
+        ProviderPipeline.from_names(
+            names="cache,turbo", registry=provider_layers(alias_index=AliasIndex())
+        )
+
+
+def test_dependency_should_serve_the_pipeline_around_the_provider() -> None:
+    """Check that the dependency serves the provider wrapped once by the pipeline."""
+    # Given a dependency with a pipeline
+    dependency = UmbrellaReportProviderDependency(
+        pipeline=ProviderPipeline(layers=[CachingLayer])
+    )
+    provider = _DummyProvider()
+
+    # When setting the provider
+    dependency.provider = provider
+
+    # Then the provider itself should be kept
+    assert dependency.provider is provider
+
+    # And the routes should get the same wrapped provider every time
+    served: UmbrellaReportProvider = dependency()
+    assert isinstance(served, CachingLayer)
+    assert dependency() is served
+
+    # And setting the provider again should not wrap it twice
+    dependency.provider = dependency.provider
+    served = dependency()
+    assert isinstance(served, CachingLayer)
+    assert served.provider is provider
+
+
+def test_dependency_should_raise_without_provider() -> None:
+    """Check that the dependency fails when no provider is set."""
+    # Given a dependency without provider
+    dependency = UmbrellaReportProviderDependency()
+
+    # When resolving the dependency
+    # Then an exception should be raised
+    with pytest.raises(DependencyNotInitializedException):
+        dependency()
@@ -0,0 +1,102 @@
+"""Tests for the umbrella maps computed over a grid of coordinates."""
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from myumbrella.core import Location, UmbrellaReport, WeatherState
+from myumbrella.grid import (
+    BoundingBox,
+    UmbrellaGrid,
+    compute_umbrella_flags,
+    pack_flags,
+)
+from myumbrella.metrics import MetricsRegistry
+from myumbrella.providers import RateLimitExceededException
+
+
+class _RainyWestProvider:
+    """Fake provider: it rains west of the Greenwich meridian, the east is throttled."""
+
+    def get_umbrella_report(self, city: str) -> UmbrellaReport:
+        """Not used."""
+        raise NotImplementedError  # pragma: nocover
+
+    def get_umbrella_report_at(
+        self, latitude: float, longitude: float
+    ) -> UmbrellaReport:
+        """Get a test report."""
+        if longitude > 1.0:
+            raise RateLimitExceededException("Too many calls")
+        return UmbrellaReport(
+            location=Location(latitude=latitude, longitude=longitude),
+            weather=WeatherState.RAIN if longitude < 0.0 else WeatherState.CLEAR,
+        )
+
+
+@pytest.mark.parametrize(
+    argnames="text",
+    argvalues=["1,2,3", "a,b,c,d", "3,43,1,44", "1,-91,2,0"],
+)
+def test_boundingbox_should_reject_invalid_regions(text: str) -> None:
+    """Check that malformed or inverted bounding boxes are rejected."""
+    # Given an invalid bounding box
+    # When parsing it
+    # Then it should fail
+    with pytest.raises(ValueError):
+        BoundingBox.parse(text)
+
+
+def test_umbrellagrid_should_snap_region_to_lattice() -> None:
+    """Check that the grid covers the region with cells aligned on the lattice."""
+    # Given a region that is not aligned on the lattice
+    bbox = BoundingBox.parse("1.25,43.55,1.55,43.7")
+
+    # When computing the grid covering it
+    grid = UmbrellaGrid.covering(bbox, resolution=0.1)
+
+    # Then the grid should be snapped to the lattice
+    assert grid.bbox == BoundingBox(west=1.2, south=43.5, east=1.6, north=43.7)
+    assert (grid.rows, grid.columns) == (2, 4)
+
+    # And the cells should be listed from the north-west corner
+    centers = grid.cell_centers()
+    assert len(centers) == len(grid) == 8
+    assert centers[0] == (43.65, 1.25)
+    assert centers[-1] == (43.55, 1.55)
+
+
+@pytest.mark.parametrize(
+    argnames="flags, expected_bytes",
+    argvalues=[
+        ([], b""),
+        ([True], b"\x80"),
+        ([True, False, True, False, False, False, False, True], b"\xa1"),
+        ([False] * 8 + [True, True], b"\x00\xc0"),
+    ],
+)
+def test_pack_flags_should_pack_bits_msb_first(
+    flags: list[bool], expected_bytes: bytes
+) -> None:
+    """Check the bit-packing of the flags."""
+    # Given flags
+    # When packing them
+    # Then the bits should be packed most significant bit first
+    assert pack_flags(flags) == expected_bytes
+
+
+def test_compute_umbrella_flags_should_mark_failed_cells_as_unknown() -> None:
+    """Check that every cell is assessed, failed cells being unknown."""
+    # Given a grid over a provider that fails for some cells
+    grid = UmbrellaGrid.covering(BoundingBox.parse("-1,0,2,1"), resolution=1.0)
+    registry = MetricsRegistry()
+
+    # When computing the flags of the grid
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        flags = compute_umbrella_flags(
+            _RainyWestProvider(), grid, executor=executor, registry=registry
+        )
+
+    # Then every cell should have been assessed
+    assert flags == [True, False, None]
+    assert registry.counter("map.cells") == 3
+    assert registry.counter("map.cells.unknown") == 1
@@ -0,0 +1,144 @@
+"""Tests for the hedging of slow upstream requests."""
+import threading
+import time
+from typing import Any
+
+import pytest
+
+from myumbrella.hedging import HedgingPolicy, LatencyTracker
+from myumbrella.metrics import MetricsRegistry
+from myumbrella.openweather import OpenweatherClient
+
+
+class _SlowThenFastSender:
+    """Fake request sender: the first call hangs, the following ones are fast."""
+
+    def __init__(self, slow_delay: float = 1.0) -> None:
+        self.calls = 0
+        self.slow_delay = slow_delay
+        self._lock = threading.Lock()
+
+    def __call__(self) -> str:
+        with self._lock:
+            self.calls += 1
+            call_number = self.calls
+
+        if call_number == 1:
+            time.sleep(self.slow_delay)
+            return "slow"
+        return "fast"
+
+
+def test_latencytracker_should_compute_percentiles() -> None:
+    """Check the percentile estimation of the latency tracker."""
+    # Given a tracker with 100 latencies
+    tracker = LatencyTracker()
+    for latency in range(1, 101):
+        tracker.record(latency / 100)
+
+    # When computing the 95th percentile
+    # Then it should match the expected latency
+    assert tracker.percentile(0.95) == pytest.approx(0.95)
+
+
+def test_hedgingpolicy_should_adapt_delay_to_observed_latencies() -> None:
+    """Check that the hedging delay follows the percentile of the endpoint latencies."""
+    # Given a hedging policy
+    policy = HedgingPolicy(default_delay=1.0, min_delay=0.0)
+
+    # When no latency has been observed
+    # Then the default delay should be used
+    assert policy.delay_for("endpoint") == 1.0
+
+    # When latencies have been observed
+    for _ in range(50):
+        policy.call(endpoint="endpoint", send=lambda: None)
+
+    # Then the delay should follow them
+    assert policy.delay_for("endpoint") < 0.1
+    policy.shutdown()
+
+
+def test_hedgingpolicy_should_hedge_slow_request() -> None:
+    """Check that a slow request is hedged and that the hedge wins."""
+    # Given a hedging policy with budget available
+    registry = MetricsRegistry()
+    policy = HedgingPolicy(budget=1.0, default_delay=0.05, registry=registry)
+    sender = _SlowThenFastSender()
+
+    # When sending a request that hangs
+    start = time.perf_counter()
+    result = policy.call(endpoint="endpoint", send=sender)
+    elapsed = time.perf_counter() - start
+
+    # Then the hedged request should win
+    assert result == "fast"
+    assert elapsed < sender.slow_delay
+
+    # And the hedge should be counted
+    assert registry.counter("openweather.hedge.sent") == 1
+    assert registry.counter("openweather.hedge.won") == 1
+    policy.shutdown()
+
+
+def test_hedgingpolicy_should_respect_budget() -> None:
+    """Check that no hedge is sent when the budget is exhausted."""
+    # Given a hedging policy with a small budget
+    registry = MetricsRegistry()
+    policy = HedgingPolicy(budget=0.05, default_delay=0.01, registry=registry)
+    sender = _SlowThenFastSender(slow_delay=0.1)
+
+    # When sending a request that is slow
+    result = policy.call(endpoint="endpoint", send=sender)
+
+    # Then it should not be hedged
+    assert result == "slow"
+    assert sender.calls == 1
+    assert registry.counter("openweather.hedge.sent") == 0
+    policy.shutdown()
+
+
+def test_hedgingpolicy_should_use_other_response_when_one_fails() -> None:
+    """Check that an error of one request does not hide the success of the other."""
+    # Given a hedging policy with budget available
+    policy = HedgingPolicy(budget=1.0, default_delay=0.01, registry=MetricsRegistry())
+    calls: list[int] = []
+
+    def sender() -> str:
+        calls.append(1)
+        if len(calls) == 1:
+            time.sleep(0.05)
+            raise TimeoutError("slow and failing")
+        time.sleep(0.1)
+        return "ok"
+
+    # When the first request fails after the hedge was sent
+    # Then the response of the hedge should be returned
+    assert policy.call(endpoint="endpoint", send=sender) == "ok"
+    policy.shutdown()
+
+
+def test_openweatherclient_should_hedge_through_policy() -> None:
+    """Check that the client sends its requests through the hedging policy."""
+
+    # Given a client with a hedging policy
+    class _RecordingPolicy(HedgingPolicy):
+        def __init__(self) -> None:
+            super().__init__(registry=MetricsRegistry())
+            self.endpoints: list[str] = []
+
+        def call(self, endpoint: str, send: Any) -> Any:
+            self.endpoints.append(endpoint)
+            return [{"name": "Toulouse", "lat": 43.6, "lon": 1.44}]
+
+    policy = _RecordingPolicy()
+    client = OpenweatherClient(api_key="testapikey", hedging=policy)
+
+    # When calling the API
+    client._call_rest_api(  # pylint: disable=protected-access
+        endpoint="geo/1.0/direct", params={"q": "Toulouse"}
+    )
+
+    # Then the request should go through the policy
+    assert policy.endpoints == ["geo/1.0/direct"]
+    policy.shutdown()
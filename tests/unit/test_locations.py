@@ -0,0 +1,157 @@
+"""Tests for the canonicalization of the city queries."""
+import pytest
+
+from myumbrella.core import Location
+from myumbrella.locations import AliasIndex, CityQuery, canonicalize_city_query
+
+_PARIS = Location(
+    city="Paris", state="Ile-de-France", country="FR", latitude=48.85, longitude=2.35
+)
+
+
+@pytest.mark.parametrize(
+    argnames="city",
+    argvalues=["paris", " Paris", "PARIS", "  paris  ", "Pâris"],
+)
+def test_canonicalize_should_give_same_key_to_equivalent_spellings(city: str) -> None:
+    """Check that case, whitespaces and diacritics do not change the query key."""
+    # Given a spelling of a city
+    # When canonicalizing it
+    query = canonicalize_city_query(city)
+
+    # Then its key should be the same as the simplest spelling
+    assert query.key == "paris"
+
+
+@pytest.mark.parametrize(
+    argnames="city, expected_query",
+    argvalues=[
+        ("Paris,FR", CityQuery(name="Paris", country_code="FR")),
+        (" paris , fr ", CityQuery(name="paris", country_code="FR")),
+        ("Portland, OR, US", CityQuery(name="Portland", state="OR", country_code="US")),
+        ("São  Paulo", CityQuery(name="São Paulo")),
+        ("Paris, France", CityQuery(name="Paris", state="France")),
+        (" , ", CityQuery(name="")),
+    ],
+)
+def test_canonicalize_should_parse_country_code(
+    city: str, expected_query: CityQuery
+) -> None:
+    """Check that a trailing two-letter code is parsed as the country code."""
+    # Given a city query
+    # When canonicalizing it
+    # Then the result should be the expected one
+    assert canonicalize_city_query(city) == expected_query
+
+
+def test_geocoding_query_should_keep_diacritics() -> None:
+    """Check that the query sent to Openweather is cleaned but not folded."""
+    # Given a canonicalized city query
+    query = canonicalize_city_query(" são  paulo ,br")
+
+    # When building the geocoding query
+    # Then it should keep the diacritics
+    assert query.geocoding_query == "são paulo,BR"
+
+
+def test_aliasindex_should_resolve_learned_spellings() -> None:
+    """Check that the query and the canonical location spellings are learned."""
+    # Given an alias index that learned the location of a query
+    index = AliasIndex()
+    index.learn(canonicalize_city_query("paris"), _PARIS)
+
+    # When looking up other spellings of that query or of the location
+    # Then the location should be found
+    for city in (
+        "PARIS",
+        " Paris",
+        "Paris,Ile-de-France,FR",
+        "paris, île-de-france, fr",
+    ):
+        assert index.lookup(canonicalize_city_query(city)) == _PARIS
+
+    # And other locations should not be
+    assert index.lookup(canonicalize_city_query("Paris,US")) is None
+
+
+def test_aliasindex_should_give_same_cache_key_to_known_aliases() -> None:
+    """Check that known aliases share the cache key of their location."""
+    # Given an alias index that learned the location of a query
+    index = AliasIndex()
+    index.learn(canonicalize_city_query("paris"), _PARIS)
+
+    # When computing the cache keys of known spellings
+    # Then they should all be the key of the location
+    assert (
+        index.cache_key("PARIS")
+        == index.cache_key("Paris,Ile-de-France,FR")
+        == "paris,ile-de-france,fr@48.85,2.35"
+    )
+
+    # And unknown queries should be keyed by their canonical form
+    assert index.cache_key(" Lyon ") == "lyon"
+
+
+def test_aliasindex_should_tell_homonyms_apart() -> None:
+    """Check that places sharing a name do not share a cache key."""
+    # Given an alias index that learned two Springfields
+    index = AliasIndex()
+    index.learn(
+        canonicalize_city_query("Springfield,IL,US"),
+        Location(
+            city="Springfield",
+            state="Illinois",
+            country="US",
+            latitude=39.80,
+            longitude=-89.64,
+        ),
+    )
+    index.learn(
+        canonicalize_city_query("Springfield,MO,US"),
+        Location(
+            city="Springfield",
+            state="Missouri",
+            country="US",
+            latitude=37.21,
+            longitude=-93.29,
+        ),
+    )
+
+    # When computing their cache keys
+    # Then they should differ
+    assert index.cache_key("Springfield,IL,US") != index.cache_key("Springfield,MO,US")
+
+
+def test_aliasindex_should_be_bounded() -> None:
+    """Check that the least recently used aliases are forgotten."""
+    # Given a small alias index
+    index = AliasIndex(max_entries=2)
+
+    # When learning more aliases than it can hold
+    index.learn(canonicalize_city_query("paris"), _PARIS)
+    index.learn(canonicalize_city_query("PaRiS"), _PARIS)
+    index.learn(
+        canonicalize_city_query("lyon"),
+        Location(city="Lyon", country="FR", latitude=45.76, longitude=4.84),
+    )
+
+    # Then it should not hold more than its maximum
+    assert len(index) == 2
+    assert index.lookup(canonicalize_city_query("paris")) is None
+
+
+def test_aliasindex_should_keep_stale_locations_as_hints() -> None:
+    """Check that expired aliases are only returned when stale ones are accepted."""
+    # Given an alias index whose alias expired
+    now = 0.0
+    index = AliasIndex(ttl=60.0, clock=lambda: now)
+    index.learn(canonicalize_city_query("paris"), _PARIS)
+    now = 61.0
+
+    # When looking up the alias
+    # Then it should only be found when stale locations are accepted
+    assert index.lookup(canonicalize_city_query("paris")) is None
+    assert index.lookup(canonicalize_city_query("paris"), include_stale=True) == _PARIS
+
+    # And the cache key should still be the one of the location
+    assert index.cache_key("PARIS") == "paris,ile-de-france,fr@48.85,2.35"
@@ -0,0 +1,125 @@
+"""Tests for the logging setup of the application."""
+import logging
+import threading
+from typing import Iterator
+
+import pytest
+
+from myumbrella.logs import SamplingFilter, setup_logging
+from myumbrella.metrics import MetricsRegistry
+
+
+class _FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class _RecordingHandler(logging.Handler):
+    """Handler that keeps the formatted messages and the threads that wrote them."""
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.messages: list[str] = []
+        self.threads: set[str] = set()
+
+    def emit(self, record: logging.LogRecord) -> None:
+        self.messages.append(self.format(record))
+        self.threads.add(threading.current_thread().name)
+
+
+def _create_record(msg: str, level: int = logging.INFO) -> logging.LogRecord:
+    return logging.LogRecord(
+        name="myumbrella.test",
+        level=level,
+        pathname=__file__,
+        lineno=0,
+        msg=msg,
+        args=("Toulouse",),
+        exc_info=None,
+    )
+
+
+@pytest.fixture(name="root_logger")
+def fixture_root_logger() -> Iterator[logging.Logger]:
+    """Restore the root logger once the test changed it."""
+    root_logger = logging.getLogger()
+    handlers, level = root_logger.handlers[:], root_logger.level
+
+    yield root_logger
+
+    for handler in root_logger.handlers[:]:
+        root_logger.removeHandler(handler)
+    for handler in handlers:
+        root_logger.addHandler(handler)
+    root_logger.setLevel(level)
+
+
+def test_samplingfilter_should_rate_limit_each_message_type() -> None:
+    """Check that each message type is limited on its own, within a period."""
+    # Given a filter that lets 2 messages of a type per second
+    clock = _FakeClock()
+    registry = MetricsRegistry()
+    sampling_filter = SamplingFilter(
+        rate_limit=2, period=1.0, registry=registry, clock=clock
+    )
+
+    # When filtering 3 messages of two types within a second
+    # Then only the first 2 of each type should pass
+    for msg in ("Getting report for %s", "Calling API for %s"):
+        results = [sampling_filter.filter(_create_record(msg)) for _ in range(3)]
+        assert results == [True, True, False]
+    assert registry.counter("logging.suppressed") == 2
+
+    # And warnings should never be filtered out
+    assert sampling_filter.filter(_create_record("Failed for %s", logging.WARNING))
+
+    # And messages should pass again in the next period
+    clock.now = 1.0
+    assert sampling_filter.filter(_create_record("Getting report for %s"))
+
+
+def test_samplingfilter_should_sample_per_message_type() -> None:
+    """Check that the sample rate of a message type overrides the default one."""
+    # Given a filter that keeps a tenth of a message type
+    draws = iter([0.05, 0.5, 0.5])
+    sampling_filter = SamplingFilter(
+        sample_rates={"Getting report for %s": 0.1},
+        registry=MetricsRegistry(),
+        draw=lambda: next(draws),
+    )
+
+    # When filtering messages of that type
+    # Then only the sampled ones should pass
+    assert sampling_filter.filter(_create_record("Getting report for %s"))
+    assert not sampling_filter.filter(_create_record("Getting report for %s"))
+
+    # And the other message types should all pass
+    assert sampling_filter.filter(_create_record("Calling API for %s"))
+
+
+def test_setuplogging_should_write_from_background_thread(
+    root_logger: logging.Logger,
+) -> None:
+    """Check that the logs are formatted and written by the listener thread."""
+    # Given the logging set up with a recording handler
+    handler = _RecordingHandler()
+    listener = setup_logging(
+        handlers=[handler],
+        sampling_filter=SamplingFilter(rate_limit=1, registry=MetricsRegistry()),
+    )
+
+    # When logging the same message type twice
+    logger = logging.getLogger("myumbrella.test")
+    logger.info("Getting report for %s", "Toulouse")
+    logger.info("Getting report for %s", "Paris")
+    listener.stop()
+
+    # Then only the first one should have been written
+    assert handler.messages == ["Getting report for Toulouse"]
+
+    # And it should not have been written by the emitting thread
+    assert threading.current_thread().name not in handler.threads
+    assert root_logger.handlers[0] is not handler
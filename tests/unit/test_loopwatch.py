@@ -0,0 +1,93 @@
+"""Tests for the detection of the code that blocks the event loop."""
+import asyncio
+import time
+
+import pytest
+
+from myumbrella.admission import LoopLagMonitor
+from myumbrella.loopwatch import EventLoopBlockedException, LoopBlockingDetector
+from myumbrella.metrics import MetricsRegistry
+
+
+async def _blocking_handler() -> None:
+    time.sleep(0.2)  # Blocking on purpose
+
+
+@pytest.mark.blocks_event_loop
+def test_loopblockingdetector_should_report_blocking_code() -> None:
+    """Check that a blocking coroutine is reported with its stack."""
+    # Test setup
+    registry = MetricsRegistry()
+    detector = LoopBlockingDetector(threshold=0.05, registry=registry)
+
+    async def scenario() -> None:
+        await detector.start()
+        await asyncio.sleep(0.02)
+
+        # When a coroutine blocks the event loop
+        await _blocking_handler()
+        await asyncio.sleep(0.05)
+
+        await detector.stop()
+
+    # Given a started detector
+    asyncio.run(scenario())
+
+    # Then the blocking should be reported with the offending code
+    assert len(detector.reports) == 1
+    assert "_blocking_handler" in detector.reports[0].stack
+    assert registry.counter("eventloop.blocked") == 1
+    assert registry.summary("eventloop.blocked_time").maximum >= 0.1
+
+    # And the test mode should fail
+    with pytest.raises(EventLoopBlockedException, match="_blocking_handler"):
+        detector.check()
+
+
+def test_loopblockingdetector_should_ignore_non_blocking_code() -> None:
+    """Check that awaiting does not count as blocking."""
+    # Test setup
+    detector = LoopBlockingDetector(threshold=0.05, registry=MetricsRegistry())
+
+    async def scenario() -> None:
+        await detector.start()
+
+        # When a coroutine waits without blocking the event loop
+        await asyncio.sleep(0.2)
+
+        await detector.stop()
+
+    # Given a started detector
+    asyncio.run(scenario())
+
+    # Then nothing should be reported
+    assert not detector.reports
+    detector.check()
+
+
+@pytest.mark.blocks_event_loop
+def test_loopblockingdetector_should_watch_shared_lag_monitor() -> None:
+    """Check that the detector watches the heartbeat of the given lag monitor."""
+    # Test setup
+    registry = MetricsRegistry()
+    lag_monitor = LoopLagMonitor(interval=0.01, registry=registry)
+    detector = LoopBlockingDetector(
+        threshold=0.05, registry=registry, lag_monitor=lag_monitor
+    )
+
+    async def scenario() -> None:
+        await detector.start()
+        await asyncio.sleep(0.02)
+
+        # When a coroutine blocks the event loop
+        await _blocking_handler()
+        await asyncio.sleep(0.05)
+
+        await detector.stop()
+
+    # Given a detector sharing the lag monitor of the admission control
+    asyncio.run(scenario())
+
+    # Then the blocking should be reported once
+    assert len(detector.reports) == 1
+    assert registry.summary("eventloop.lag").maximum >= 0.1
@@ -5,15 +5,26 @@ import string
 import tempfile
 from typing import Any
 
+import httpx
 import pytest
 
-from myumbrella.core import Location, UmbrellaReport, WeatherState
+from myumbrella.apikeys import APIKeyPool, APIKeysExhaustedException
+from myumbrella.cache import ObservationCache
+from myumbrella.core import (
+    Location,
+    UmbrellaReport,
+    UpstreamErrorException,
+    WeatherState,
+)
+from myumbrella.locations import AliasIndex, canonicalize_city_query
+from myumbrella.metrics import MetricsRegistry, metrics
 from myumbrella.openweather import (
     LocationNotFoundException,
     NoAPIKeyAvailableException,
     OpenweatherClient,
     convert_openweather_code_to_weatherstate,
     load_openweather_api_key_from_env_variable,
+    load_openweather_api_keys_from_env_variable,
 )
 
 
@@ -122,6 +133,40 @@ class TestLoadAPIKEY:
         # Then the expected API key should be loaded
         assert api_key == self._EXPECTED_API_KEY
 
+    def test_loadapikeys_should_work_with_raw_keys(self) -> None:
+        """Check loading several API keys from a raw environment variable."""
+        # Given a environment variable that contains several API keys
+        env_var_name = self._create_new_env_variable_from_value(value="key1, key2,")
+
+        # When load the api keys
+        api_keys = load_openweather_api_keys_from_env_variable(
+            env_var_name=env_var_name
+        )
+
+        # Test teardown before assertion that may fail
+        self._teardown_env_variable(env_var_name)
+
+        # Then the expected API keys should be loaded
+        assert api_keys == ["key1", "key2"]
+
+    def test_loadapikeys_should_work_with_file_env_variable(self) -> None:
+        """Check loading API keys from a file with one key per line."""
+        # Given a environment variable that contains the path to a file of API keys
+        env_var_name = self._create_new_file_env_variable_from_content(
+            content="# Main plan\nkey1\n\nkey2\n"
+        )
+
+        # When load the api keys
+        api_keys = load_openweather_api_keys_from_env_variable(
+            env_var_name=env_var_name
+        )
+
+        # Test teardown before assertion that may fail
+        self._teardown_file_env_variable(env_var_name=env_var_name)
+
+        # Then the expected API keys should be loaded
+        assert api_keys == ["key1", "key2"]
+
     def test_loadapikey_should_raise_if_env_variable_is_not_set(self) -> None:
         """Check that loading API key fails when the environment variable does not exist."""
         # Given an environment that does not exist
@@ -258,14 +303,14 @@ def test_openweatherclient_should_retrieve_report_when_ok() -> None:
 
 
 @pytest.mark.parametrize(
-    argnames="error_obj",
+    argnames="error_obj, expected_exception",
     argvalues=[
-        [],
-        {"cod": "400", "message": "Nothing to geocode"},
+        ([], LocationNotFoundException),
+        ({"cod": "400", "message": "Nothing to geocode"}, UpstreamErrorException),
     ],
 )
 def test_openweatherclient_should_raise_when_openweather_returns_nothing(
-    error_obj: Any,
+    error_obj: Any, expected_exception: type[Exception]
 ) -> None:
     """Check that an exception is raised when openweather returns an error or nothing."""
 
@@ -281,5 +326,243 @@ def test_openweatherclient_should_raise_when_openweather_returns_nothing(
 
     # When trying to get report
     # Then an exception should be raised
-    with pytest.raises(LocationNotFoundException):
+    with pytest.raises(expected_exception):
         client.get_umbrella_report(city="test")
+
+
+def test_openweatherclient_should_retrieve_report_from_coordinates() -> None:
+    """Check that the openweatherclient builds a report from coordinates
+    without calling the geocoding API."""
+
+    # Test setup
+    expected_location = Location(
+        city="Toulouse",
+        state="state",
+        country="FR",
+        longitude=1.4442469,
+        latitude=43.6044622,
+    )
+    api_responses: dict[str, list] = {
+        "data/2.5/weather": [
+            {
+                "coord": {
+                    "lon": expected_location.longitude,
+                    "lat": expected_location.latitude,
+                },
+                "weather": [{"id": 500}],
+                "sys": {"country": expected_location.country},
+                "name": expected_location.city,
+                "dt": 1_700_000_000,
+            },
+        ],
+    }
+
+    # Given a Openweather client
+    client = _create_mocked_client(api_responses=api_responses)
+
+    # When retrieving a report from coordinates
+    report = client.get_umbrella_report_at(
+        latitude=expected_location.latitude, longitude=expected_location.longitude
+    )
+
+    # Then the report should be the one expected
+    assert report == UmbrellaReport(
+        location=expected_location, weather=WeatherState.RAIN
+    )
+
+    # And it should carry the time at which Openweather calculated the weather
+    assert report.observed_at == 1_700_000_000.0
+
+
+def test_openweatherclient_should_reuse_nearby_cached_observation() -> None:
+    """Check that the openweatherclient reuses a nearby observation
+    instead of calling the weather API."""
+
+    # Test setup
+    cached_report = UmbrellaReport(
+        location=Location(city="Toulouse", latitude=43.6044622, longitude=1.4442469),
+        weather=WeatherState.CLEAR,
+    )
+    observation_cache = ObservationCache(radius_km=5.0)
+    observation_cache.add(cached_report)
+
+    # Given a Openweather client that has no API response available
+    client = _create_mocked_client(api_responses={})
+    client.observation_cache = observation_cache
+
+    # When retrieving a report close to a cached observation
+    report = client.get_umbrella_report_at(latitude=43.61, longitude=1.45)
+
+    # Then the cached observation should be returned
+    assert report is cached_report
+
+
+def test_openweatherclient_should_not_geocode_known_aliases() -> None:
+    """Check that equivalent spellings of a city are only geocoded once."""
+
+    # Test setup
+    weather_response = {"weather": [{"id": 500}]}
+    api_responses: dict[str, list] = {
+        "geo/1.0/direct": [
+            [{"name": "Paris", "country": "FR", "lat": 48.85, "lon": 2.35}],
+        ],
+        "data/2.5/weather": [weather_response, weather_response, weather_response],
+    }
+
+    # Given a Openweather client with an alias index
+    client = _create_mocked_client(api_responses=api_responses)
+    client.alias_index = AliasIndex()
+
+    # When retrieving reports for several spellings of the same city
+    reports = [
+        client.get_umbrella_report(city) for city in ("paris", " PARIS ", "Pâris")
+    ]
+
+    # Then the geocoding API should have been called once (no response left)
+    assert not api_responses["geo/1.0/direct"]
+
+    # And all the reports should be for the same location
+    assert all(report.location == reports[0].location for report in reports)
+
+
+def test_openweatherclient_should_send_canonical_query() -> None:
+    """Check that the geocoding query is cleaned before being sent."""
+
+    # Given a Openweather client that records its calls
+    class _RecordingClient(OpenweatherClient):
+        def __init__(self) -> None:
+            super().__init__(api_key="testapikey")
+            self.params: list[dict] = []
+
+        def _call_rest_api(self, endpoint: str, params: dict) -> Any:
+            self.params.append(params)
+            return []
+
+    client = _RecordingClient()
+
+    # When geocoding a badly spelled query
+    with pytest.raises(LocationNotFoundException):
+        client.get_umbrella_report("  paris ,  fr ")
+
+    # Then the query should have been cleaned
+    assert client.params == [{"q": "paris,FR"}]
+
+
+class _FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _create_client_with_stale_paris(
+    api_responses: dict[str, list]
+) -> OpenweatherClient:
+    clock = _FakeClock()
+    alias_index = AliasIndex(ttl=60.0, clock=clock)
+    alias_index.learn(
+        canonicalize_city_query("paris"),
+        Location(city="Paris", country="FR", latitude=48.85, longitude=2.35),
+    )
+    clock.now = 61.0
+
+    client = _create_mocked_client(api_responses=api_responses)
+    client.alias_index = alias_index
+    return client
+
+
+def test_openweatherclient_should_use_speculative_weather_when_city_did_not_move() -> (
+    None
+):
+    """Check that the weather fetched for stale coordinates is used once confirmed."""
+
+    # Test setup
+    metrics.reset()
+    api_responses: dict[str, list] = {
+        "geo/1.0/direct": [
+            [{"name": "Paris", "country": "FR", "lat": 48.85, "lon": 2.35}],
+        ],
+        "data/2.5/weather": [{"weather": [{"id": 500}]}],
+    }
+
+    # Given a Openweather client whose location of the city is stale
+    client = _create_client_with_stale_paris(api_responses)
+
+    # When retrieving a report for the city
+    report = client.get_umbrella_report("Paris")
+
+    # Then the location should have been revalidated
+    assert not api_responses["geo/1.0/direct"]
+
+    # And the speculative weather should have been used
+    assert report.weather == WeatherState.RAIN
+    assert metrics.counter("openweather.speculation.hits") == 1
+
+    # Test teardown
+    client.close()
+
+
+def test_openweatherclient_should_fetch_weather_again_when_city_moved() -> None:
+    """Check that the weather is fetched again when the location changed."""
+
+    # Test setup
+    metrics.reset()
+    api_responses: dict[str, list] = {
+        "geo/1.0/direct": [
+            [{"name": "Paris", "country": "FR", "lat": 48.86, "lon": 2.34}],
+        ],
+        "data/2.5/weather": [{"weather": [{"id": 500}]}, {"weather": [{"id": 800}]}],
+    }
+
+    # Given a Openweather client whose location of the city is stale
+    client = _create_client_with_stale_paris(api_responses)
+
+    # When retrieving a report for a city that moved
+    report = client.get_umbrella_report("Paris")
+
+    # Then the report should be for the revalidated location
+    assert report.location.latitude == 48.86
+    assert metrics.counter("openweather.speculation.misses") == 1
+
+    # Test teardown
+    client.close()
+
+
+def test_openweatherclient_should_retry_with_another_key_when_rejected() -> None:
+    """Check that a key rejected by Openweather is rotated out of the calls."""
+
+    # Test setup
+    def handle_request(request: httpx.Request) -> httpx.Response:
+        if request.url.params["appid"] == "ratelimitedkey":
+            return httpx.Response(status_code=429, json={"cod": 429})
+        return httpx.Response(status_code=200, json=[{"name": "Toulouse"}])
+
+    # Given a client with a pool of keys, one of them being rate limited
+    client = OpenweatherClient(
+        api_key=APIKeyPool(
+            keys=["ratelimitedkey", "validkey"], registry=MetricsRegistry()
+        ),
+        transport=httpx.MockTransport(handle_request),
+    )
+
+    # When calling the API several times
+    for _ in range(3):
+        response = client._call_rest_api(  # pylint: disable=protected-access
+            endpoint="geo/1.0/direct", params={"q": "Toulouse"}
+        )
+
+        # Then the calls should succeed with the valid key
+        assert response == [{"name": "Toulouse"}]
+
+    # When the valid key gets rejected too
+    client.api_keys.reject("validkey", status_code=401)
+
+    # Then the calls should fail as rate limited
+    with pytest.raises(APIKeysExhaustedException):
+        client._call_rest_api(  # pylint: disable=protected-access
+            endpoint="geo/1.0/direct", params={"q": "Toulouse"}
+        )
+
+    # Test teardown
+    client.close()
@@ -0,0 +1,170 @@
+"""Tests for the on-demand profiling of a worker."""
+import threading
+
+import httpx
+import pytest
+from fastapi.testclient import TestClient
+
+from myumbrella.app import app
+from myumbrella.profiling import (
+    ProfilerBusyException,
+    SamplingProfiler,
+    format_collapsed_stacks,
+    take_allocations_snapshot,
+)
+
+
+class _FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, duration: float) -> None:
+        """Advance the fake time."""
+        self.now += duration
+
+
+def _wait_for_stop(stop: threading.Event) -> None:
+    stop.wait()
+
+
+def test_samplingprofiler_should_count_collapsed_stacks() -> None:
+    """Check that the stacks of the other threads are sampled and categorized."""
+    # Test setup
+    stop = threading.Event()
+    thread = threading.Thread(target=_wait_for_stop, args=(stop,))
+    thread.start()
+
+    # Given a profiler with a fake clock
+    clock = _FakeClock()
+    profiler = SamplingProfiler(interval=0.25, clock=clock, sleep=clock.sleep)
+
+    # When profiling for a second
+    stacks = profiler.profile(seconds=1.0)
+
+    # Then a waiting thread should have been sampled at each interval
+    waiting_stacks = [stack for stack in stacks if "_wait_for_stop" in stack]
+    assert len(waiting_stacks) == 1
+    assert stacks[waiting_stacks[0]] == 4
+
+    # And its stack should be categorized as idle and collapsed from the outermost frame
+    frames = waiting_stacks[0].split(";")
+    assert frames[0] == "idle"
+    assert frames[1] == "threading:_bootstrap"
+    assert frames[-1] == "threading:wait"
+
+    # And the stacks should be formatted for flame graphs
+    assert f"{waiting_stacks[0]} 4\n" in format_collapsed_stacks(stacks)
+
+    # Test teardown
+    stop.set()
+    thread.join()
+
+
+def test_samplingprofiler_should_run_one_profile_at_a_time() -> None:
+    """Check that a profile cannot be started while another one runs."""
+
+    # Given a profiler whose sleep starts another profile
+    def sleep(_: float) -> None:
+        profiler.profile(seconds=1.0)
+
+    profiler = SamplingProfiler(sleep=sleep)
+
+    # When profiling
+    # Then the nested profile should be refused
+    with pytest.raises(ProfilerBusyException):
+        profiler.profile(seconds=1.0)
+
+
+def test_take_allocations_snapshot_should_return_top_lines() -> None:
+    """Check that the allocations snapshot returns the top lines of code."""
+    # Test setup
+    allocated: list[bytearray] = []
+
+    # Given allocations made while tracing
+    def allocate(_: float) -> None:
+        allocated.extend(bytearray(1024) for _ in range(100))
+
+    # When taking a snapshot
+    statistics = take_allocations_snapshot(top=3, sleep=allocate)
+
+    # Then the top lines should be returned, the allocating one first
+    assert len(statistics) <= 3
+    assert __file__ in statistics[0].location
+    assert statistics[0].size >= 100 * 1024
+
+
+class TestDebugRouter:
+    """Class used to aggregate the tests for the debug endpoints."""
+
+    _TOKEN = "testtoken"
+
+    def test_debug_views_should_not_exist_without_token(
+        self, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        """Check that the debug endpoints are disabled unless a token is set."""
+        # Given an app without debug token
+        monkeypatch.delenv("MYUMBRELLA_DEBUG_TOKEN", raising=False)
+        client = TestClient(app=app)
+
+        # When calling the profile endpoint
+        response = client.get("/debug/profile?seconds=0.01")
+
+        # Then it should not be found
+        assert response.status_code == httpx.codes.NOT_FOUND
+
+    def test_debug_views_should_require_token(
+        self, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        """Check that the debug endpoints reject wrong tokens."""
+        # Given an app with a debug token
+        monkeypatch.setenv("MYUMBRELLA_DEBUG_TOKEN", self._TOKEN)
+        client = TestClient(app=app)
+
+        # When calling the profile endpoint with a wrong token
+        response = client.get(
+            "/debug/profile?seconds=0.01", headers={"Authorization": "Bearer wrong"}
+        )
+
+        # Then it should be unauthorized
+        assert response.status_code == httpx.codes.UNAUTHORIZED
+
+    def test_profile_view_should_return_collapsed_stacks(
+        self, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        """Check that the profile endpoint returns collapsed stacks."""
+        # Given an app with a debug token
+        monkeypatch.setenv("MYUMBRELLA_DEBUG_TOKEN", self._TOKEN)
+        client = TestClient(app=app)
+
+        # When calling the profile endpoint
+        response = client.get(
+            "/debug/profile?seconds=0.05",
+            headers={"Authorization": f"Bearer {self._TOKEN}"},
+        )
+
+        # Then it should return "stack count" lines
+        assert response.status_code == httpx.codes.OK
+        lines = response.text.splitlines()
+        assert lines
+        assert all(line.rsplit(" ", 1)[1].isdigit() for line in lines)
+
+    def test_allocations_view_should_return_top_lines(
+        self, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        """Check that the allocations endpoint returns at most the top N lines."""
+        # Given an app with a debug token
+        monkeypatch.setenv("MYUMBRELLA_DEBUG_TOKEN", self._TOKEN)
+        client = TestClient(app=app)
+
+        # When calling the allocations endpoint
+        response = client.get(
+            "/debug/allocations?top=5&seconds=0.01",
+            headers={"Authorization": f"Bearer {self._TOKEN}"},
+        )
+
+        # Then it should return at most 5 lines
+        assert response.status_code == httpx.codes.OK
+        assert len(response.json()) <= 5
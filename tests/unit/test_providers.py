@@ -0,0 +1,584 @@
+"""Tests for the layers that can be stacked around a provider."""
+import threading
+import time
+
+import httpx
+import pytest
+
+from myumbrella.cache import NegativeCache, ObservationCache, ReportCache
+from myumbrella.core import (
+    CoordinatesUmbrellaReportProvider,
+    Location,
+    LocationNotFoundException,
+    UmbrellaReport,
+    UpstreamErrorException,
+    WeatherState,
+)
+from myumbrella.locations import AliasIndex
+from myumbrella.metrics import MetricsRegistry
+from myumbrella.openweather import OpenweatherClient
+from myumbrella.providers import (
+    CachingLayer,
+    CoalescingLayer,
+    MetricsLayer,
+    ObservationLayer,
+    RacingMode,
+    RacingProvider,
+    RateLimitExceededException,
+    RateLimitingLayer,
+    TokenBucket,
+    prepaid_calls,
+)
+
+
+class _CountingProvider:
+    def __init__(self, delay: float = 0.0) -> None:
+        self.calls: list[str] = []
+        self.delay = delay
+
+    def get_umbrella_report(self, city: str) -> UmbrellaReport:
+        """Build a report after an optional delay."""
+        self.calls.append(city)
+        time.sleep(self.delay)
+        return UmbrellaReport(location=Location(city=city), weather=WeatherState.RAIN)
+
+
+class _CoordinatesProvider(_CountingProvider):
+    def get_umbrella_report_at(
+        self, latitude: float, longitude: float
+    ) -> UmbrellaReport:
+        """Build a report for coordinates."""
+        self.calls.append(f"{latitude},{longitude}")
+        return UmbrellaReport(
+            location=Location(latitude=latitude, longitude=longitude),
+            weather=WeatherState.CLEAR,
+        )
+
+
+class _FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+    def sleep(self, duration: float) -> None:
+        """Advance the fake time."""
+        self.now += duration
+
+
+def test_cachinglayer_should_serve_equivalent_queries_from_cache() -> None:
+    """Check that the cache layer only calls the provider once per normalized city."""
+    # Given a provider wrapped by a cache layer
+    provider = _CountingProvider()
+    registry = MetricsRegistry()
+    layer = CachingLayer(provider=provider, cache=ReportCache(), registry=registry)
+
+    # When querying the same city several times
+    first = layer.get_umbrella_report(city="Toulouse")
+    second = layer.get_umbrella_report(city=" toulouse ")
+
+    # Then the provider should be called once
+    assert provider.calls == ["Toulouse"]
+    assert second is first
+
+    # And the hits and misses should be counted
+    assert registry.counter("cache.hits") == 1
+    assert registry.counter("cache.misses") == 1
+
+
+class _NotFoundProvider(_CountingProvider):
+    def get_umbrella_report(self, city: str) -> UmbrellaReport:
+        """Raise as if the city did not exist."""
+        self.calls.append(city)
+        raise LocationNotFoundException(f"Cannot find location '{city}'")
+
+
+def test_cachinglayer_should_cache_locations_not_found() -> None:
+    """Check that a location that is not found is not queried again for a while."""
+    # Given a provider that finds no location wrapped by a cache layer
+    provider = _NotFoundProvider()
+    clock = _FakeClock()
+    registry = MetricsRegistry()
+    layer = CachingLayer(
+        provider=provider,
+        registry=registry,
+        negative_cache=NegativeCache(ttl=60.0, clock=clock),
+    )
+
+    # When querying the same unknown city twice
+    for _ in range(2):
+        with pytest.raises(LocationNotFoundException, match="Toulose"):
+            layer.get_umbrella_report(city="Toulose")
+
+    # Then the provider should be called once
+    assert provider.calls == ["Toulose"]
+    assert registry.counter("cache.negative_hits") == 1
+
+    # And it should be called again once the miss expired
+    clock.now = 60.0
+    with pytest.raises(LocationNotFoundException):
+        layer.get_umbrella_report(city="Toulose")
+    assert provider.calls == ["Toulose", "Toulose"]
+
+
+def test_cachinglayer_should_call_upstream_once_for_a_newly_learned_city() -> None:
+    """Check that a city is served from cache once its alias has been learned."""
+    # Test setup
+    weather_calls: list[str] = []
+
+    def handle_request(request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("geo/1.0/direct"):
+            return httpx.Response(
+                status_code=200,
+                json=[
+                    {
+                        "name": "Paris",
+                        "state": "Ile-de-France",
+                        "country": "FR",
+                        "lat": 48.85,
+                        "lon": 2.35,
+                    }
+                ],
+            )
+        weather_calls.append(str(request.url))
+        return httpx.Response(status_code=200, json={"weather": [{"id": 800}]})
+
+    alias_index = AliasIndex()
+
+    # Given an Openweather client learning aliases wrapped by a cache layer
+    client = OpenweatherClient(
+        api_key="testapikey",
+        alias_index=alias_index,
+        transport=httpx.MockTransport(handle_request),
+    )
+    layer = CachingLayer(
+        provider=client, registry=MetricsRegistry(), alias_index=alias_index
+    )
+
+    # When requesting the same city twice
+    first = layer.get_umbrella_report(city="Paris")
+    second = layer.get_umbrella_report(city="Paris")
+
+    # Then the weather should have been fetched once
+    assert len(weather_calls) == 1
+    assert second == first
+
+    # Test teardown
+    client.close()
+
+
+def test_cachinglayer_should_not_cache_upstream_errors() -> None:
+    """Check that a failing upstream is retried instead of reporting a missing city."""
+    # Test setup
+    geocoding_responses = [
+        httpx.Response(status_code=500, json={"cod": 500, "message": "Internal error"}),
+        httpx.Response(
+            status_code=200,
+            json=[{"name": "Paris", "country": "FR", "lat": 48.85, "lon": 2.35}],
+        ),
+    ]
+
+    def handle_request(request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("geo/1.0/direct"):
+            return geocoding_responses.pop(0)
+        return httpx.Response(status_code=200, json={"weather": [{"id": 800}]})
+
+    alias_index = AliasIndex()
+
+    # Given an Openweather client wrapped by a cache layer
+    client = OpenweatherClient(
+        api_key="testapikey",
+        alias_index=alias_index,
+        transport=httpx.MockTransport(handle_request),
+    )
+    layer = CachingLayer(
+        provider=client, registry=MetricsRegistry(), alias_index=alias_index
+    )
+
+    # When the geocoding API fails once
+    # Then the error should be reported as an upstream error
+    with pytest.raises(UpstreamErrorException):
+        layer.get_umbrella_report(city="Paris")
+
+    # And the next request should reach the upstream again
+    assert layer.get_umbrella_report(city="Paris").location.city == "Paris"
+
+    # Test teardown
+    client.close()
+
+
+class _CountingAliasIndex(AliasIndex):
+    def __init__(self) -> None:
+        super().__init__()
+        self.computed_keys = 0
+
+    def cache_key(self, city: str) -> str:
+        """Count the computed keys."""
+        self.computed_keys += 1
+        return super().cache_key(city)
+
+
+def test_layers_should_compute_city_key_once() -> None:
+    """Check that the key of a city is only computed once through stacked layers."""
+    # Given a provider wrapped by the layers of the default pipeline
+    alias_index = _CountingAliasIndex()
+    registry = MetricsRegistry()
+    layer = CachingLayer(
+        provider=CoalescingLayer(
+            provider=RateLimitingLayer(
+                provider=MetricsLayer(provider=_CountingProvider(), registry=registry)
+            ),
+            registry=registry,
+            alias_index=alias_index,
+        ),
+        cache=ReportCache(),
+        registry=registry,
+        alias_index=alias_index,
+    )
+
+    # When querying a city
+    layer.get_umbrella_report(city="Toulouse")
+
+    # Then its key should have been computed once (and again once it may be learned)
+    assert alias_index.computed_keys == 2
+
+    # And only once when it is served from the cache
+    alias_index.computed_keys = 0
+    layer.get_umbrella_report(city="Toulouse")
+    assert alias_index.computed_keys == 1
+
+
+def test_coalescinglayer_should_share_concurrent_calls() -> None:
+    """Check that concurrent queries for the same city share one provider call."""
+    # Given a slow provider wrapped by a coalescing layer
+    provider = _CountingProvider(delay=0.2)
+    layer = CoalescingLayer(provider=provider, registry=MetricsRegistry())
+
+    # When querying the same city concurrently
+    reports: list[UmbrellaReport] = []
+    threads = [
+        threading.Thread(
+            target=lambda: reports.append(layer.get_umbrella_report(city="Toulouse"))
+        )
+        for _ in range(5)
+    ]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # Then the provider should be called once and all callers get the same report
+    assert provider.calls == ["Toulouse"]
+    assert len(reports) == 5
+    assert all(report is reports[0] for report in reports)
+
+
+def test_coalescinglayer_should_propagate_errors_to_all_callers() -> None:
+    """Check that an error of the shared call is raised, and not kept afterwards."""
+
+    # Given a failing provider wrapped by a coalescing layer
+    class _FailingProvider:
+        def get_umbrella_report(self, city: str) -> UmbrellaReport:
+            """Will fail"""
+            raise TimeoutError(city)
+
+    layer = CoalescingLayer(provider=_FailingProvider(), registry=MetricsRegistry())
+
+    # When querying a city twice
+    # Then the error should be raised each time
+    for _ in range(2):
+        with pytest.raises(TimeoutError):
+            layer.get_umbrella_report(city="Toulouse")
+
+
+def test_tokenbucket_should_wait_for_tokens() -> None:
+    """Check that the token bucket delays calls that exceed the burst."""
+    # Given an empty-ish token bucket
+    clock = _FakeClock()
+    bucket = TokenBucket(rate=2.0, capacity=1, clock=clock, sleep=clock.sleep)
+    bucket.acquire()
+
+    # When acquiring another token
+    bucket.acquire(max_wait=1.0)
+
+    # Then the call should have waited for the refill
+    assert clock.now == pytest.approx(0.5)
+
+
+def test_ratelimitinglayer_should_raise_when_wait_is_too_long() -> None:
+    """Check that the rate limiting layer fails fast instead of waiting too long."""
+    # Given a provider wrapped by a rate limiter that has no token left
+    clock = _FakeClock()
+    bucket = TokenBucket(rate=0.1, capacity=1, clock=clock, sleep=clock.sleep)
+    provider = _CountingProvider()
+    layer = RateLimitingLayer(provider=provider, bucket=bucket, max_wait=1.0)
+    layer.get_umbrella_report(city="Toulouse")
+
+    # When querying again right away
+    # Then the rate limit should be reported
+    with pytest.raises(RateLimitExceededException):
+        layer.get_umbrella_report(city="Paris")
+
+    # And the provider should not have been called
+    assert provider.calls == ["Toulouse"]
+
+
+def test_tokenbucket_should_take_the_tokens_available_at_once() -> None:
+    """Check that the token bucket only hands out the tokens it has right away."""
+    # Given a token bucket with 3 tokens
+    clock = _FakeClock()
+    bucket = TokenBucket(rate=1.0, capacity=3, clock=clock, sleep=clock.sleep)
+
+    # When taking more tokens than available, twice
+    # Then only the available tokens should be taken
+    assert bucket.take(5) == 3
+    assert bucket.take(5) == 0
+    assert clock.now == 0.0
+
+
+def test_ratelimitinglayer_should_let_prepaid_calls_through() -> None:
+    """Check that the calls whose tokens were already taken are not rate limited."""
+    # Given a provider wrapped by a rate limiter whose tokens have been taken
+    clock = _FakeClock()
+    bucket = TokenBucket(rate=0.1, capacity=1, clock=clock, sleep=clock.sleep)
+    provider = _CountingProvider()
+    layer = RateLimitingLayer(provider=provider, bucket=bucket, max_wait=1.0)
+    assert bucket.take(1) == 1
+
+    # When querying with prepaid calls
+    with prepaid_calls():
+        layer.get_umbrella_report(city="Toulouse")
+
+    # Then the provider should have been called right away
+    assert provider.calls == ["Toulouse"]
+    assert clock.now == 0.0
+
+    # And the other calls should still be rate limited
+    with pytest.raises(RateLimitExceededException):
+        layer.get_umbrella_report(city="Paris")
+
+
+def test_metricslayer_should_count_calls_and_errors() -> None:
+    """Check that the metrics layer measures the wrapped provider."""
+    # Given a provider wrapped by a metrics layer
+    registry = MetricsRegistry()
+    layer = MetricsLayer(provider=_CountingProvider(), registry=registry)
+
+    # When querying a city
+    layer.get_umbrella_report(city="Toulouse")
+
+    # Then the call should be counted and timed
+    assert registry.counter("provider._CountingProvider.calls") == 1
+    assert registry.counter("provider._CountingProvider.errors") == 0
+    assert registry.summary("provider._CountingProvider.latency").count == 1
+
+
+def test_observationlayer_should_only_rate_limit_upstream_calls() -> None:
+    """Check that reused observations neither take tokens nor count as provider calls."""
+    # Test setup
+    weather_calls: list[str] = []
+
+    def handle_request(request: httpx.Request) -> httpx.Response:
+        weather_calls.append(str(request.url))
+        return httpx.Response(status_code=200, json={"weather": [{"id": 800}]})
+
+    # Given an Openweather client reusing nearby observations behind a pipeline
+    client = OpenweatherClient(
+        api_key="testapikey",
+        observation_cache=ObservationCache(radius_km=5.0),
+        transport=httpx.MockTransport(handle_request),
+    )
+    registry = MetricsRegistry()
+    bucket = TokenBucket(rate=1.0, capacity=60, clock=lambda: 0.0)
+    layer = ObservationLayer(
+        provider=RateLimitingLayer(
+            provider=MetricsLayer(provider=client, registry=registry), bucket=bucket
+        ),
+        registry=registry,
+    )
+
+    # When requesting 20 points within the reuse radius
+    for index in range(20):
+        layer.get_umbrella_report_at(latitude=48.85 + index * 1e-3, longitude=2.35)
+
+    # Then only the upstream call should have been rate limited and counted
+    assert len(weather_calls) == 1
+    assert bucket.available() == 59.0
+    assert registry.counter("provider.OpenweatherClient.calls") == 1
+    assert registry.counter("nearby.hits") == 19
+
+    # Test teardown
+    client.close()
+
+
+def test_layers_should_only_expose_coordinates_when_supported() -> None:
+    """Check that layers forward coordinates queries only if the provider has them."""
+    # Given layers around providers that do or do not support coordinates
+    city_only = MetricsLayer(provider=_CountingProvider(), registry=MetricsRegistry())
+    coordinates_provider = _CoordinatesProvider()
+    with_coordinates = CachingLayer(
+        provider=coordinates_provider, registry=MetricsRegistry()
+    )
+
+    # When checking their capabilities
+    # Then only the second one should support coordinates
+    assert not isinstance(city_only, CoordinatesUmbrellaReportProvider)
+    assert isinstance(with_coordinates, CoordinatesUmbrellaReportProvider)
+
+    # And coordinates queries should go through the layer
+    with_coordinates.get_umbrella_report_at(latitude=1.0, longitude=2.0)
+    with_coordinates.get_umbrella_report_at(latitude=1.0, longitude=2.0)
+    assert coordinates_provider.calls == ["1.0,2.0"]
+
+
+class _FailingProvider:
+    def __init__(self) -> None:
+        self.calls = 0
+
+    def get_umbrella_report(self, city: str) -> UmbrellaReport:
+        """Fail like an unavailable upstream."""
+        self.calls += 1
+        raise ConnectionError("Upstream is down")
+
+
+def test_racingprovider_should_return_first_answer_in_race_mode() -> None:
+    """Check that the fastest provider wins the race."""
+    # Given a racing provider whose primary is slow
+    slow_primary = _CountingProvider(delay=0.5)
+    fast_secondary = _CountingProvider()
+    registry = MetricsRegistry()
+    provider = RacingProvider(
+        slow_primary, fast_secondary, mode=RacingMode.RACE, registry=registry
+    )
+
+    # When retrieving a report
+    start = time.perf_counter()
+    report = provider.get_umbrella_report("Toulouse")
+
+    # Then the secondary answer should be returned without waiting for the primary
+    assert report.location.city == "Toulouse"
+    assert time.perf_counter() - start < 0.4
+    assert registry.counter("racing.secondary.won") == 1
+
+    # And both providers should have been queried
+    assert slow_primary.calls == fast_secondary.calls == ["Toulouse"]
+
+    # Test teardown
+    provider.shutdown()
+
+
+def test_racingprovider_should_fall_back_after_deadline() -> None:
+    """Check that the secondary is only queried once the primary misses its deadline."""
+    # Given a racing provider in fallback mode
+    primary = _CountingProvider(delay=0.5)
+    secondary = _CountingProvider()
+    registry = MetricsRegistry()
+    provider = RacingProvider(primary, secondary, deadline=0.1, registry=registry)
+
+    # When the primary is too slow
+    report = provider.get_umbrella_report("Toulouse")
+
+    # Then the secondary answer should be returned
+    assert report.location.city == "Toulouse"
+    assert secondary.calls == ["Toulouse"]
+    assert registry.counter("racing.secondary.won") == 1
+
+    # Test teardown
+    provider.shutdown()
+
+
+def test_racingprovider_should_fall_back_on_failure_and_adapt_order() -> None:
+    """Check that a failing primary is bypassed, then tried after the secondary."""
+    # Given a racing provider whose primary fails
+    primary = _FailingProvider()
+    secondary = _CountingProvider()
+    provider = RacingProvider(primary, secondary, deadline=10.0)
+
+    # When retrieving reports
+    for _ in range(2):
+        report = provider.get_umbrella_report("Toulouse")
+        assert report.location.city == "Toulouse"
+
+    # Then the primary should only have been tried the first time
+    assert primary.calls == 1
+    assert secondary.calls == ["Toulouse", "Toulouse"]
+
+    # Test teardown
+    provider.shutdown()
+
+
+def test_racingprovider_should_try_unmeasured_providers_last() -> None:
+    """Check that a provider whose latency is unknown does not jump ahead."""
+    # Given a racing provider whose primary latency only is known
+    primary = _CountingProvider()
+    secondary = _CountingProvider()
+    provider = RacingProvider(primary, secondary, deadline=10.0)
+    provider.latencies["primary"].record(0.3)
+
+    # When retrieving a report
+    provider.get_umbrella_report("Toulouse")
+
+    # Then only the measured primary should have been queried
+    assert primary.calls == ["Toulouse"]
+    assert not secondary.calls
+
+    # Test teardown
+    provider.shutdown()
+
+
+def test_racingprovider_should_probe_other_providers() -> None:
+    """Check that the providers that are not chosen still get measured now and then."""
+    # Given a racing provider in fallback mode that probes every 3 calls
+    primary = _CountingProvider()
+    secondary = _CountingProvider()
+    registry = MetricsRegistry()
+    provider = RacingProvider(
+        primary, secondary, deadline=10.0, registry=registry, probe_every=3
+    )
+
+    # When retrieving reports
+    for _ in range(3):
+        provider.get_umbrella_report("Toulouse")
+
+    # Then the secondary should have been queried by the 3rd call only
+    assert len(primary.calls) == 3
+    assert secondary.calls == ["Toulouse"]
+    assert registry.counter("racing.secondary.calls") == 1
+
+    # Test teardown
+    provider.shutdown()
+
+
+def test_racingprovider_should_raise_when_all_providers_fail() -> None:
+    """Check that the error is propagated when no provider answers."""
+    # Given a racing provider whose providers all fail
+    provider = RacingProvider(_FailingProvider(), _FailingProvider())
+
+    # When retrieving a report
+    # Then the error should be propagated
+    with pytest.raises(ConnectionError):
+        provider.get_umbrella_report("Toulouse")
+
+    # Test teardown
+    provider.shutdown()
+
+
+def test_racingprovider_should_only_expose_coordinates_when_supported() -> None:
+    """Check that coordinates queries go to the providers supporting them."""
+    # Given racing providers with and without coordinates support
+    provider = RacingProvider(_CountingProvider(), _CoordinatesProvider())
+    city_only_provider = RacingProvider(_CountingProvider(), _CountingProvider())
+
+    # When checking their support of the coordinates
+    # Then only the first one should support them
+    assert isinstance(provider, CoordinatesUmbrellaReportProvider)
+    assert not isinstance(city_only_provider, CoordinatesUmbrellaReportProvider)
+
+    # And it should query the provider supporting them
+    report = provider.get_umbrella_report_at(latitude=43.6, longitude=1.44)
+    assert report.weather == WeatherState.CLEAR
+
+    # Test teardown
+    provider.shutdown()
+    city_only_provider.shutdown()
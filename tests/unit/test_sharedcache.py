@@ -0,0 +1,157 @@
+"""Tests for the report cache shared by the workers of a host."""
+import multiprocessing
+import pathlib
+import struct
+import uuid
+
+import pytest
+
+from myumbrella.cache import ReportCache
+from myumbrella.core import Location, UmbrellaReport, WeatherState
+from myumbrella.metrics import MetricsRegistry
+from myumbrella.sharedcache import SharedReportCache
+
+
+class _FakeClock:
+    def __init__(self) -> None:
+        self.now = 1_700_000_000.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+def _create_report(city: str) -> UmbrellaReport:
+    return UmbrellaReport(
+        location=Location(
+            city=city, state="Occitanie", country="FR", latitude=43.6, longitude=1.44
+        ),
+        weather=WeatherState.RAIN,
+        observed_at=1_699_999_900.0,
+    )
+
+
+def _create_shared_cache(
+    tmp_path: pathlib.Path, name: str, slots: int = 64, **kwargs: object
+) -> SharedReportCache:
+    return SharedReportCache(
+        name=name,
+        slots=slots,
+        lock_path=str(tmp_path / "shared.lock"),
+        **kwargs,  # type: ignore[arg-type]
+    )
+
+
+def _publish_from_other_process(name: str, lock_path: str) -> None:
+    cache = SharedReportCache(name=name, slots=64, lock_path=lock_path)
+    cache.set("toulouse", _create_report("Toulouse"), ttl=60.0)
+    cache.close()
+
+
+@pytest.fixture(name="segment_name")
+def fixture_segment_name() -> str:
+    """Return a unique segment name."""
+    return f"myumbrella-test-{uuid.uuid4().hex[:12]}"
+
+
+def test_sharedreportcache_should_share_reports_between_processes(
+    tmp_path: pathlib.Path, segment_name: str
+) -> None:
+    """Check that a report published by a worker is read by another one."""
+    # Given a worker attached to a shared segment
+    cache = _create_shared_cache(tmp_path, segment_name)
+
+    # When another worker process publishes a report
+    process = multiprocessing.get_context("fork").Process(
+        target=_publish_from_other_process,
+        args=(segment_name, str(tmp_path / "shared.lock")),
+    )
+    process.start()
+    process.join()
+
+    # Then the report should be read back as is
+    assert process.exitcode == 0
+    report = cache.get("toulouse")
+    assert report == _create_report("Toulouse")
+    assert report is not None and report.observed_at == 1_699_999_900.0
+
+    # And deleting it should remove it for all workers
+    cache.delete("toulouse")
+    assert cache.get("toulouse") is None
+
+    # Test teardown
+    cache.close()
+    cache.unlink()
+
+
+def test_sharedreportcache_should_expire_reports(
+    tmp_path: pathlib.Path, segment_name: str
+) -> None:
+    """Check that the reports are only served until their TTL."""
+    # Given a shared cache that contains a report
+    clock = _FakeClock()
+    cache = _create_shared_cache(tmp_path, segment_name, clock=clock)
+    cache.set("toulouse", _create_report("Toulouse"), ttl=60.0)
+
+    # When reading it before and after its TTL
+    # Then it should only be served before
+    assert cache.get("toulouse") is not None
+    clock.now += 60.0
+    assert cache.get("toulouse") is None
+
+    # Test teardown
+    cache.close()
+    cache.unlink()
+
+
+def test_sharedreportcache_should_not_serve_slots_being_written(
+    tmp_path: pathlib.Path, segment_name: str
+) -> None:
+    """Check that a slot whose sequence number is odd is not read."""
+    # Given a shared cache that contains a report
+    cache = _create_shared_cache(tmp_path, segment_name, slots=1)
+    cache.set("toulouse", _create_report("Toulouse"), ttl=60.0)
+
+    # When a writer is updating its slot
+    buffer = cache._memory.buf  # pylint: disable=protected-access
+    (sequence,) = struct.unpack_from("<I", buffer, 0)
+    struct.pack_into("<I", buffer, 0, sequence + 1)
+
+    # Then the report should not be read
+    assert cache.get("toulouse") is None
+
+    # And it should be read again once the update is over
+    struct.pack_into("<I", buffer, 0, sequence + 2)
+    assert cache.get("toulouse") is not None
+
+    # Test teardown
+    del buffer
+    cache.close()
+    cache.unlink()
+
+
+def test_reportcache_should_fall_back_to_local_entries_when_shared_is_full(
+    tmp_path: pathlib.Path, segment_name: str
+) -> None:
+    """Check that the reports that do not fit in the shared cache are kept locally."""
+    # Given a report cache backed by a shared cache of a single slot
+    registry = MetricsRegistry()
+    shared = _create_shared_cache(tmp_path, segment_name, slots=1, registry=registry)
+    cache = ReportCache(shared=shared)
+
+    # When storing two reports
+    cache.set("toulouse", _create_report("Toulouse"))
+    cache.set("paris", _create_report("Paris"))
+
+    # Then the first one should be shared and the second one kept locally
+    assert shared.get("toulouse") is not None
+    assert shared.get("paris") is None
+    assert len(cache) == 1
+    assert registry.counter("sharedcache.full") == 1
+
+    # And both should be served
+    assert cache.get("toulouse") == _create_report("Toulouse")
+    assert cache.get("paris") == _create_report("Paris")
+
+    # Test teardown
+    shared.close()
+    shared.unlink()
@@ -0,0 +1,76 @@
+"""Tests that protect the start-up time of the application."""
+import os
+import subprocess  # nosec B404
+import sys
+
+import pytest
+
+# Cumulative import time allowed for the entry point, i.e. ~70 ms measured with some
+# headroom, well under the ~365 ms of the eager imports (can be relaxed on slow CI boxes)
+_IMPORT_TIME_BUDGET_US = int(os.environ.get("MYUMBRELLA_IMPORT_BUDGET_US", "200000"))
+
+
+def _run_python(code: str, *options: str) -> subprocess.CompletedProcess:
+    return subprocess.run(  # nosec B603
+        [sys.executable, *options, "-c", code],
+        capture_output=True,
+        check=True,
+        text=True,
+    )
+
+
+def _get_cumulative_import_time_us(module: str) -> int:
+    result = _run_python(f"import {module}", "-X", "importtime")
+
+    # Lines look like "import time:  self [us] | cumulative | imported package"
+    for line in result.stderr.splitlines():
+        fields = [field.strip() for field in line.split("|")]
+        if len(fields) == 3 and fields[2] == module:
+            return int(fields[1])
+
+    raise AssertionError(f"No import time reported for '{module}'")
+
+
+@pytest.mark.parametrize(
+    argnames="module, lazy_modules",
+    argvalues=[
+        ("myumbrella", ["importlib.metadata", "fastapi", "httpx"]),
+        (
+            "myumbrella.main",
+            ["importlib.metadata", "fastapi", "pydantic", "httpx", "uvicorn"],
+        ),
+    ],
+)
+def test_import_should_not_load_heavy_modules(
+    module: str, lazy_modules: list[str]
+) -> None:
+    """Check that heavy modules are only loaded when they are first needed."""
+    # Given a fresh interpreter
+    # When importing a module of the package
+    result = _run_python(
+        f"import sys, {module}; print(*sys.modules, sep=chr(10))",
+    )
+
+    # Then the heavy modules should not be loaded yet
+    loaded_modules = set(result.stdout.splitlines())
+    assert loaded_modules.isdisjoint(lazy_modules)
+
+
+def test_main_import_time_should_stay_within_budget() -> None:
+    """Check that importing the entry point stays under the import time budget."""
+    # Given a fresh interpreter
+    # When measuring the time needed to import the entry point
+    import_time_us = _get_cumulative_import_time_us("myumbrella.main")
+
+    # Then it should be within budget
+    assert import_time_us < _IMPORT_TIME_BUDGET_US
+
+
+def test_version_should_be_resolved_lazily() -> None:
+    """Check that the version is still available as a package attribute."""
+    # Given a fresh interpreter
+    # When accessing the version
+    result = _run_python("import myumbrella; print(myumbrella.__version__)")
+
+    # Then a version should be returned
+    assert result.stdout.strip()
@@ -0,0 +1,264 @@
+"""Tests for the transport used to reach the Openweather API."""
+import json
+import shutil
+import ssl
+import subprocess  # nosec B404
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from typing import Iterator
+
+import pytest
+
+from myumbrella.openweather import OpenweatherClient
+from myumbrella.transport import (
+    CachingResolver,
+    OpenweatherTransport,
+    is_http2_available,
+)
+
+_STUB_HOST = "openweather.test"
+
+
+class _FakeClock:
+    def __init__(self) -> None:
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+class _CountingResolve:
+    def __init__(self, address: str = "127.0.0.1") -> None:
+        self.address = address
+        self.calls = 0
+        self.fail = False
+
+    def __call__(self, host: str, port: int) -> str:
+        self.calls += 1
+        if self.fail:
+            raise OSError(f"Cannot resolve {host}")
+        return self.address
+
+
+class _StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    connections: list[tuple[str, int]] = []
+    paths: list[str] = []
+
+    def setup(self) -> None:
+        super().setup()
+        self.connections.append(self.client_address)
+
+    def _reply(self, with_body: bool) -> None:
+        body = json.dumps([{"name": "Toulouse"}]).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        if with_body:
+            self.wfile.write(body)
+
+    def do_GET(self) -> None:  # pylint: disable=invalid-name
+        """Reply to the API calls."""
+        self.paths.append(self.path)
+        self._reply(with_body=True)
+
+    def do_HEAD(self) -> None:  # pylint: disable=invalid-name
+        """Reply to the warm-up calls."""
+        self._reply(with_body=False)
+
+    def log_message(  # pylint: disable=redefined-builtin
+        self, format: str, *args: object
+    ) -> None:
+        """Keep the test output quiet."""
+
+
+@pytest.fixture(name="tls_stub")
+def fixture_tls_stub(tmp_path: Path) -> Iterator[tuple[int, Path]]:
+    """Serve a local TLS stub of the Openweather API with a certificate for its host."""
+    openssl = shutil.which("openssl")
+    if openssl is None:
+        pytest.skip("openssl is needed to create the stub certificate")
+
+    cert_path = tmp_path / "cert.pem"
+    key_path = tmp_path / "key.pem"
+    subprocess.run(  # nosec B603
+        [
+            openssl,
+            "req",
+            "-x509",
+            "-newkey",
+            "rsa:2048",
+            "-nodes",
+            "-days",
+            "1",
+            "-subj",
+            f"/CN={_STUB_HOST}",
+            "-addext",
+            f"subjectAltName=DNS:{_STUB_HOST}",
+            "-keyout",
+            str(key_path),
+            "-out",
+            str(cert_path),
+        ],
+        capture_output=True,
+        check=True,
+    )
+
+    _StubHandler.connections = []
+    _StubHandler.paths = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _StubHandler)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(certfile=cert_path, keyfile=key_path)
+    server.socket = context.wrap_socket(server.socket, server_side=True)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+
+    yield server.server_address[1], cert_path
+
+    server.shutdown()
+    server.server_close()
+
+
+def test_cachingresolver_should_cache_addresses_for_ttl() -> None:
+    """Check that the resolver only resolves again once the TTL expired."""
+    # Given a caching resolver
+    clock = _FakeClock()
+    resolve = _CountingResolve()
+    resolver = CachingResolver(ttl=60.0, resolve=resolve, clock=clock)
+
+    # When resolving the same host several times within the TTL
+    for _ in range(3):
+        assert resolver.resolve(_STUB_HOST, 443) == "127.0.0.1"
+
+    # Then the host should be resolved once
+    assert resolve.calls == 1
+
+    # When the TTL expired
+    clock.now = 61.0
+    resolver.resolve(_STUB_HOST, 443)
+
+    # Then the host should be resolved again
+    assert resolve.calls == 2
+
+
+def test_cachingresolver_should_use_stale_address_on_failure() -> None:
+    """Check that a stale address is used when the resolution fails."""
+    # Given a resolver that has a stale address
+    clock = _FakeClock()
+    resolve = _CountingResolve()
+    resolver = CachingResolver(ttl=60.0, resolve=resolve, clock=clock)
+    resolver.resolve(_STUB_HOST, 443)
+    clock.now = 61.0
+
+    # When the resolution fails
+    resolve.fail = True
+
+    # Then the stale address should be returned
+    assert resolver.resolve(_STUB_HOST, 443) == "127.0.0.1"
+
+    # And unknown hosts should still fail
+    with pytest.raises(OSError):
+        resolver.resolve("unknown.test", 443)
+
+
+def test_openweatherclient_should_reuse_warmed_up_connection(
+    tls_stub: tuple[int, Path]
+) -> None:
+    """Check that the client opens its connection at warm-up and then reuses it."""
+    # Test setup
+    port, cert_path = tls_stub
+    resolve = _CountingResolve()
+    transport = OpenweatherTransport(
+        resolver=CachingResolver(resolve=resolve), http2=False, verify=str(cert_path)
+    )
+
+    # Given a client that targets the TLS stub
+    client = OpenweatherClient(
+        api_key="testapikey",
+        openweather_host=f"https://{_STUB_HOST}:{port}",
+        transport=transport,
+    )
+
+    # When warming up the client
+    client.warm_up()
+
+    # Then a connection should be opened before any API call
+    assert len(_StubHandler.connections) == 1
+    assert not _StubHandler.paths
+
+    # When calling the API several times
+    for _ in range(5):
+        response = client._call_rest_api(  # pylint: disable=protected-access
+            endpoint="geo/1.0/direct", params={"q": "Toulouse"}
+        )
+        assert response == [{"name": "Toulouse"}]
+
+    # Then the warmed-up connection should be reused
+    assert len(_StubHandler.connections) == 1
+    assert len(_StubHandler.paths) == 5
+
+    # And the host should have been resolved only once
+    assert resolve.calls == 1
+
+    # Test teardown
+    client.close()
+
+
+@pytest.mark.parametrize(
+    argnames="http2, expected_max_connections", argvalues=[(True, 4), (False, 100)]
+)
+def test_openweathertransport_should_size_pool_by_http_version(
+    http2: bool, expected_max_connections: int
+) -> None:
+    """Check that HTTP/1.1, which sends one call per connection, gets a larger pool."""
+    # Given a transport with or without HTTP/2
+    transport = OpenweatherTransport(http2=http2)
+
+    # When looking at its connection pool
+    pool = transport._pool  # pylint: disable=protected-access
+
+    # Then it should allow enough connections for the concurrent calls
+    assert pool._max_connections == expected_max_connections
+
+    # Test teardown
+    transport.close()
+
+
+def test_openweathertransport_should_use_http2_by_default() -> None:
+    """Check that the declared HTTP/2 support (httpx[http2]) is used by default."""
+    # Given the installed dependencies
+    assert is_http2_available()
+
+    # When creating a transport without specifying the HTTP version
+    transport = OpenweatherTransport()
+
+    # Then it should use HTTP/2 over a few connections
+    assert transport.http2
+    assert transport._pool._max_connections == 4  # pylint: disable=protected-access
+
+    # Test teardown
+    transport.close()
+
+
+def test_openweatherclient_should_start_keepalive_once() -> None:
+    """Check that starting the keep-alive twice does not start a second thread."""
+    # Given a client
+    client = OpenweatherClient(api_key="testapikey")
+
+    # When starting its keep-alive twice
+    client.start_keepalive(interval=3600.0)
+    client.start_keepalive(interval=3600.0)
+
+    # Then a single keep-alive thread should run
+    threads = [
+        thread
+        for thread in threading.enumerate()
+        if thread.name == "openweather-keepalive"
+    ]
+    assert len(threads) == 1
+
+    # Test teardown
+    client.close()
+    threads[0].join()